@@ -1,17 +1,28 @@
+import time
+_import_start = time.perf_counter()
+
 import os
 import base64
 import numpy as np
-import cv2
-import tensorflow as tf
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
-from PIL import Image
-import io
+import json
+import threading
+from itertools import islice
 from config.config import Config
-from data.data_preprocessing import DataPreprocessor
-from utils.losses import contrastive_loss
+from serving.inference import load_inference_model, model_version, preload_artifact
+from serving.embedding_cache import EmbeddingCache
+from serving.embedding_store import EmbeddingStore
+from serving.embedding_index import EmbeddingIndex
+from serving.batching import MicroBatcher
+from serving.bulk import BulkInputError, iter_pairs, pairs_per_chunk
+from serving.jobs import TrainingJobManager
+from serving.metrics import MetricsRegistry, CONTENT_TYPE as METRICS_CONTENT_TYPE
 import logging
 
+# TensorFlow, OpenCV, PIL and scikit-learn are imported where they are first needed
+startup_timings = {'imports': time.perf_counter() - _import_start}
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -21,88 +32,574 @@ CORS(app)  # Enable CORS for React frontend
 
 # Global variables for model and config
 model = None
+inference_model = None
+embedding_store = None
+embedding_index = None
+embedding_cache = None
+pair_batcher = None
+embed_batcher = None
+training_jobs = None
 config = None
 preprocessor = None
+decision_threshold = 0.5
+model_status = 'not_loaded'  # 'loading', 'ready', 'missing' or 'failed'
+model_error = None
+model_lock = threading.Lock()
+index_lock = threading.Lock()
+index_rebuilding = False
+
+# Instrumentation exposed on /api/metrics
+metrics = MetricsRegistry()
+REQUESTS = metrics.counter('signet_requests_total', 'HTTP requests by endpoint and status', ('endpoint', 'method', 'status'))
+ERRORS = metrics.counter('signet_errors_total', 'Requests answered with a 4xx or 5xx status', ('endpoint', 'status'))
+REQUEST_SECONDS = metrics.histogram('signet_request_seconds', 'Request latency until the response is built', ('endpoint',))
+STAGE_SECONDS = metrics.histogram('signet_stage_seconds', 'Time spent in each verification stage', ('stage',))
+IMAGE_BYTES = metrics.histogram('signet_image_bytes', 'Size of uploaded encoded images', buckets=(
+    1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7, 5e7))
+IMAGE_PIXELS = metrics.histogram('signet_image_pixels', 'Pixel count of decoded uploaded images', buckets=(
+    1e4, 5e4, 1e5, 5e5, 1e6, 2e6, 4e6, 8e6, 1.2e7, 2.5e7, 5e7))
+MODEL_LOAD_SECONDS = metrics.gauge('signet_model_load_seconds', 'Time to load, validate and warm up the serving model')
+STARTUP_SECONDS = metrics.gauge('signet_startup_seconds', 'Time spent in each startup phase', ('phase',))
+MODEL_INFO = metrics.gauge('signet_model_info', 'Currently served model version', ('version', 'type'))
+
+def _predict_pairs_batch(images_a, images_b):
+    return inference_model.predict_pairs(images_a, images_b)
+
+def _embed_batch(images):
+    return inference_model.embed(images)
+
+def start_batchers():
+    """Start the micro-batching workers that group concurrent requests into one forward pass"""
+    global pair_batcher, embed_batcher
+    if not config.MICRO_BATCHING or pair_batcher is not None:
+        return
+    pair_batcher = MicroBatcher(
+        _predict_pairs_batch,
+        max_batch_size=config.MICRO_BATCH_MAX_SIZE,
+        max_wait_ms=config.MICRO_BATCH_MAX_WAIT_MS,
+        name='pair_batcher'
+    )
+    embed_batcher = MicroBatcher(
+        _embed_batch,
+        max_batch_size=config.MICRO_BATCH_MAX_SIZE,
+        max_wait_ms=config.MICRO_BATCH_MAX_WAIT_MS,
+        name='embed_batcher'
+    )
 
-def load_model():
-    """Load the trained Siamese model"""
-    global model, config, preprocessor
+def _build_embedding_index():
+    revision, reference_ids, writer_ids, embeddings = embedding_store.snapshot()
+    use_ivf = config.IDENTIFY_INDEX == 'ivf' and len(reference_ids) >= config.IDENTIFY_IVF_MIN_SIZE
+    return EmbeddingIndex(
+        embeddings,
+        reference_ids,
+        writer_ids,
+        revision=revision,
+        index_type='ivf' if use_ivf else 'exact',
+        storage_dtype=config.IDENTIFY_STORAGE_DTYPE,
+        n_lists=config.IDENTIFY_IVF_LISTS,
+        n_probe=config.IDENTIFY_IVF_PROBES
+    )
+
+def _install_embedding_index(index):
+    """Keep whichever index reflects the newer store revision"""
+    global embedding_index
+    with index_lock:
+        if embedding_index is None or embedding_index.revision < index.revision:
+            embedding_index = index
+        return embedding_index
+
+def _rebuild_embedding_index():
+    global index_rebuilding
     try:
-        config = Config()
-        preprocessor = DataPreprocessor(config)
-        
-        if os.path.exists(config.MODEL_SAVE_PATH):
-            model = tf.keras.models.load_model(
-                config.MODEL_SAVE_PATH, 
-                custom_objects={'contrastive_loss': contrastive_loss}
-            )
-            logger.info("Model loaded successfully")
+        _install_embedding_index(_build_embedding_index())
+    except Exception as e:
+        logger.error(f"Rebuilding the embedding index failed: {str(e)}")
+    finally:
+        with index_lock:
+            index_rebuilding = False
+
+def get_embedding_index():
+    """Search index over the enrolled embeddings, rebuilt whenever the store has changed.
+    
+    An exact index is only a copy of the embeddings and is rebuilt right away.
+    Re-clustering an IVF index takes longer, so the previous one keeps serving
+    while a background thread rebuilds it; references enrolled meanwhile become
+    searchable when it finishes.
+    """
+    global index_rebuilding
+    revision = embedding_store.revision
+    with index_lock:
+        current = embedding_index
+        if current is not None and current.revision == revision:
+            return current
+        if current is not None and current.index_type == 'ivf':
+            if not index_rebuilding:
+                index_rebuilding = True
+                threading.Thread(target=_rebuild_embedding_index, name='index-rebuild', daemon=True).start()
+            return current
+    return _install_embedding_index(_build_embedding_index())
+
+def rank_references(embedding, current, top_k):
+    """Retrieve the enrolled references nearest to a query embedding and re-score them with the head.
+    
+    Candidates are re-scored from the store's float32 embeddings, so scores match
+    /api/verify whatever ``Config.IDENTIFY_STORAGE_DTYPE`` the index uses;
+    references removed since the index was built are dropped. Returns the index
+    and the ``top_k`` matches, best first.
+    """
+    index = get_embedding_index()
+    rows, _, distances = index.search(embedding, max(top_k, config.IDENTIFY_RERANK_CANDIDATES))
+    distance_of = {index.reference_ids[row]: float(distance) for row, distance in zip(rows, distances)}
+    reference_ids, writer_ids, embeddings = embedding_store.get_many([index.reference_ids[row] for row in rows])
+    if not reference_ids:
+        return index, []
+    scores = current.score_embeddings(embeddings, embedding[np.newaxis])
+    return index, [{
+        'reference_id': reference_ids[i],
+        'writer_id': writer_ids[i],
+        'similarity_score': float(scores[i]),
+        'distance': distance_of[reference_ids[i]]
+    } for i in np.argsort(-scores)[:top_k]]
+
+def parse_top_k(data, default=5):
+    """``top_k`` of an identify request, or None unless it is a positive integer"""
+    top_k = data.get('top_k', default)
+    if isinstance(top_k, str) and top_k.strip().isdigit():
+        top_k = int(top_k)
+    if isinstance(top_k, bool) or not isinstance(top_k, int) or top_k < 1:
+        return None
+    return top_k
+
+def predict_pair(img1, img2):
+    """Similarity score of one preprocessed pair"""
+    if pair_batcher is not None:
+        return float(pair_batcher(img1, img2))
+    return float(inference_model.predict_pairs(img1[np.newaxis], img2[np.newaxis])[0])
+
+def embed_image(image):
+    """Base-tower embedding of one preprocessed image"""
+    if embed_batcher is not None:
+        return embed_batcher(image)
+    return inference_model.embed(image[np.newaxis])[0]
+
+class _UnreadableImage(Exception):
+    pass
+
+def embed_upload(image_data, current):
+    """Base-tower embedding of a base64 upload, or None if it cannot be processed.
+    
+    Goes through the content-hash embedding cache when it is enabled, so a
+    re-submitted image is neither preprocessed nor embedded again.
+    """
+    try:
+        image_bytes = decode_upload(image_data)
+    except ValueError:
+        return None
+    
+    def compute():
+        image = preprocess_image(image_bytes, is_base64=False)
+        if image is None:
+            raise _UnreadableImage()
+        with STAGE_SECONDS.time(stage='embed'):
+            return embed_image(image)
+    
+    try:
+        if embedding_cache is None:
+            return compute()
+        return embedding_cache.get_or_compute(image_bytes, current.version, compute)
+    except _UnreadableImage:
+        return None
+
+def threshold_for(candidate):
+    """Configured decision threshold, else the EER threshold evaluate.py found for this model, else 0.5"""
+    if config.DECISION_THRESHOLD is not None:
+        return config.DECISION_THRESHOLD
+    from evaluate import load_evaluation
+    report = load_evaluation(config, model_version=candidate.version)
+    if report is None:
+        logger.warning(f"No evaluation for model version {candidate.version}; using threshold 0.5")
+        return 0.5
+    return report['threshold']
+
+def install_model(model_path, timings=None):
+    """Load, validate and warm up a model, then atomically swap it in.
+    
+    Requests already holding a reference to the previous model finish on it.
+    ``timings`` receives the duration of each phase when given.
+    """
+    global model, inference_model, model_status, model_error, decision_threshold
+    timings = {} if timings is None else timings
+    start = time.perf_counter()
+    from utils.losses import contrastive_loss
+    candidate = load_inference_model(
+        model_path, 
+        custom_objects={'contrastive_loss': contrastive_loss},
+        jit_compile=config.SERVING_XLA,
+        batch_buckets=config.SERVING_BATCH_BUCKETS
+    )
+    
+    timings['model_load'] = time.perf_counter() - start
+    
+    # Validate and warm up before any request can reach the new model
+    phase_start = time.perf_counter()
+    probe = np.random.RandomState(0).rand(2, *config.INPUT_SHAPE).astype(np.float32)
+    scores = candidate.predict_pairs(probe, probe[::-1])
+    if scores.shape != (2,) or not np.all(np.isfinite(scores)) or np.any((scores < 0) | (scores > 1)):
+        raise ValueError(f'Model at {model_path} produced invalid scores: {scores}')
+    timings['model_validate'] = time.perf_counter() - phase_start
+    phase_start = time.perf_counter()
+    candidate.warmup(config.SERVING_BATCH_BUCKETS, config.INPUT_SHAPE)
+    timings['model_warmup'] = time.perf_counter() - phase_start
+    threshold = threshold_for(candidate)
+    
+    with model_lock:
+        embedding_store.refresh(candidate)
+        if embedding_cache is not None:
+            embedding_cache.invalidate()
+        model, inference_model = candidate.model, candidate
+        decision_threshold = threshold
+        model_status, model_error = 'ready', None
+    start_batchers()
+    
+    MODEL_LOAD_SECONDS.set(time.perf_counter() - start)
+    MODEL_INFO.clear()
+    MODEL_INFO.set(1, version=candidate.version, type=type(candidate).__name__)
+    return candidate
+
+def serving_model_path():
+    """Artifact to serve: an exported SavedModel/TFLite directory or the trained h5"""
+    return config.SERVING_MODEL_PATH or config.MODEL_SAVE_PATH
+
+def publish_trained_model(model_path):
+    """Install a model produced by a training job and make it the one loaded at startup.
+    
+    The other worker processes pick the published file up through ``watch_model``.
+    When an exported artifact is served (``Config.SERVING_MODEL_PATH``) the h5 is
+    only published; it is served once it has been exported again.
+    """
+    if serving_model_path() == config.MODEL_SAVE_PATH:
+        install_model(model_path)
+    os.replace(model_path, config.MODEL_SAVE_PATH)
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+def watch_model(interval):
+    """Install the serving model again whenever another process publishes a new version of it.
+    
+    Training jobs (in whichever worker started them), onboard.py and manual
+    deployments all replace the file at ``serving_model_path()``; polling its
+    stat is cheap, and the content hash decides whether it really changed.
+    """
+    path = serving_model_path()
+    last = None  # The first poll compares versions, in case a new model was published while this one loaded
+    while True:
+        time.sleep(interval)
+        signature = _file_signature(path)
+        if signature is None or signature == last:
+            continue
+        last = signature
+        try:
+            version = model_version(path)
+            current = inference_model
+            if current is not None and current.version == version:
+                continue
+            logger.info(f"Serving model at {path} changed to version {version}; installing it")
+            install_model(path)
+        except Exception as e:
+            logger.error(f"Could not install the new model at {path}: {str(e)}")
+
+def preload():
+    """Import the heavy dependencies once in the master of a pre-forking server.
+    
+    Importing TensorFlow is fork-safe as long as no op has run yet, so workers
+    inherit the imported modules copy-on-write and only load the model
+    themselves. TFLite exports are read into memory here and shared as well.
+    """
+    global config
+    start = time.perf_counter()
+    import tensorflow  # noqa: F401
+    from PIL import Image  # noqa: F401
+    import data.image_preprocessing  # noqa: F401  (OpenCV)
+    import models.siamese  # noqa: F401
+    import utils.losses  # noqa: F401
+    startup_timings['preload_imports'] = time.perf_counter() - start
+    
+    config = Config()
+    if preload_artifact(serving_model_path()):
+        logger.info(f"Preloaded {serving_model_path()} for the workers")
+
+def _load_serving_model():
+    """Load the serving model and log how long each startup phase took"""
+    global model, inference_model, model_status, model_error
+    model_path = serving_model_path()
+    try:
+        if os.path.exists(model_path):
+            start = time.perf_counter()
+            import tensorflow  # noqa: F401
+            startup_timings['tensorflow_import'] = time.perf_counter() - start
+            install_model(model_path, timings=startup_timings)
+            logger.info(f"Model loaded successfully from {model_path}")
         else:
-            logger.warning(f"Model file not found at {config.MODEL_SAVE_PATH}")
-            model = None
+            logger.warning(f"Model file not found at {model_path}")
+            model_status = 'missing'
     except Exception as e:
         logger.error(f"Error loading model: {str(e)}")
         model = None
+        inference_model = None
+        model_status, model_error = 'failed', str(e)
+    
+    if config.MODEL_WATCH_INTERVAL_S:
+        threading.Thread(target=watch_model, args=(config.MODEL_WATCH_INTERVAL_S,), name='model-watcher',
+                         daemon=True).start()
+    
+    for phase, seconds in startup_timings.items():
+        STARTUP_SECONDS.set(seconds, phase=phase)
+    breakdown = ', '.join(f'{phase} {seconds:.2f}s' for phase, seconds in startup_timings.items())
+    logger.info(f"Startup time: {breakdown} (total {sum(startup_timings.values()):.2f}s)")
+
+def load_model(background=False):
+    """Set up the config and stores, then load the trained Siamese model.
+    
+    With ``background`` the model loads in a separate thread, so the server can
+    answer /api/health immediately; /api/ready reports when it can serve.
+    """
+    global embedding_store, embedding_cache, training_jobs, config, preprocessor, model_status, model_error
+    try:
+        start = time.perf_counter()
+        config = Config()
+        from data.data_preprocessing import DataPreprocessor
+        preprocessor = DataPreprocessor(config)
+        embedding_store = EmbeddingStore(config.EMBEDDING_STORE_PATH)
+        if config.EMBEDDING_CACHE_MB:
+            embedding_cache = EmbeddingCache(int(config.EMBEDDING_CACHE_MB * 2**20))
+        training_jobs = TrainingJobManager(config, on_model_ready=publish_trained_model)
+        startup_timings['setup'] = time.perf_counter() - start
+    except Exception as e:
+        logger.error(f"Error loading model: {str(e)}")
+        model_status, model_error = 'failed', str(e)
+        return
+    
+    model_status = 'loading'
+    if background:
+        threading.Thread(target=_load_serving_model, name='model-loader', daemon=True).start()
+    else:
+        _load_serving_model()
+
+def model_unavailable():
+    """Error response for requests that arrive while no model is being served"""
+    if model_status == 'loading':
+        return jsonify({
+            'error': 'Model is still loading. Please retry shortly.',
+            'success': False
+        }), 503
+    return jsonify({
+        'error': 'Model not loaded. Please train the model first.',
+        'success': False
+    }), 500
+
+def decode_upload(image_data):
+    """Raw image bytes of a base64 upload (optionally a data URL)"""
+    with STAGE_SECONDS.time(stage='base64_decode'):
+        image_data = image_data.split(',')[1] if ',' in image_data else image_data
+        return base64.b64decode(image_data)
 
 def preprocess_image(image_data, is_base64=True):
-    """Preprocess image for model prediction"""
+    """Preprocess image for model prediction, with the same pipeline as training"""
     try:
         if is_base64:
-            # Decode base64 image
-            image_data = image_data.split(',')[1] if ',' in image_data else image_data
-            image_bytes = base64.b64decode(image_data)
-            image = Image.open(io.BytesIO(image_bytes))
+            image_bytes = decode_upload(image_data)
         else:
-            image = Image.open(image_data)
-        
-        # Convert to numpy array
-        image_array = np.array(image)
-        
-        # Convert to grayscale if needed
-        if len(image_array.shape) == 3:
-            image_array = cv2.cvtColor(image_array, cv2.COLOR_RGB2GRAY)
+            image_bytes = image_data.read() if hasattr(image_data, 'read') else image_data
+        IMAGE_BYTES.observe(len(image_bytes))
         
-        # Resize to model input shape
-        image_resized = cv2.resize(image_array, config.IMAGE_SHAPE)
+        from data.image_preprocessing import decode_grayscale, finish_batch, resize_grayscale
         
-        # Normalize pixel values
-        image_normalized = image_resized.astype(np.float32) / 255.0
+        # Decode straight into grayscale; large JPEGs at reduced resolution
+        with STAGE_SECONDS.time(stage='image_decode'):
+            image = decode_grayscale(image_bytes, config.IMAGE_SHAPE, config.PREPROCESS_DECODE_OVERSAMPLING)
+        if image is None:
+            raise ValueError("unsupported or corrupt image data")
+        IMAGE_PIXELS.observe(image.size)
         
-        # Add channel dimension
-        image_final = np.expand_dims(image_normalized, axis=-1)
+        # Crop to the ink if configured, resize to model input shape
+        with STAGE_SECONDS.time(stage='resize'):
+            image = resize_grayscale(image, config.IMAGE_SHAPE, config.PREPROCESS_CROP_TO_INK)
         
-        return image_final
+        # Invert, normalize pixel values and add channel dimension
+        with STAGE_SECONDS.time(stage='normalize'):
+            return finish_batch(image[np.newaxis])[0]
     except Exception as e:
         logger.error(f"Error preprocessing image: {str(e)}")
         return None
 
+def preprocess_image_batch(images):
+    """Preprocess encoded images (bytes) or raw grayscale arrays into one float32 batch.
+    
+    Returns the batch and a boolean mask of the entries that could be decoded.
+    """
+    from data.image_preprocessing import preprocess_batch
+    images, ok = preprocess_batch(images, config.IMAGE_SHAPE, crop=config.PREPROCESS_CROP_TO_INK,
+                                  oversampling=config.PREPROCESS_DECODE_OVERSAMPLING)
+    if not ok.all():
+        logger.error(f"Could not preprocess images {np.flatnonzero(~ok).tolist()} of batch")
+    return images, ok
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    if endpoint != '/api/metrics' and 'request_start' in g:
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
+    REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    if response.status_code >= 400:
+        ERRORS.inc(endpoint=endpoint, status=response.status_code)
+    return response
+
+def _batcher_metrics():
+    families = []
+    batchers = [b for b in (pair_batcher, embed_batcher) if b is not None]
+    if batchers:
+        stats = [b.stats() for b in batchers]
+        families.append(('signet_batcher_queue_depth', 'Requests waiting in a micro-batcher', 'gauge',
+                         [({'batcher': st['name']}, st['queue_depth']) for st in stats]))
+        families.append(('signet_batcher_batches_total', 'Forward passes run by a micro-batcher', 'counter',
+                         [({'batcher': st['name']}, st['batches']) for st in stats]))
+        families.append(('signet_batcher_requests_total', 'Examples processed by a micro-batcher', 'counter',
+                         [({'batcher': st['name']}, st['requests']) for st in stats]))
+    return families
+
+metrics.register_collector(_batcher_metrics)
+
+def _cache_metrics():
+    if embedding_cache is None:
+        return []
+    stats = embedding_cache.stats()
+    return [
+        ('signet_embedding_cache_lookups_total', 'Embedding cache lookups by result', 'counter',
+         [({'result': result}, stats[key]) for result, key in
+          (('hit', 'hits'), ('miss', 'misses'), ('coalesced', 'coalesced'))]),
+        ('signet_embedding_cache_evictions_total', 'Embeddings evicted to stay within the memory budget', 'counter',
+         [({}, stats['evictions'])]),
+        ('signet_embedding_cache_entries', 'Embeddings currently cached', 'gauge', [({}, stats['entries'])]),
+        ('signet_embedding_cache_bytes', 'Memory used by cached embeddings', 'gauge', [({}, stats['bytes'])]),
+    ]
+
+metrics.register_collector(_cache_metrics)
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text-format metrics"""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({
         'status': 'healthy',
         'model_loaded': model is not None,
+        'model_status': model_status,
         'message': 'Signature verification API is running'
     })
 
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    """Readiness probe: 200 once a model is loaded and warmed up, 503 until then"""
+    ready = inference_model is not None
+    return jsonify({
+        'ready': ready,
+        'model_status': model_status,
+        'error': model_error,
+        'startup_seconds': startup_timings
+    }), 200 if ready else 503
+
+def verification_result(similarity_score):
+    """Build the JSON payload for a similarity score"""
+    # Operating threshold from the last evaluation of the served model (see evaluate.py)
+    threshold = decision_threshold
+    # Scores at the threshold count as genuine, matching the ROC operating point evaluate.py reports
+    is_genuine = similarity_score >= threshold
+    # Distance from the threshold, scaled to [0, 1] on either side of it
+    margin = ((similarity_score - threshold) / max(1 - threshold, 1e-12) if is_genuine
+              else (threshold - similarity_score) / threshold)
+    return {
+        'success': True,
+        'similarity_score': similarity_score,
+        'is_genuine': is_genuine,
+        'confidence': min(max(margin, 0.0), 1.0),
+        'threshold': threshold
+    }
+
 @app.route('/api/verify', methods=['POST'])
 def verify_signatures():
-    """Verify two signatures for authenticity"""
+    """Verify two signatures, or one signature against an enrolled reference, for authenticity"""
     try:
         if model is None:
-            return jsonify({
-                'error': 'Model not loaded. Please train the model first.',
-                'success': False
-            }), 500
+            return model_unavailable()
         
         data = request.json
         
+        if 'reference_id' in data:
+            if 'signature1' not in data:
+                return jsonify({
+                    'error': 'signature1 is required when verifying against a reference_id',
+                    'success': False
+                }), 400
+            
+            current = inference_model
+            reference = embedding_store.get(data['reference_id'])
+            if reference is None:
+                return jsonify({
+                    'error': f"Unknown reference_id: {data['reference_id']}",
+                    'success': False
+                }), 404
+            reference_embedding, writer_id = reference
+            
+            # Only the questioned signature goes through the CNN tower
+            embedding = embed_upload(data['signature1'], current)
+            if embedding is None:
+                return jsonify({
+                    'error': 'Failed to process the image',
+                    'success': False
+                }), 400
+            with STAGE_SECONDS.time(stage='score'):
+                similarity_score = float(current.score_embeddings(
+                    embedding[np.newaxis], reference_embedding[np.newaxis])[0])
+            
+            result = verification_result(similarity_score)
+            result.update({'reference_id': data['reference_id'], 'writer_id': writer_id})
+            with STAGE_SECONDS.time(stage='json_encode'):
+                return jsonify(result)
+        
         if 'signature1' not in data or 'signature2' not in data:
             return jsonify({
                 'error': 'Both signature1 and signature2 are required',
                 'success': False
             }), 400
         
+        if embedding_cache is not None:
+            # Embed each side through the cache, then score with the Siamese head
+            current = inference_model
+            embedding1 = embed_upload(data['signature1'], current)
+            embedding2 = embed_upload(data['signature2'], current)
+            if embedding1 is None or embedding2 is None:
+                return jsonify({
+                    'error': 'Failed to process one or both images',
+                    'success': False
+                }), 400
+            with STAGE_SECONDS.time(stage='score'):
+                similarity_score = float(current.score_embeddings(
+                    embedding1[np.newaxis], embedding2[np.newaxis])[0])
+            with STAGE_SECONDS.time(stage='json_encode'):
+                return jsonify(verification_result(similarity_score))
+        
         # Preprocess images
         img1 = preprocess_image(data['signature1'])
         img2 = preprocess_image(data['signature2'])
@@ -113,51 +610,270 @@ def verify_signatures():
                 'success': False
             }), 400
         
-        # Add batch dimension
-        img1_batch = np.expand_dims(img1, axis=0)
-        img2_batch = np.expand_dims(img2, axis=0)
+        # Make prediction (batched together with concurrent requests)
+        with STAGE_SECONDS.time(stage='predict'):
+            similarity_score = predict_pair(img1, img2)
         
-        # Make prediction
-        prediction = model.predict([img1_batch, img2_batch])
-        similarity_score = float(prediction[0][0])
+        with STAGE_SECONDS.time(stage='json_encode'):
+            return jsonify(verification_result(similarity_score))
         
-        # Determine if signatures match (threshold can be adjusted)
-        threshold = 0.5
-        is_genuine = similarity_score > threshold
+    except Exception as e:
+        logger.error(f"Error in verification: {str(e)}")
+        return jsonify({
+            'error': f'Internal server error: {str(e)}',
+            'success': False
+        }), 500
+
+@app.route('/api/verify/batch', methods=['POST'])
+def verify_signatures_batch():
+    """Verify many pairs uploaded as binary multipart parts or a zip/npz archive.
+    
+    Results are streamed back as newline-delimited JSON, one line per pair,
+    followed by a summary line.
+    """
+    if model is None:
+        return model_unavailable()
+    
+    try:
+        pairs = iter_pairs(request.files, request.form)
+        first_chunk = list(islice(pairs, pairs_per_chunk(config)))
+    except (BulkInputError, ValueError) as e:
+        return jsonify({
+            'error': str(e),
+            'success': False
+        }), 400
+    
+    def score_chunk(chunk):
+        current = inference_model
+        images, ok = preprocess_image_batch(
+            [item[1] for item in chunk] + [item[2] for item in chunk if item[3] is None]
+        )
+        first_images, first_ok = images[:len(chunk)], ok[:len(chunk)]
+        second_images, second_ok = images[len(chunk):], ok[len(chunk):]
+        
+        results = [None] * len(chunk)
+        errors = {}
+        paired = [i for i, item in enumerate(chunk) if item[3] is None]
+        referenced = [i for i, item in enumerate(chunk) if item[3] is not None]
+        
+        # Full Siamese model for uploaded pairs, one call per chunk
+        valid = [k for k, i in enumerate(paired) if first_ok[i] and second_ok[k]]
+        if valid:
+            scores = current.predict_pairs(
+                first_images[[paired[k] for k in valid]], second_images[valid])
+            for k, score in zip(valid, scores):
+                results[paired[k]] = float(score)
+        
+        # One tower plus the head for enrolled references
+        references = {}
+        for i in referenced:
+            reference = embedding_store.get(chunk[i][3])
+            if reference is None:
+                errors[i] = f'Unknown reference_id: {chunk[i][3]}'
+            elif first_ok[i]:
+                references[i] = reference[0]
+        if references:
+            indices = list(references)
+            embeddings = current.embed(first_images[indices])
+            scores = current.score_embeddings(embeddings, np.stack([references[i] for i in indices]))
+            for i, score in zip(indices, scores):
+                results[i] = float(score)
+        
+        for i, item in enumerate(chunk):
+            if results[i] is not None:
+                line = verification_result(results[i])
+            else:
+                line = {'success': False, 'error': errors.get(i, 'Failed to process one or both images')}
+            line['pair_id'] = item[0]
+            if item[3] is not None:
+                line['reference_id'] = item[3]
+            yield line
+    
+    def generate():
+        total, failed = 0, 0
+        chunk = first_chunk
+        try:
+            while chunk:
+                for line in score_chunk(chunk):
+                    total += 1
+                    failed += not line['success']
+                    yield json.dumps(line) + '\n'
+                chunk = list(islice(pairs, pairs_per_chunk(config)))
+        except Exception as e:
+            logger.error(f"Error in batch verification: {str(e)}")
+            yield json.dumps({'success': False, 'error': f'Batch verification aborted: {str(e)}'}) + '\n'
+        yield json.dumps({'summary': True, 'pairs': total, 'failed': failed}) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/identify', methods=['POST'])
+def identify_signature():
+    """Find the enrolled writers a signature most likely belongs to (1:N)"""
+    try:
+        if model is None:
+            return model_unavailable()
+        
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({
+                'error': 'Request body must be a JSON object',
+                'success': False
+            }), 400
+        
+        if 'signature' not in data:
+            return jsonify({
+                'error': 'signature is required',
+                'success': False
+            }), 400
+        top_k = parse_top_k(data)
+        if top_k is None:
+            return jsonify({
+                'error': 'top_k must be a positive integer',
+                'success': False
+            }), 400
+        
+        # Embed the query once, retrieve the nearest references, re-score them with the head
+        current = inference_model
+        embedding = embed_upload(data['signature'], current)
+        if embedding is None:
+            return jsonify({
+                'error': 'Failed to process the image',
+                'success': False
+            }), 400
+        start = time.perf_counter()
+        index, matches = rank_references(embedding, current, top_k)
+        search_ms = (time.perf_counter() - start) * 1000
+        
+        best = verification_result(matches[0]['similarity_score']) if matches else None
         
         return jsonify({
             'success': True,
-            'similarity_score': similarity_score,
-            'is_genuine': is_genuine,
-            'confidence': abs(similarity_score - 0.5) * 2,  # Convert to confidence score
-            'threshold': threshold
+            'matches': matches,
+            'best_match': dict(matches[0], is_genuine=best['is_genuine'], confidence=best['confidence']) if matches else None,
+            'threshold': best['threshold'] if best else None,
+            'gallery_size': len(index),
+            'index_type': index.index_type,
+            'search_ms': search_ms
         })
         
     except Exception as e:
-        logger.error(f"Error in verification: {str(e)}")
+        logger.error(f"Error in identification: {str(e)}")
         return jsonify({
-            'error': f'Internal server error: {str(e)}',
+            'error': f'Identification failed: {str(e)}',
             'success': False
         }), 500
 
-@app.route('/api/train', methods=['POST'])
-def train_model_endpoint():
-    """Trigger model training"""
+@app.route('/api/enroll', methods=['POST'])
+def enroll_signature():
+    """Embed a reference signature once and store it under a reference id"""
     try:
-        from train import train_model
+        if model is None:
+            return model_unavailable()
+        
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({
+                'error': 'Request body must be a JSON object',
+                'success': False
+            }), 400
+        
+        if 'reference_id' not in data or 'signature' not in data:
+            return jsonify({
+                'error': 'Both reference_id and signature are required',
+                'success': False
+            }), 400
         
-        # Run training in background (in production, use Celery or similar)
-        model_trained, test_data = train_model()
+        image = preprocess_image(data['signature'])
+        if image is None:
+            return jsonify({
+                'error': 'Failed to process the image',
+                'success': False
+            }), 400
         
-        # Update global model
-        global model
-        model = model_trained
+        # Embed and record with the same model even if a new one is swapped in meanwhile
+        current = inference_model
+        embedding = current.embed(image[np.newaxis])[0]
+        embedding_store.enroll(
+            str(data['reference_id']),
+            image,
+            embedding,
+            writer_id=data.get('writer_id'),
+            model_version=current.version
+        )
         
         return jsonify({
             'success': True,
-            'message': 'Model training completed successfully'
+            'reference_id': str(data['reference_id']),
+            'writer_id': data.get('writer_id'),
+            'embedding_dim': int(embedding.shape[0]),
+            'enrolled_count': len(embedding_store)
         })
         
+    except Exception as e:
+        logger.error(f"Error in enrollment: {str(e)}")
+        return jsonify({
+            'error': f'Enrollment failed: {str(e)}',
+            'success': False
+        }), 500
+
+@app.route('/api/enroll', methods=['GET'])
+def list_enrolled():
+    """List enrolled reference signatures"""
+    return jsonify({
+        'success': True,
+        'references': embedding_store.entries() if embedding_store is not None else []
+    })
+
+@app.route('/api/enroll/<reference_id>', methods=['DELETE'])
+def remove_enrolled(reference_id):
+    """Remove an enrolled reference signature"""
+    if embedding_store is None or not embedding_store.remove(reference_id):
+        return jsonify({
+            'error': f'Unknown reference_id: {reference_id}',
+            'success': False
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'reference_id': reference_id
+    })
+
+@app.route('/api/batching/stats', methods=['GET'])
+def batching_stats():
+    """Queue-depth and batch-size statistics of the micro-batchers"""
+    return jsonify({
+        'success': True,
+        'enabled': pair_batcher is not None,
+        'batchers': [b.stats() for b in (pair_batcher, embed_batcher) if b is not None]
+    })
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss statistics of the content-hash embedding cache"""
+    return jsonify({
+        'success': True,
+        'enabled': embedding_cache is not None,
+        'cache': embedding_cache.stats() if embedding_cache is not None else None
+    })
+
+@app.route('/api/train', methods=['POST'])
+def train_model_endpoint():
+    """Start model training as a background job"""
+    try:
+        job = training_jobs.submit()
+        if job is None:
+            return jsonify({
+                'error': 'A training job is already running',
+                'success': False
+            }), 409
+        
+        result = job.to_dict()
+        result.update({
+            'success': True,
+            'message': 'Training started'
+        })
+        return jsonify(result), 202
+        
     except Exception as e:
         logger.error(f"Error in training: {str(e)}")
         return jsonify({
@@ -165,9 +881,32 @@ def train_model_endpoint():
             'success': False
         }), 500
 
+@app.route('/api/train/jobs', methods=['GET'])
+def list_training_jobs():
+    """List training jobs, most recent first"""
+    return jsonify({
+        'success': True,
+        'jobs': [job.to_dict() for job in training_jobs.jobs()]
+    })
+
+@app.route('/api/train/<job_id>', methods=['GET'])
+def training_job_status(job_id):
+    """Status and progress (epoch, loss, ETA) of a training job"""
+    job = training_jobs.get(job_id)
+    if job is None:
+        return jsonify({
+            'error': f'Unknown training job: {job_id}',
+            'success': False
+        }), 404
+    
+    result = job.to_dict()
+    result['success'] = True
+    return jsonify(result)
+
 @app.route('/api/evaluate', methods=['GET'])
 def evaluate_model_endpoint():
     """Evaluate the current model"""
+    global decision_threshold
     try:
         if model is None:
             return jsonify({
@@ -176,13 +915,27 @@ def evaluate_model_endpoint():
             }), 400
         
         from evaluate import evaluate_model
-        loss, accuracy = evaluate_model()
+        report = evaluate_model(model_path=serving_model_path())
+        
+        # Serve the new operating threshold right away if the evaluated model is still the current one
+        with model_lock:
+            if inference_model is not None and inference_model.version == report['model_version']:
+                decision_threshold = threshold_for(inference_model)
         
+        accuracy = report['recommended']['accuracy']
         return jsonify({
             'success': True,
-            'accuracy': float(accuracy),
-            'loss': float(loss),
-            'accuracy_percentage': float(accuracy * 100)
+            'accuracy': accuracy,
+            'accuracy_percentage': accuracy * 100,
+            'auc': report['auc'],
+            'eer': report['eer'],
+            'threshold': report['threshold'],
+            'far': report['recommended']['far'],
+            'frr': report['recommended']['frr'],
+            'accuracy_at_0.5': report['at_0.5']['accuracy'],
+            'pairs': report['pairs'],
+            'images': report['images'],
+            'curves': report['curves']
         })
         
     except Exception as e:
@@ -206,7 +959,10 @@ def get_model_info():
             'model_loaded': True,
             'input_shape': config.INPUT_SHAPE,
             'image_shape': config.IMAGE_SHAPE,
-            'model_path': config.MODEL_SAVE_PATH,
+            'model_path': serving_model_path(),
+            'model_type': type(inference_model).__name__,
+            'model_version': inference_model.version,
+            'decision_threshold': decision_threshold,
             'parameters': {
                 'batch_size': config.BATCH_SIZE,
                 'epochs': config.EPOCHS,
@@ -222,8 +978,8 @@ def get_model_info():
         }), 500
 
 if __name__ == '__main__':
-    # Load model on startup
-    load_model()
+    # Load the model in the background while the server starts answering
+    load_model(background=True)
     
     # Run the Flask app
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,326 @@
+"""Asynchronous production server for the verification endpoints.
+
+    python async_app.py --port 5000
+
+One process owns the model. An aiohttp event loop accepts requests without
+blocking, base64 and image decoding plus preprocessing run in a pool of
+worker processes (one per core but one), and every forward pass goes through
+the single inference worker (the micro-batcher thread), so the weights exist
+once. Concurrent requests beyond ``Config.ASYNC_MAX_IN_FLIGHT`` are rejected
+with 503 and ``Retry-After``, and requests slower than
+``Config.ASYNC_REQUEST_TIMEOUT_S`` are answered with 504.
+
+Serves /api/verify, /api/identify, /api/health, /api/ready and /api/metrics.
+Enrollment, bulk verification, training and evaluation stay on the Flask app
+(app.py behind gunicorn).
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+from aiohttp import web
+from config.config import Config
+from serving.preprocess_pool import init_worker, preprocess_upload, worker_pid
+
+# Probes and metrics are always answered, even under overload
+UNLIMITED_PATHS = ('/api/health', '/api/ready', '/api/metrics')
+
+def _error(message, status):
+    return web.json_response({'error': message, 'success': False}, status=status)
+
+class AsyncServer:
+    """aiohttp application sharing the model, stores and metrics of app.py"""
+
+    def __init__(self, config=None, decode_workers=None):
+        self.config = config or Config()
+        self.decode_workers = (decode_workers or self.config.ASYNC_DECODE_WORKERS
+                               or max(1, (os.cpu_count() or 2) - 1))
+        # Spawned, not forked: this process runs TensorFlow, which is not fork-safe
+        self.decode_pool = ProcessPoolExecutor(self.decode_workers, mp_context=multiprocessing.get_context('spawn'),
+                                               initializer=init_worker)
+        # The inference worker when micro-batching is off; index searches when it is on
+        self.inference_executor = ThreadPoolExecutor(1, thread_name_prefix='inference')
+        self.in_flight = 0
+        self._pending = {}  # (model version, content hash) -> Future of an embedding being computed
+
+        import app as api
+        self.api = api
+        self.rejected = api.metrics.counter('signet_async_rejected_total',
+                                            'Requests rejected with 503 because too many were in flight')
+        self.timeouts = api.metrics.counter('signet_async_timeouts_total',
+                                            'Requests answered with 504 after ASYNC_REQUEST_TIMEOUT_S')
+        api.metrics.register_collector(self._collect_metrics)
+
+    def create_app(self):
+        app = web.Application(middlewares=[self.middleware],
+                              client_max_size=int(self.config.ASYNC_MAX_BODY_MB * 2**20))
+        app.router.add_post('/api/verify', self.verify)
+        app.router.add_post('/api/identify', self.identify)
+        app.router.add_get('/api/health', self.health)
+        app.router.add_get('/api/ready', self.ready)
+        app.router.add_get('/api/metrics', self.metrics)
+        app.on_startup.append(self.on_startup)
+        app.on_cleanup.append(self.on_cleanup)
+        return app
+
+    async def on_startup(self, app):
+        # The model loads in a background thread; /api/ready reports when it can serve
+        self.api.load_model(background=True)
+        # Start every decode process now rather than on the first requests
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.decode_pool, worker_pid) for _ in range(self.decode_workers)])
+        self.api.logger.info(f"Async server: {self.decode_workers} decode workers started, "
+                             f"at most {self.config.ASYNC_MAX_IN_FLIGHT} requests in flight")
+
+    async def on_cleanup(self, app):
+        self.decode_pool.shutdown(cancel_futures=True)
+        self.inference_executor.shutdown(wait=False)
+
+    def _collect_metrics(self):
+        return [('signet_async_in_flight', 'Requests currently being processed', 'gauge', [({}, self.in_flight)])]
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        """Admission control, request timeout and the request metrics"""
+        start = time.perf_counter()
+        resource = request.match_info.route.resource
+        endpoint = resource.canonical if resource is not None else 'unmatched'
+        status = 500
+        try:
+            if request.path in UNLIMITED_PATHS:
+                response = await handler(request)
+            elif self.in_flight >= self.config.ASYNC_MAX_IN_FLIGHT:
+                self.rejected.inc()
+                response = _error('Server is overloaded. Please retry shortly.', 503)
+                response.headers['Retry-After'] = '1'
+            else:
+                self.in_flight += 1
+                try:
+                    response = await asyncio.wait_for(handler(request), self.config.ASYNC_REQUEST_TIMEOUT_S)
+                except asyncio.TimeoutError:
+                    self.timeouts.inc()
+                    response = _error('Request timed out.', 504)
+                finally:
+                    self.in_flight -= 1
+            status = response.status
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            api = self.api
+            if endpoint != '/api/metrics':
+                api.REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+            api.REQUESTS.inc(endpoint=endpoint, method=request.method, status=status)
+            if status >= 400:
+                api.ERRORS.inc(endpoint=endpoint, status=status)
+
+    async def _read_json(self, request):
+        try:
+            data = await request.json()
+        except (ValueError, UnicodeDecodeError):
+            raise web.HTTPBadRequest(text=json.dumps({'error': 'Request body must be JSON', 'success': False}),
+                                     content_type='application/json')
+        if not isinstance(data, dict):
+            raise web.HTTPBadRequest(text=json.dumps({'error': 'Request body must be a JSON object', 'success': False}),
+                                     content_type='application/json')
+        return data
+
+    def _model_unavailable(self):
+        if self.api.model_status == 'loading':
+            return _error('Model is still loading. Please retry shortly.', 503)
+        return _error('Model not loaded. Please train the model first.', 500)
+
+    async def _compute_embedding(self, image_data, current):
+        """Decode and preprocess in the pool, then embed on the inference worker; None if undecodable"""
+        api, config = self.api, self.config
+        loop = asyncio.get_running_loop()
+        image, num_bytes, num_pixels, seconds = await loop.run_in_executor(
+            self.decode_pool, preprocess_upload, image_data, config.IMAGE_SHAPE,
+            config.PREPROCESS_CROP_TO_INK, config.PREPROCESS_DECODE_OVERSAMPLING)
+        api.STAGE_SECONDS.observe(seconds, stage='preprocess')
+        if num_bytes:
+            api.IMAGE_BYTES.observe(num_bytes)
+        if num_pixels:
+            api.IMAGE_PIXELS.observe(num_pixels)
+        if image is None:
+            return None
+        # Same normalization as data.image_preprocessing.finish_batch
+        image = image.astype(np.float32) * np.float32(1.0 / 255.0)
+
+        start = time.perf_counter()
+        if api.embed_batcher is not None:
+            embedding = await asyncio.wrap_future(api.embed_batcher.submit(image))
+        else:
+            embedding = await loop.run_in_executor(self.inference_executor,
+                                                   lambda: current.embed(image[np.newaxis])[0])
+        api.STAGE_SECONDS.observe(time.perf_counter() - start, stage='embed')
+        return embedding
+
+    async def embed_upload(self, image_data, current):
+        """Base-tower embedding of a base64 upload, or None if it cannot be processed.
+
+        With the embedding cache enabled, the base64 payload is decoded and the
+        image bytes are hashed on the event loop, which takes well under a
+        millisecond for a signature scan. Keys therefore match those of app.py,
+        whatever the base64 or data URL wrapping. A cached image then skips the
+        decode pool and the model entirely; otherwise the pool gets the decoded
+        bytes. Identical uploads that arrive while the first one is still being
+        computed wait for its result.
+        """
+        if not isinstance(image_data, str):
+            return None
+        cache = self.api.embedding_cache
+        if cache is None:
+            return await self._compute_embedding(image_data, current)
+
+        try:
+            image_data = self.api.decode_upload(image_data)
+        except ValueError:
+            return None
+        digest = cache.content_hash(image_data)
+        key = (current.version, digest)
+        pending = self._pending.get(key)
+        if pending is not None:
+            cache.record_coalesced()
+            return await asyncio.shield(pending)
+        embedding, generation = cache.get(digest, current.version)
+        if embedding is not None:
+            return embedding
+
+        future = self._pending[key] = asyncio.get_running_loop().create_future()
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())  # Nobody may be waiting
+        try:
+            embedding = await self._compute_embedding(image_data, current)
+            if embedding is not None:
+                embedding = cache.put(digest, current.version, embedding, generation)
+            future.set_result(embedding)
+            return embedding
+        except BaseException as e:
+            # Requests coalesced onto one that timed out time out as well
+            future.set_exception(asyncio.TimeoutError() if isinstance(e, asyncio.CancelledError) else e)
+            raise
+        finally:
+            self._pending.pop(key, None)
+
+    async def verify(self, request):
+        """Verify two signatures, or one signature against an enrolled reference (same API as app.py)"""
+        api = self.api
+        data = await self._read_json(request)
+        if api.model is None:
+            return self._model_unavailable()
+        current = api.inference_model
+        try:
+            if 'reference_id' in data:
+                if 'signature1' not in data:
+                    return _error('signature1 is required when verifying against a reference_id', 400)
+                # The store may be waiting on SQLite or another process; keep the event loop free
+                reference = await asyncio.get_running_loop().run_in_executor(
+                    None, api.embedding_store.get, data['reference_id'])
+                if reference is None:
+                    return _error(f"Unknown reference_id: {data['reference_id']}", 404)
+                reference_embedding, writer_id = reference
+                embedding = await self.embed_upload(data['signature1'], current)
+                if embedding is None:
+                    return _error('Failed to process the image', 400)
+                similarity_score = float(current.score_embeddings(
+                    embedding[np.newaxis], reference_embedding[np.newaxis])[0])
+                result = api.verification_result(similarity_score)
+                result.update({'reference_id': data['reference_id'], 'writer_id': writer_id})
+                return web.json_response(result)
+
+            if 'signature1' not in data or 'signature2' not in data:
+                return _error('Both signature1 and signature2 are required', 400)
+            # Both sides are decoded in parallel and embedded in the same micro-batch
+            embedding1, embedding2 = await asyncio.gather(
+                self.embed_upload(data['signature1'], current),
+                self.embed_upload(data['signature2'], current))
+            if embedding1 is None or embedding2 is None:
+                return _error('Failed to process one or both images', 400)
+            with api.STAGE_SECONDS.time(stage='score'):
+                similarity_score = float(current.score_embeddings(
+                    embedding1[np.newaxis], embedding2[np.newaxis])[0])
+            return web.json_response(api.verification_result(similarity_score))
+        except asyncio.TimeoutError:
+            raise
+        except Exception as e:
+            api.logger.error(f"Error in verification: {str(e)}")
+            return _error(f'Internal server error: {str(e)}', 500)
+
+    async def identify(self, request):
+        """Find the enrolled writers a signature most likely belongs to (same API as app.py)"""
+        api = self.api
+        data = await self._read_json(request)
+        if api.model is None:
+            return self._model_unavailable()
+        if 'signature' not in data:
+            return _error('signature is required', 400)
+        top_k = api.parse_top_k(data)
+        if top_k is None:
+            return _error('top_k must be a positive integer', 400)
+        current = api.inference_model
+        try:
+            embedding = await self.embed_upload(data['signature'], current)
+            if embedding is None:
+                return _error('Failed to process the image', 400)
+
+            def search():
+                start = time.perf_counter()
+                index, matches = api.rank_references(embedding, current, top_k)
+                return index, matches, (time.perf_counter() - start) * 1000
+            # Large galleries take a while to search; keep the event loop free meanwhile
+            index, matches, search_ms = await asyncio.get_running_loop().run_in_executor(None, search)
+            best = api.verification_result(matches[0]['similarity_score']) if matches else None
+            return web.json_response({
+                'success': True,
+                'matches': matches,
+                'best_match': dict(matches[0], is_genuine=best['is_genuine'],
+                                   confidence=best['confidence']) if matches else None,
+                'threshold': best['threshold'] if best else None,
+                'gallery_size': len(index),
+                'index_type': index.index_type,
+                'search_ms': search_ms
+            })
+        except asyncio.TimeoutError:
+            raise
+        except Exception as e:
+            api.logger.error(f"Error in identification: {str(e)}")
+            return _error(f'Identification failed: {str(e)}', 500)
+
+    async def health(self, request):
+        api = self.api
+        return web.json_response({
+            'status': 'healthy',
+            'model_loaded': api.model is not None,
+            'model_status': api.model_status,
+            'message': 'Signature verification API is running'
+        })
+
+    async def ready(self, request):
+        api = self.api
+        ready = api.inference_model is not None
+        return web.json_response({
+            'ready': ready,
+            'model_status': api.model_status,
+            'error': api.model_error,
+            'startup_seconds': api.startup_timings,
+            'decode_workers': self.decode_workers,
+            'in_flight': self.in_flight
+        }, status=200 if ready else 503)
+
+    async def metrics(self, request):
+        from serving.metrics import CONTENT_TYPE
+        return web.Response(body=self.api.metrics.render().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Async verification server with multi-process image decoding")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--decode-workers', type=int, default=None,
+                        help="Decode processes (defaults to Config.ASYNC_DECODE_WORKERS, else cores - 1)")
+    args = parser.parse_args()
+    web.run_app(AsyncServer(decode_workers=args.decode_workers).create_app(), host=args.host, port=args.port)
@@ -0,0 +1,243 @@
+import argparse
+import base64
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import cv2
+import tensorflow as tf
+from config.config import Config
+from data.data_preprocessing import DataPreprocessor
+from models.siamese import SiameseModel
+from serving.embedding_cache import EmbeddingCache
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+BATCH_SIZES = (1, 8, 32, 128)
+CONCURRENCY_LEVELS = (1, 4, 16)
+
+def synthetic_signature(rng, size=(220, 150)):
+    """Dark, smooth pen strokes on a white page, roughly like a scanned signature"""
+    width, height = size
+    image = np.full((height, width), 255, dtype=np.uint8)
+    for _ in range(rng.randint(2, 5)):
+        points = np.cumsum(rng.randn(rng.randint(6, 14), 2) * [width / 10, height / 8], axis=0)
+        points += [rng.uniform(0.1, 0.5) * width, rng.uniform(0.3, 0.7) * height]
+        points = np.clip(points, 0, [width - 1, height - 1]).astype(np.int32)
+        cv2.polylines(image, [points], False, int(rng.randint(0, 60)), int(rng.randint(1, 4)), cv2.LINE_AA)
+    return image
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (2**20 if sys.platform == "darwin" else 2**10)
+
+def _summarize(latencies, items_per_call, wall_seconds):
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        "calls": len(latencies),
+        "items_per_call": items_per_call,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "mean_ms": float(latencies_ms.mean()),
+        "throughput_per_sec": len(latencies) * items_per_call / wall_seconds,
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+def time_calls(fn, repeats, warmup=3, items_per_call=1):
+    """Time ``fn()`` sequentially after a few warm-up calls"""
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeats):
+        call_start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - call_start)
+    return _summarize(latencies, items_per_call, time.perf_counter() - start)
+
+def time_concurrent(fn, concurrency, requests_per_worker, warmup=2):
+    """Time ``fn()`` issued from ``concurrency`` threads at once"""
+    for _ in range(warmup):
+        fn()
+    latencies, lock = [], threading.Lock()
+
+    def worker():
+        for _ in range(requests_per_worker):
+            call_start = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - call_start
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result = _summarize(latencies, 1, time.perf_counter() - start)
+    result["concurrency"] = concurrency
+    return result
+
+def run_benchmarks(repeats=30, batch_sizes=BATCH_SIZES, concurrency_levels=CONCURRENCY_LEVELS, seed=0):
+    """Run every benchmark offline on synthetic images and a randomly initialized model"""
+    rng = np.random.RandomState(seed)
+    tf.random.set_seed(seed)
+    config = Config()
+    workdir = tempfile.mkdtemp(prefix="signet-bench-")
+    results = {}
+
+    # Synthetic inputs
+    pages = [synthetic_signature(rng) for _ in range(16)]
+    paths = []
+    for i, page in enumerate(pages):
+        paths.append(os.path.join(workdir, f"signature_{i}.png"))
+        cv2.imwrite(paths[-1], page)
+    data_urls = [
+        "data:image/png;base64," + base64.b64encode(cv2.imencode(".png", page)[1].tobytes()).decode()
+        for page in pages
+    ]
+
+    print("Benchmarking DataPreprocessor.preprocess_image...")
+    preprocessor = DataPreprocessor(config)
+    counter = iter(range(10**9))
+    results["data_preprocess_image"] = time_calls(
+        lambda: preprocessor.preprocess_image(paths[next(counter) % len(paths)]), repeats * 4)
+
+    # The app reads its model and config from module globals; point them at a scratch model
+    print("Building a randomly initialized model...")
+    start = time.perf_counter()
+    model_path = os.path.join(workdir, "siamese_model.h5")
+    SiameseModel(config).create_siamese_model().save(model_path)
+    build_seconds = time.perf_counter() - start
+
+    import app as app_module
+    Config.MODEL_SAVE_PATH = model_path
+    Config.SERVING_MODEL_PATH = None
+    Config.EMBEDDING_STORE_PATH = os.path.join(workdir, "embeddings.sqlite")
+    # The requests below cycle through 16 images, so with the embedding cache on everything after
+    # the first pass would be a hit; the cache is left off here and timed as its own variant
+    cache_mb, Config.EMBEDDING_CACHE_MB = config.EMBEDDING_CACHE_MB, 0
+    start = time.perf_counter()
+    app_module.load_model()
+    results["model_load"] = {"build_seconds": build_seconds, "load_seconds": time.perf_counter() - start,
+                             "peak_rss_mb": peak_rss_mb()}
+    inference_model = app_module.inference_model
+
+    print("Benchmarking app.preprocess_image...")
+    results["app_preprocess_image"] = time_calls(
+        lambda: app_module.preprocess_image(data_urls[next(counter) % len(data_urls)]), repeats * 4)
+
+    # A 12-megapixel phone photo of a signature, decoded at reduced resolution
+    photo = cv2.resize(pages[0], (4000, 3000), interpolation=cv2.INTER_CUBIC)
+    photo_url = "data:image/jpeg;base64," + base64.b64encode(cv2.imencode(".jpg", photo)[1].tobytes()).decode()
+    print("Benchmarking app.preprocess_image on a 12 MP JPEG...")
+    results["app_preprocess_large_jpeg"] = time_calls(lambda: app_module.preprocess_image(photo_url), repeats)
+
+    images = np.stack([preprocessor.preprocess_image(path) for path in paths])
+    for batch_size in batch_sizes:
+        batch = images[np.arange(batch_size) % len(images)]
+        print(f"Benchmarking base tower and Siamese model, batch size {batch_size}...")
+        results[f"base_tower_b{batch_size}"] = time_calls(
+            lambda: inference_model.embed(batch), repeats, items_per_call=batch_size)
+        results[f"siamese_b{batch_size}"] = time_calls(
+            lambda: inference_model.predict_pairs(batch, batch[::-1]), repeats, items_per_call=batch_size)
+
+    client = app_module.app.test_client()
+
+    def verify():
+        i = next(counter)
+        response = client.post("/api/verify", json={
+            "signature1": data_urls[i % len(data_urls)],
+            "signature2": data_urls[(i + 1) % len(data_urls)]
+        })
+        if response.status_code != 200:
+            raise RuntimeError(f"/api/verify returned {response.status_code}: {response.get_data(as_text=True)}")
+
+    for concurrency in concurrency_levels:
+        print(f"Benchmarking /api/verify end to end, concurrency {concurrency}...")
+        results[f"api_verify_c{concurrency}"] = time_concurrent(
+            verify, concurrency, max(1, repeats // concurrency * 2))
+
+    if cache_mb:
+        app_module.embedding_cache = EmbeddingCache(int(cache_mb * 2**20))
+        for _ in data_urls:  # One pass caches every image
+            verify()
+        for concurrency in concurrency_levels:
+            print(f"Benchmarking /api/verify end to end with cached embeddings, concurrency {concurrency}...")
+            results[f"api_verify_cached_c{concurrency}"] = time_concurrent(
+                verify, concurrency, max(1, repeats // concurrency * 2))
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "tensorflow": tf.__version__,
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "seed": seed,
+            "repeats": repeats,
+            "image_shape": list(config.IMAGE_SHAPE),
+            "micro_batching": config.MICRO_BATCHING,
+            "embedding_cache_mb": cache_mb
+        },
+        "results": results
+    }
+
+def compare_runs(baseline, candidate, threshold=0.10):
+    """List benchmarks whose latency grew or throughput dropped by more than ``threshold``"""
+    regressions = []
+    for name, before in baseline["results"].items():
+        after = candidate["results"].get(name)
+        if after is None or "p50_ms" not in before:
+            continue
+        for metric, worse in (("p50_ms", 1), ("p95_ms", 1), ("throughput_per_sec", -1)):
+            change = (after[metric] - before[metric]) / before[metric]
+            flagged = change * worse > threshold
+            if flagged:
+                regressions.append({"benchmark": name, "metric": metric, "before": before[metric],
+                                    "after": after[metric], "change": change})
+            print(f"{name:<24}{metric:<20}{before[metric]:>12.2f}{after[metric]:>12.2f}{change:>+9.1%}"
+                  f"{'  REGRESSION' if flagged else ''}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline performance benchmarks for SigNet")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="Run the benchmark suite")
+    run_parser.add_argument("--output", default="benchmark.json", help="Where to write the JSON results")
+    run_parser.add_argument("--repeats", type=int, default=30, help="Timed calls per benchmark")
+    run_parser.add_argument("--seed", type=int, default=0)
+    compare_parser = subparsers.add_parser("compare", help="Flag regressions between two runs")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--threshold", type=float, default=0.10,
+                                help="Relative change that counts as a regression")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        report = run_benchmarks(repeats=args.repeats, seed=args.seed)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.candidate) as f:
+            candidate = json.load(f)
+        regressions = compare_runs(baseline, candidate, args.threshold)
+        print(f"{len(regressions)} regression(s) above {args.threshold:.0%}")
+        sys.exit(1 if regressions else 0)
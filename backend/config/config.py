@@ -11,11 +11,23 @@ class Config:
     INPUT_SHAPE = (IMAGE_SHAPE[1], IMAGE_SHAPE[0], 1)  # (height, width, channels)
     
     # Training configuration
-    BATCH_SIZE = 128
+    BATCH_SIZE = 128  # Per worker; the global batch is BATCH_SIZE x workers
     EPOCHS = 10
     LEARNING_RATE = 0.0001
+    SCALE_LEARNING_RATE = True  # Multiply LEARNING_RATE by the worker count in distributed training
     WEIGHT_DECAY = 0.0005
     
+    # In-batch pair mining (TRAINING_MODE = "in_batch")
+    TRAINING_MODE = "pairs"  # "pairs" (precomputed pair list) or "in_batch" (all pairs within each batch)
+    IN_BATCH_WRITERS = 8  # Writers per batch
+    IN_BATCH_SAMPLES = 4  # Originals and forgeries per writer and batch
+    IN_BATCH_CROSS_WRITER = True  # Also use other writers' originals as negatives
+    IN_BATCH_LOSS = "contrastive"  # "contrastive" or "triplet"
+    MINING = "semi-hard"  # "all", "hard" or "semi-hard"
+    MINING_HARD_NEGATIVES = 4  # Negatives kept per anchor by "hard" mining
+    MINING_MARGIN = 0.3  # Similarity window below the hardest genuine pair for "semi-hard" mining
+    TRIPLET_MARGIN = 0.2
+    
     # Data split configuration
     TEST_SIZE = 0.3
     VAL_SIZE = 0.5
@@ -24,8 +36,110 @@ class Config:
     
     # Model configuration
     MODEL_SAVE_PATH = "./siamese_model.h5"
+    ARCHITECTURE = "signet"  # "signet" or "compact" (strided stem, depthwise-separable convs, global pooling)
+    
+    # Distillation of a compact tower from the trained SigNet (distill.py)
+    DISTILLED_MODEL_PATH = "./siamese_model_compact.h5"
+    DISTILL_REPORT_PATH = "./distillation.json"
+    DISTILL_EPOCHS = 30
+    DISTILL_BATCH_SIZE = 64
+    DISTILL_LEARNING_RATE = 0.001
+    DISTILL_PATIENCE = 5  # Epochs without a validation-loss improvement before stopping
+    
+    # Incremental onboarding of new writers (onboard.py)
+    ONBOARD_CACHE_DIR = "./embeddings/onboarding"  # Frozen-tower features, keyed by tower weights and image content
+    ONBOARD_UNFREEZE_DENSE = 0  # Last Dense layers of the tower trained along with the head; 0 trains the head only
+    ONBOARD_EPOCHS = 20
+    ONBOARD_BATCH_SIZE = 256
+    ONBOARD_LEARNING_RATE = 0.001
+    ONBOARD_PATIENCE = 3  # Epochs without a validation-loss improvement before stopping
+    ONBOARD_RETRAIN_EER_MARGIN = 0.02  # EER gap (new vs. existing writers, or existing before vs. after) that calls for a full retrain
+    ONBOARD_REPORT_PATH = "./onboarding.json"
+    
+    # Checkpointing, resumable training and early stopping
+    CHECKPOINT_DIR = "./checkpoints"
+    CHECKPOINT_EVERY_STEPS = None  # Also checkpoint every N training steps; None checkpoints once per epoch
+    CHECKPOINT_KEEP = 3  # Most recent checkpoints kept
+    CHECKPOINT_KEEP_EVERY_HOURS = None  # Additionally keep one checkpoint per this many hours
+    RESUME_TRAINING = True  # Continue an interrupted run from CHECKPOINT_DIR
+    EARLY_STOPPING_PATIENCE = 3  # Epochs without a val_loss improvement before stopping; None disables
+    EARLY_STOPPING_MIN_DELTA = 0.0
+    
+    # Training profiling (opt-in)
+    PROFILE_TRAINING = False  # Log per-step input wait vs. compute, examples/sec and memory to PROFILE_DIR
+    PROFILE_DIR = "./profile"
+    PROFILE_TRACE_STEPS = None  # e.g. (10, 20): TensorBoard profiler trace of these training steps
+    PROFILE_STALL_FRACTION = 0.5  # Steps waiting longer than this share of their time for input count as stalled
+    TRAINING_PLOT_PATH = "./training_history.png"  # None shows the plot with plt.show() (blocks)
+    
+    # Hyperparameter sweeps (sweep.py)
+    SWEEP_DIR = "./sweeps"
+    SWEEP_THREADS_PER_TRIAL = 2  # Cores each trial process is pinned to
+    SWEEP_PARALLEL_TRIALS = None  # None runs cores / SWEEP_THREADS_PER_TRIAL trials at once
+    SWEEP_METRIC = "val_loss"  # Ranking and pruning metric; use "val_accuracy" when sweeping MARGIN/ALPHA/BETA
+    SWEEP_PRUNE_WARMUP_EPOCHS = 2  # Trials are never pruned before this many epochs
+    SWEEP_PRUNE_MIN_TRIALS = 3  # Other trials that must have reached an epoch before pruning at it
+    
+    # Evaluation and decision threshold
+    EVALUATION_PATH = "./evaluation.json"  # Written by evaluate.py
+    DECISION_THRESHOLD = None  # None uses the evaluated EER threshold of the served model, else 0.5
     
     # Loss function parameters
     MARGIN = 1.0
     ALPHA = 1.0
-    BETA = 1.0
\ No newline at end of file
+    BETA = 1.0
+    
+    # Serving configuration
+    EMBEDDING_STORE_PATH = "./embeddings/enrolled.sqlite"  # Shared by every worker process; an enrolled.npz next to it is imported once
+    EMBEDDING_CACHE_MB = 64  # Content-hash LRU cache of upload embeddings; 0 disables it
+    
+    # Micro-batching of concurrent verify requests
+    MICRO_BATCHING = True
+    MICRO_BATCH_MAX_SIZE = 32
+    MICRO_BATCH_MAX_WAIT_MS = 2.0
+    
+    # Async serving (async_app.py)
+    ASYNC_DECODE_WORKERS = None  # Image decoding/preprocessing processes; None uses every core but one
+    ASYNC_MAX_IN_FLIGHT = 256  # Requests processed at once; more are rejected with 503 and Retry-After
+    ASYNC_REQUEST_TIMEOUT_S = 10.0  # Requests taking longer are answered with 504
+    ASYNC_MAX_BODY_MB = 20  # Larger request bodies are rejected with 413
+    
+    # Compiled serving functions
+    SERVING_XLA = False  # XLA-compile the tower and Siamese forward pass
+    SERVING_BATCH_BUCKETS = (1, 2, 4, 8, 16, 32)  # Warmed up at load; XLA pads batches up to these
+    
+    # Bulk verification (/api/verify/batch)
+    BULK_VERIFY_MEMORY_MB = 512
+    BULK_VERIFY_MAX_CHUNK = 256
+    
+    # Packed, memory-mapped dataset shards
+    USE_PACKED_DATASET = True
+    PACKED_DATASET_PATH = "./dataset/packed"
+    PREPROCESSING_VERSION = 2  # Bump whenever data/image_preprocessing.py changes
+    SHARD_SIZE = 1024  # Images per shard file
+    
+    # Image preprocessing (shared by training and serving)
+    PREPROCESS_CROP_TO_INK = False  # Crop to the signature's ink bounding box before resizing
+    PREPROCESS_DECODE_OVERSAMPLING = 4  # Large JPEGs are decoded at reduced size, at least this many times the input size
+    
+    # Parallel image preprocessing
+    PREPROCESS_WORKERS = None  # None uses every CPU core, 1 forces the serial path
+    PREPROCESS_CHUNK_SIZE = 32  # Images handed to a worker at a time
+    PREPROCESS_BACKEND = "thread"  # "thread" (OpenCV releases the GIL) or "process"
+    
+    # Background training jobs
+    TRAINING_JOB_THREADS = max(1, (os.cpu_count() or 2) // 2)  # TF threads for the training process
+    TRAINING_JOBS_DIR = "./training_jobs"  # Job status files shared by all worker processes
+    MODEL_WATCH_INTERVAL_S = 5.0  # Poll the serving model file and install newly published versions; None disables
+    
+    # Inference export (export.py)
+    EXPORT_PATH = "./exported"
+    SERVING_MODEL_PATH = None  # e.g. "./exported/tflite-int8"; defaults to MODEL_SAVE_PATH
+    
+    # 1:N writer identification (/api/identify)
+    IDENTIFY_INDEX = "exact"  # "exact" or "ivf" (approximate, for large galleries)
+    IDENTIFY_STORAGE_DTYPE = "float32"  # "float32", "float16" or "int8"
+    IDENTIFY_IVF_MIN_SIZE = 10000  # Galleries smaller than this are always searched exactly
+    IDENTIFY_IVF_LISTS = None  # None picks ~sqrt(gallery size)
+    IDENTIFY_IVF_PROBES = 8
+    IDENTIFY_RERANK_CANDIDATES = 50  # Nearest references re-scored with the Siamese head
@@ -1,70 +1,287 @@
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
 import numpy as np
-import cv2
-from sklearn.model_selection import train_test_split
 from config.config import Config
+from data.image_preprocessing import preprocess_batch
+
+def preprocess_image_files(image_paths, image_shape, crop=False, oversampling=4, dtype=np.float32):
+    """Preprocess a chunk of image files into one batch (picklable for process pools)"""
+    images, ok = preprocess_batch(image_paths, image_shape, crop=crop, oversampling=oversampling, dtype=dtype)
+    if not ok.all():
+        raise ValueError(f"Could not decode {[str(path) for path, good in zip(image_paths, ok) if not good]}")
+    return images
+
+def gather_float_images(images, indices):
+    """Gather images (in-memory or memory-mapped shards) as float32 in [0, 1]"""
+    batch = np.asarray(images[np.asarray(indices)])
+    return batch.astype(np.float32) / 255.0 if batch.dtype == np.uint8 else batch.astype(np.float32)
 
 class DataPreprocessor:
     def __init__(self, config=None):
         self.config = config or Config()
+        self.last_throughput = None
     
     def preprocess_image(self, image_path):
         """Preprocess a single image"""
-        img = cv2.imread(str(image_path), cv2.IMREAD_GRAYSCALE)
-        img = cv2.resize(img, self.config.IMAGE_SHAPE, interpolation=cv2.INTER_LANCZOS4)
-        img = img / 255.0  # Normalize pixel values to [0, 1]
-        img = 1 - img  # Invert colors
-        return np.expand_dims(img, axis=-1)  # Add channel dimension
+        return self.preprocess_images([image_path], workers=1, verbose=False)[0]
+    
+    def preprocess_images(self, paths, workers=None, chunk_size=None, backend=None, dtype=np.float32, verbose=True):
+        """Preprocess many images into one [N, H, W, 1] batch, in parallel when more than one worker is configured.
+        
+        Uses the same pipeline as serving (data/image_preprocessing.py). Results
+        are in the order of ``paths`` and identical to the serial path.
+        ``backend`` is "thread" (OpenCV releases the GIL while decoding and
+        resizing) or "process". ``dtype`` is float32 in [0, 1] or uint8.
+        """
+        workers = workers or self.config.PREPROCESS_WORKERS or os.cpu_count()
+        chunk_size = chunk_size or self.config.PREPROCESS_CHUNK_SIZE
+        backend = backend or self.config.PREPROCESS_BACKEND
+        work = partial(preprocess_image_files, image_shape=self.config.IMAGE_SHAPE,
+                       crop=self.config.PREPROCESS_CROP_TO_INK,
+                       oversampling=self.config.PREPROCESS_DECODE_OVERSAMPLING, dtype=dtype)
+        chunks = [[str(path) for path in paths[i:i + chunk_size]] for i in range(0, len(paths), chunk_size)]
+        
+        start = time.perf_counter()
+        if workers <= 1 or len(chunks) <= 1:
+            batches = [work(chunk) for chunk in chunks]
+        elif backend == "process":
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                batches = list(pool.map(work, chunks))
+        elif backend == "thread":
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                batches = list(pool.map(work, chunks))
+        else:
+            raise ValueError(f"Unknown preprocessing backend: {backend}")
+        images = np.concatenate(batches) if batches else np.zeros((0,) + self.config.INPUT_SHAPE, dtype)
+        elapsed = time.perf_counter() - start
+        
+        self.last_throughput = len(paths) / elapsed if elapsed > 0 else float("inf")
+        if verbose:
+            print(f"Preprocessed {len(paths)} images in {elapsed:.2f}s "
+                  f"({self.last_throughput:.0f} images/sec, {backend if workers > 1 else 'serial'}, {workers} workers)")
+        return images
     
     def preprocess_dataset(self, dataset, orig):
         """Preprocess the entire dataset"""
+        paths = [path for i in dataset for path in dataset[i]]
+        images = iter(self.preprocess_images(paths))
+        
         processed_dataset = {}
         for i in dataset:
             processed_dataset[i] = {
-                "originals": [self.preprocess_image(path) for path in dataset[i][:len(orig[i])]],
-                "forgeries": [self.preprocess_image(path) for path in dataset[i][len(orig[i]):]]
+                "originals": [next(images) for _ in dataset[i][:len(orig[i])]],
+                "forgeries": [next(images) for _ in dataset[i][len(orig[i]):]]
             }
         return processed_dataset
     
-    def create_pairs(self, processed_dataset, max_pairs_per_class=1000):
-        """Create pairs of images for siamese network training"""
-        pairs, labels = [], []
+    def build_image_index(self, processed_dataset):
+        """Stack every image exactly once into a single tensor.
         
-        for keys, values in processed_dataset.items():
+        Returns the [N, H, W, 1] image tensor and, per writer, the row indices
+        of its originals and forgeries in that tensor.
+        """
+        images, image_index = [], {}
+        for writer, values in processed_dataset.items():
+            start = len(images)
+            images.extend(values["originals"])
+            middle = len(images)
+            images.extend(values["forgeries"])
+            image_index[writer] = {
+                "originals": np.arange(start, middle, dtype=np.int32),
+                "forgeries": np.arange(middle, len(images), dtype=np.int32)
+            }
+        images = np.stack(images).astype(np.float32) if images else np.zeros((0,) + self.config.INPUT_SHAPE, np.float32)
+        return images, image_index
+    
+    def create_pairs(self, image_index, max_pairs_per_class=1000):
+        """Create (index_a, index_b, label) pair triples over the stacked image tensor"""
+        pairs = []
+        
+        for keys, values in image_index.items():
             originals = values["originals"]
             forgeries = values["forgeries"]
             
-            # Generate positive pairs (original-original)
-            positive_pairs = []
-            for i in range(len(originals)):
-                for j in range(i + 1, len(originals)):
-                    positive_pairs.append([originals[i], originals[j]])
+            # Generate positive pairs (original-original), labeled as 1
+            a, b = np.triu_indices(len(originals), k=1)
+            positive_pairs = np.stack([originals[a], originals[b], np.ones_like(a)], axis=1)
             
-            # Generate negative pairs (original-forgery)
-            negative_pairs = []
-            for orig_img in originals:
-                for forg_img in forgeries:
-                    negative_pairs.append([orig_img, forg_img])
+            # Generate negative pairs (original-forgery), labeled as 0
+            a, b = np.meshgrid(originals, forgeries, indexing="ij")
+            negative_pairs = np.stack([a.ravel(), b.ravel(), np.zeros(a.size, dtype=a.dtype)], axis=1)
             
-            # Add pairs and corresponding labels
-            pairs.extend(positive_pairs)
-            labels.extend([1] * len(positive_pairs))  # Positive pairs labeled as 1
-            pairs.extend(negative_pairs)
-            labels.extend([0] * len(negative_pairs))  # Negative pairs labeled as 0
+            pairs.append(positive_pairs.astype(np.int32))
+            pairs.append(negative_pairs.astype(np.int32))
         
-        return np.array(pairs), np.array(labels)
+        return np.concatenate(pairs) if pairs else np.zeros((0, 3), np.int32)
     
-    def split_data(self, pairs, labels):
-        """Split data into train, validation, and test sets"""
-        train_pairs, temp_pairs, train_labels, temp_labels = train_test_split(
-            pairs, labels, 
+    def split_data(self, pairs):
+        """Split pair triples into train, validation, and test sets"""
+        from sklearn.model_selection import train_test_split
+        
+        train_pairs, temp_pairs = train_test_split(
+            pairs,
             test_size=self.config.TEST_SIZE, 
             random_state=self.config.RANDOM_STATE_TRAIN
         )
         
-        val_pairs, test_pairs, val_labels, test_labels = train_test_split(
-            temp_pairs, temp_labels, 
+        val_pairs, test_pairs = train_test_split(
+            temp_pairs,
             test_size=self.config.VAL_SIZE, 
             random_state=self.config.RANDOM_STATE_VAL
         )
         
-        return (train_pairs, train_labels), (val_pairs, val_labels), (test_pairs, test_labels)
\ No newline at end of file
+        return train_pairs, val_pairs, test_pairs
+    
+    def pair_steps_per_epoch(self, num_pairs, batch_size=None, shard=None):
+        """Batches per epoch of a repeating pair pipeline (the same on every worker)"""
+        batch_size = batch_size or self.config.BATCH_SIZE
+        num_workers = shard[0] if shard else 1
+        return max(1, num_pairs // num_workers // batch_size)
+    
+    def make_pair_dataset(self, images, pairs, batch_size=None, shuffle=False, repeat=False, shard=None,
+                          start_batch=0):
+        """tf.data pipeline of ((image_a, image_b), label) batches.
+        
+        Only the integer pair triples are batched; the images of each batch are
+        gathered from the single image tensor when the batch is produced.
+        ``images`` may be an in-memory array (float in [0, 1] or uint8) or
+        memory-mapped shards (``ShardedImages``), which are read out of core.
+        ``shard`` is ``(num_workers, worker_index)`` in multi-worker training:
+        each worker then reads only its own share of the pairs, and
+        ``batch_size`` is the global batch that tf.distribute splits across them.
+        
+        With ``repeat`` every epoch is ``pair_steps_per_epoch`` full batches and
+        epoch ``e`` is always shuffled the same way, so a pipeline created with
+        ``start_batch=n`` continues exactly where one that produced ``n`` batches
+        stopped (resumed training).
+        """
+        import tensorflow as tf
+        batch_size = batch_size or self.config.BATCH_SIZE
+        gather = self._make_gather(images)
+        
+        steps = self.pair_steps_per_epoch(len(pairs), batch_size, shard)
+        if shard is not None:
+            pairs = pairs[shard[1]::shard[0]]
+        num_pairs = len(pairs)
+        pairs = tf.constant(pairs)
+        first_epoch, skip = divmod(start_batch, steps)
+        seed = self.config.RANDOM_STATE_TRAIN
+        
+        def epoch_batches(epoch):
+            epoch_pairs = pairs
+            if shuffle:
+                keys = tf.random.stateless_uniform([num_pairs], seed=tf.stack([tf.constant(seed, tf.int64), epoch]))
+                epoch_pairs = tf.gather(pairs, tf.argsort(keys))
+            batches = tf.data.Dataset.from_tensor_slices(epoch_pairs).batch(batch_size)
+            return batches.take(steps) if repeat else batches
+        
+        if repeat:
+            dataset = tf.data.Dataset.range(first_epoch, np.iinfo(np.int64).max).flat_map(epoch_batches).skip(skip)
+        else:
+            dataset = epoch_batches(tf.constant(0, tf.int64))
+        dataset = dataset.map(
+            lambda batch: (
+                (gather(batch[:, 0]), gather(batch[:, 1])),
+                tf.cast(batch[:, 2], tf.float32)
+            ),
+            num_parallel_calls=tf.data.AUTOTUNE
+        )
+        return self._finish(dataset, shard)
+    
+    def make_writer_batch_dataset(self, images, image_index, writers_per_batch=None, samples_per_writer=None,
+                                  shard=None, start_batch=0):
+        """Endless tf.data pipeline of writer-balanced batches for in-batch pair mining.
+        
+        Each batch holds ``samples_per_writer`` originals and as many forgeries of
+        each of ``writers_per_batch`` random writers, as
+        ``(images, (writer_labels, is_forgery, image_ids))``. The training step
+        forms the pairs inside the batch, so every image is embedded once per step.
+        With ``shard = (num_workers, worker_index)`` every worker samples its own
+        batches and yields ``num_workers`` of them at once as the global batch,
+        which tf.distribute splits back into one writer-balanced batch per worker.
+        Batch ``n`` is drawn from its own seed, so ``start_batch`` resumes the
+        stream at a given position.
+        """
+        import tensorflow as tf
+        writers_per_batch = writers_per_batch or self.config.IN_BATCH_WRITERS
+        samples_per_writer = samples_per_writer or self.config.IN_BATCH_SAMPLES
+        writers = [writer for writer, values in image_index.items() if len(values["originals"]) >= 2]
+        if not writers:
+            raise ValueError("In-batch training needs writers with at least two originals")
+        num_workers, worker = shard or (1, 0)
+        
+        def batches():
+            for batch in itertools.count(start_batch):
+                rng = np.random.RandomState([self.config.RANDOM_STATE_TRAIN, worker, batch])
+                indices, labels, forged = [], [], []
+                chosen = [rng.choice(len(writers), min(writers_per_batch, len(writers)), replace=False)
+                          for _ in range(num_workers)]
+                for label, writer in enumerate(np.concatenate(chosen)):
+                    for kind in ("originals", "forgeries"):
+                        pool = image_index[writers[writer]][kind]
+                        if len(pool) == 0:
+                            continue
+                        picks = rng.choice(pool, samples_per_writer, replace=len(pool) < samples_per_writer)
+                        indices.extend(picks)
+                        labels.extend([label] * len(picks))
+                        forged.extend([kind == "forgeries"] * len(picks))
+                yield np.array(indices, np.int32), np.array(labels, np.int32), np.array(forged, bool)
+        
+        gather = self._make_gather(images)
+        dataset = tf.data.Dataset.from_generator(batches, output_signature=(
+            tf.TensorSpec((None,), tf.int32),
+            tf.TensorSpec((None,), tf.int32),
+            tf.TensorSpec((None,), tf.bool)
+        ))
+        dataset = dataset.map(
+            lambda indices, labels, forged: (gather(indices), (labels, forged, indices)),
+            num_parallel_calls=tf.data.AUTOTUNE
+        )
+        return self._finish(dataset, shard)
+    
+    def make_image_dataset(self, images, image_ids, targets, batch_size=None, shuffle=False):
+        """tf.data pipeline of (images, targets) batches for per-image objectives such as distillation.
+        
+        ``targets`` has one row per entry of ``image_ids``; the images of each
+        batch are gathered as in ``make_pair_dataset``.
+        """
+        import tensorflow as tf
+        batch_size = batch_size or self.config.BATCH_SIZE
+        gather = self._make_gather(images)
+        dataset = tf.data.Dataset.from_tensor_slices((np.asarray(image_ids), np.asarray(targets, np.float32)))
+        if shuffle:
+            dataset = dataset.shuffle(len(image_ids), seed=self.config.RANDOM_STATE_TRAIN)
+        dataset = dataset.batch(batch_size).map(
+            lambda ids, batch_targets: (gather(ids), batch_targets),
+            num_parallel_calls=tf.data.AUTOTUNE
+        )
+        return self._finish(dataset, None)
+    
+    def _finish(self, dataset, shard):
+        """Prefetch, and keep tf.distribute from sharding a pipeline that is already per worker"""
+        import tensorflow as tf
+        if shard is not None:
+            options = tf.data.Options()
+            options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+            dataset = dataset.with_options(options)
+        return dataset.prefetch(tf.data.AUTOTUNE)
+    
+    def _make_gather(self, images):
+        """Return a graph function mapping a batch of image indices to float32 images"""
+        import tensorflow as tf
+        if isinstance(images, np.ndarray) and not isinstance(images, np.memmap):
+            images = tf.constant(images)
+            take = lambda indices: tf.gather(images, indices)
+        else:
+            # Out-of-core images: copy only the rows of this batch on the host
+            def take(indices):
+                batch = tf.numpy_function(lambda i: np.asarray(images[i]), [indices], tf.as_dtype(images.dtype))
+                batch.set_shape((None,) + self.config.INPUT_SHAPE)
+                return batch
+        
+        if images.dtype == np.uint8:
+            return lambda indices: tf.cast(take(indices), tf.float32) / 255.0
+        return take
@@ -1,5 +1,6 @@
 import os
 import pathlib
+import re
 import numpy as np
 import tensorflow as tf
 import rarfile
@@ -33,13 +34,23 @@ class DatasetLoader:
         """Load file paths for original and forged signatures"""
         path = pathlib.Path(self.config.EXTRACT_PATH)
         
+        # Group files by writer in a single pass instead of globbing per writer
+        pattern = re.compile(r'(original|forgeries)_(\d+)_\d+\.png$')
         orig, forg = {}, {}
-        for i in range(55):
-            orig[i] = np.array(list(path.glob(f'full_org/original_{i+1}_*.png')))
-            forg[i] = np.array(list(path.glob(f'full_forg/forgeries_{i+1}_*.png')))
+        for folder in ('full_org', 'full_forg'):
+            for file_path in sorted((path / folder).glob('*.png')):
+                match = pattern.match(file_path.name)
+                if match is None:
+                    continue
+                target = orig if match.group(1) == 'original' else forg
+                target.setdefault(int(match.group(2)) - 1, []).append(file_path)
+        
+        writers = sorted(set(orig) | set(forg))
+        orig = {i: np.array(orig.get(i, [])) for i in writers}
+        forg = {i: np.array(forg.get(i, [])) for i in writers}
         
         dataset = {}
-        for i in range(55):
+        for i in writers:
             dataset[i] = np.concatenate((orig[i], forg[i]))
         
         return dataset, orig, forg
\ No newline at end of file
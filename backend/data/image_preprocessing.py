@@ -0,0 +1,115 @@
+import io
+import os
+import numpy as np
+import cv2
+
+# Reduced-resolution decode modes, largest reduction first. libjpeg scales JPEGs down
+# while decoding the DCT blocks, so a phone photo is never materialized at full size.
+REDUCED_DECODE_MODES = (
+    (8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+    (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+    (2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+)
+
+def source_info(data):
+    """Format and (width, height) from the image header, without decoding pixels; (None, None) if unknown"""
+    from PIL import Image
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return image.format, image.size
+    except Exception:
+        return None, None
+
+def decode_grayscale(data, image_shape=None, oversampling=4):
+    """Decode an encoded image (bytes) into a grayscale uint8 array, or None if it cannot be decoded.
+
+    For JPEGs much larger than ``image_shape`` (width, height) the decoder
+    scales by 1/2, 1/4 or 1/8 on the fly, keeping at least ``oversampling``
+    times the target resolution for the final resize and the ink crop. Other
+    formats are decoded at full size.
+    """
+    buffer = np.frombuffer(data, np.uint8)
+    flags = cv2.IMREAD_GRAYSCALE
+    if image_shape is not None:
+        image_format, size = source_info(data)
+        if image_format == "JPEG":
+            for factor, reduced_flags in REDUCED_DECODE_MODES:
+                if all(side // factor >= target * oversampling for side, target in zip(size, image_shape)):
+                    flags = reduced_flags
+                    break
+    return cv2.imdecode(buffer, flags)
+
+def to_grayscale_uint8(array):
+    """Raw image array (grayscale or color, uint8 or float in [0, 1]) as 2-D grayscale uint8"""
+    array = np.squeeze(np.asarray(array))
+    if array.ndim == 3:
+        array = cv2.cvtColor(array, cv2.COLOR_RGBA2GRAY if array.shape[-1] == 4 else cv2.COLOR_RGB2GRAY)
+    if array.dtype != np.uint8:
+        array = np.clip(array * 255.0 if array.max() <= 1.0 else array, 0, 255).astype(np.uint8)
+    return array
+
+def crop_to_ink(image, margin=0.05, outlier_fraction=0.005):
+    """Crop a grayscale page (dark ink on light paper) to the bounding box of its ink.
+
+    Ink is separated from paper with Otsu's threshold. The box spans the ink
+    pixels between the ``outlier_fraction`` and ``1 - outlier_fraction``
+    quantiles of each axis, so isolated specks do not widen it, and is padded
+    by ``margin`` of its size. Pages without ink are returned unchanged.
+    """
+    _, ink = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    ys, xs = np.nonzero(ink)
+    if len(xs) == 0:
+        return image
+    (x0, x1), (y0, y1) = (np.quantile(axis, [outlier_fraction, 1 - outlier_fraction]) for axis in (xs, ys))
+    pad_x, pad_y = margin * (x1 - x0) + 1, margin * (y1 - y0) + 1
+    height, width = image.shape
+    return image[max(0, int(y0 - pad_y)):min(height, int(y1 + pad_y) + 1),
+                 max(0, int(x0 - pad_x)):min(width, int(x1 + pad_x) + 1)]
+
+def load_grayscale(source, image_shape=None, oversampling=4):
+    """Grayscale uint8 array from encoded bytes, a file path or a raw array; None if it cannot be decoded"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return decode_grayscale(source, image_shape, oversampling)
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return decode_grayscale(f.read(), image_shape, oversampling)
+    return to_grayscale_uint8(source)
+
+def resize_grayscale(image, image_shape, crop=False):
+    """Optionally crop to the ink, then resize to ``image_shape`` (width, height)"""
+    if crop:
+        image = crop_to_ink(image)
+    return cv2.resize(image, image_shape, interpolation=cv2.INTER_LANCZOS4)
+
+def finish_batch(resized, dtype=np.float32):
+    """Invert a [N, H, W] uint8 batch (ink becomes bright) and add the channel axis.
+
+    Returns uint8 in [0, 255] or float32 in [0, 1].
+    """
+    inverted = 255 - resized[..., np.newaxis]
+    if np.dtype(dtype) == np.uint8:
+        return inverted
+    return inverted.astype(np.float32) * np.float32(1.0 / 255.0)
+
+def preprocess_batch(sources, image_shape, crop=False, oversampling=4, dtype=np.float32):
+    """Preprocess images for the model, as used by both training and serving.
+
+    ``sources`` are encoded bytes, file paths or raw grayscale/color arrays.
+    Each is decoded to grayscale (reduced-resolution for large JPEGs),
+    optionally cropped to its ink, resized with Lanczos interpolation and
+    inverted. Returns a [N, height, width, 1] batch of ``dtype`` and a boolean
+    mask of the entries that could be decoded (failed entries are zero).
+    """
+    width, height = image_shape
+    resized = np.full((len(sources), height, width), 255, dtype=np.uint8)
+    ok = np.zeros(len(sources), dtype=bool)
+    for i, source in enumerate(sources):
+        try:
+            image = load_grayscale(source, image_shape, oversampling)
+            if image is None or image.size == 0:
+                continue
+            resized[i] = resize_grayscale(image, image_shape, crop)
+            ok[i] = True
+        except (cv2.error, OSError, ValueError, TypeError):
+            continue
+    return finish_batch(resized, dtype), ok
@@ -0,0 +1,140 @@
+import json
+import os
+import numpy as np
+from config.config import Config
+
+class ShardedImages:
+    """Read-only view over memory-mapped uint8 image shards, indexable by global image index"""
+
+    def __init__(self, shard_paths, count, shard_size):
+        self._shards = [np.load(path, mmap_mode="r") for path in shard_paths]
+        self.shard_size = shard_size
+        self.count = count
+        self.dtype = np.uint8
+        self.shape = (count,) + (self._shards[0].shape[1:] if self._shards else ())
+
+    def __len__(self):
+        return self.count
+
+    def gather(self, indices):
+        """Copy the requested images out of the shards, touching only the pages they live on"""
+        indices = np.asarray(indices, dtype=np.int64)
+        out = np.empty((len(indices),) + self.shape[1:], dtype=np.uint8)
+        shard_ids, offsets = np.divmod(indices, self.shard_size)
+        for shard_id in np.unique(shard_ids):
+            mask = shard_ids == shard_id
+            out[mask] = self._shards[shard_id][offsets[mask]]
+        return out
+
+    def __getitem__(self, indices):
+        if np.isscalar(indices):
+            return self.gather([indices])[0]
+        return self.gather(indices)
+
+class ShardedDataset:
+    """Preprocessed dataset packed once into fixed-size uint8 shard files plus a manifest.
+    
+    Shards live under a directory keyed by IMAGE_SHAPE, PREPROCESSING_VERSION
+    and PREPROCESS_CROP_TO_INK, so changing any of them starts a fresh pack. The manifest maps each source
+    image (writer, genuine/forged, path) to its shard and offset; new images are
+    appended to the last shard without touching the ones already packed.
+    """
+
+    MANIFEST = "manifest.json"
+
+    def __init__(self, config=None):
+        self.config = config or Config()
+        width, height = self.config.IMAGE_SHAPE
+        self.root = os.path.join(
+            self.config.PACKED_DATASET_PATH,
+            f"{width}x{height}-v{self.config.PREPROCESSING_VERSION}" + ("-ink" if self.config.PREPROCESS_CROP_TO_INK else "")
+        )
+        self.manifest_path = os.path.join(self.root, self.MANIFEST)
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self):
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            if (tuple(manifest["image_shape"]) == tuple(self.config.INPUT_SHAPE)
+                    and manifest["preprocessing_version"] == self.config.PREPROCESSING_VERSION):
+                return manifest
+        return {
+            "image_shape": list(self.config.INPUT_SHAPE),
+            "preprocessing_version": self.config.PREPROCESSING_VERSION,
+            "shard_size": self.config.SHARD_SIZE,
+            "shards": [],
+            "entries": []
+        }
+
+    def _save_manifest(self):
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def exists(self):
+        return len(self.manifest["entries"]) > 0
+
+    def __len__(self):
+        return len(self.manifest["entries"])
+
+    def pack(self, dataset, orig, preprocessor):
+        """Preprocess and append every image of the dataset that is not packed yet"""
+        packed = {entry["path"] for entry in self.manifest["entries"]}
+        new_entries = []
+        for writer in dataset:
+            for position, path in enumerate(dataset[writer]):
+                if str(path) not in packed:
+                    kind = "original" if position < len(orig[writer]) else "forgery"
+                    new_entries.append({"writer": int(writer), "kind": kind, "path": str(path)})
+        
+        if new_entries:
+            images = preprocessor.preprocess_images([entry["path"] for entry in new_entries], dtype=np.uint8)
+            self.append(new_entries, images)
+        return len(new_entries)
+
+    def append(self, entries, images):
+        """Write preprocessed images (uint8, or float in [0, 1]) into the shards and record them in the manifest"""
+        os.makedirs(self.root, exist_ok=True)
+        shard_size = self.manifest["shard_size"]
+        shape = tuple(self.manifest["image_shape"])
+        
+        shard, shard_id = None, None
+        for entry, image in zip(entries, images):
+            index = len(self.manifest["entries"])
+            entry_shard_id, offset = divmod(index, shard_size)
+            if entry_shard_id != shard_id:
+                if shard is not None:
+                    shard.flush()
+                shard_id = entry_shard_id
+                shard = self._open_shard(shard_id, shard_size, shape)
+            shard[offset] = image if image.dtype == np.uint8 else np.round(np.clip(image, 0.0, 1.0) * 255).astype(np.uint8)
+            self.manifest["entries"].append(dict(entry, shard=shard_id, offset=offset))
+        if shard is not None:
+            shard.flush()
+        
+        self._save_manifest()
+
+    def _open_shard(self, shard_id, shard_size, shape):
+        name = f"shard_{shard_id:05d}.npy"
+        path = os.path.join(self.root, name)
+        if shard_id < len(self.manifest["shards"]):
+            return np.load(path, mmap_mode="r+")
+        self.manifest["shards"].append(name)
+        return np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=(shard_size,) + shape)
+
+    def open(self):
+        """Memory-map the shards; returns the images and the per-writer index used by create_pairs"""
+        shard_paths = [os.path.join(self.root, name) for name in self.manifest["shards"]]
+        images = ShardedImages(shard_paths, len(self.manifest["entries"]), self.manifest["shard_size"])
+        
+        image_index = {}
+        for index, entry in enumerate(self.manifest["entries"]):
+            writer = image_index.setdefault(entry["writer"], {"originals": [], "forgeries": []})
+            writer["originals" if entry["kind"] == "original" else "forgeries"].append(index)
+        image_index = {
+            writer: {kind: np.array(indices, dtype=np.int32) for kind, indices in values.items()}
+            for writer, values in image_index.items()
+        }
+        return images, image_index
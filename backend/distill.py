@@ -0,0 +1,125 @@
+import argparse
+import json
+import os
+import time
+import tensorflow as tf
+from benchmark import time_calls
+from config.config import Config
+from data.dataset_loader import DatasetLoader
+from data.data_preprocessing import DataPreprocessor, gather_float_images
+from evaluate import embed_unique_images, score_pairs, verification_metrics
+from models.siamese import SiameseModel
+from serving.inference import load_inference_model
+from train import load_training_data
+from utils.losses import contrastive_loss
+
+LATENCY_BATCH_SIZES = (1, 32)
+
+def _profile(inference_model, images, test_pairs, batch_size, path, repeats=50):
+    """Test-pair EER/AUC, tower latency, parameter count and size of one model"""
+    image_ids, embeddings = embed_unique_images(inference_model, images, test_pairs[:, :2], batch_size)
+    metrics = verification_metrics(score_pairs(inference_model, image_ids, embeddings, test_pairs), test_pairs[:, 2])
+    probe = gather_float_images(images, image_ids[:max(LATENCY_BATCH_SIZES)])
+    tower = SiameseModel.get_base_model(inference_model.model)
+    return {
+        "path": path,
+        "architecture": SiameseModel.get_architecture(inference_model.model),
+        "tower_parameters": int(tower.count_params()),
+        "tower_weights_mb": sum(w.size * w.dtype.itemsize for w in tower.get_weights()) / 2 ** 20,
+        "size_mb": os.path.getsize(path) / 2 ** 20,
+        "auc": metrics["auc"],
+        "eer": metrics["eer"],
+        "threshold": metrics["threshold"],
+        "accuracy": metrics["recommended"]["accuracy"],
+        "embed_latency_ms_p50": {
+            str(size): time_calls(lambda: inference_model.embed(probe[:size]), repeats)["p50_ms"]
+            for size in LATENCY_BATCH_SIZES
+        }
+    }
+
+def distill_model(teacher_path=None, student_path=None, epochs=None):
+    """Train a compact tower to reproduce the trained SigNet's embeddings.
+
+    The teacher embeds every training and validation image once; the student
+    tower (``Config.ARCHITECTURE = "compact"``) then regresses those 128-d
+    embeddings with a mean squared error, so it needs neither pairs nor
+    labels. The student reuses the teacher's Dense head unchanged, so its
+    scores, thresholds and enrolled-embedding format stay comparable. Both
+    models are then evaluated on the test pairs and the accuracy, latency and
+    size tradeoff is written to ``Config.DISTILL_REPORT_PATH``.
+    """
+    config = Config()
+    teacher_path = teacher_path or config.MODEL_SAVE_PATH
+    student_path = student_path or config.DISTILLED_MODEL_PATH
+    epochs = epochs or config.DISTILL_EPOCHS
+
+    preprocessor = DataPreprocessor(config)
+    images, image_index = load_training_data(config, DatasetLoader(config), preprocessor)
+    train_pairs, val_pairs, test_pairs = preprocessor.split_data(preprocessor.create_pairs(image_index))
+
+    print(f"Loading teacher {teacher_path}...")
+    teacher = load_inference_model(teacher_path, custom_objects={'contrastive_loss': contrastive_loss})
+
+    print("Embedding training and validation images with the teacher...")
+    train_ids, train_targets = embed_unique_images(teacher, images, train_pairs[:, :2], config.BATCH_SIZE)
+    val_ids, val_targets = embed_unique_images(teacher, images, val_pairs[:, :2], config.BATCH_SIZE)
+    print(f"Distillation images: {len(train_ids)} training, {len(val_ids)} validation")
+
+    student = SiameseModel(config).create_siamese_model(architecture="compact")
+    head = SiameseModel.get_head(student)
+    head.set_weights([teacher.head_kernel, teacher.head_bias])
+    head.trainable = False
+    tower = SiameseModel.get_base_model(student)
+    tower.compile(optimizer=tf.keras.optimizers.AdamW(learning_rate=config.DISTILL_LEARNING_RATE,
+                                                      weight_decay=config.WEIGHT_DECAY),
+                  loss="mse")
+
+    print("Distilling...")
+    start = time.perf_counter()
+    history = tower.fit(
+        preprocessor.make_image_dataset(images, train_ids, train_targets, config.DISTILL_BATCH_SIZE, shuffle=True),
+        validation_data=preprocessor.make_image_dataset(images, val_ids, val_targets, config.DISTILL_BATCH_SIZE),
+        epochs=epochs,
+        callbacks=[tf.keras.callbacks.EarlyStopping(patience=config.DISTILL_PATIENCE, restore_best_weights=True)],
+        verbose=1
+    )
+    distill_seconds = time.perf_counter() - start
+    student.save(student_path)
+    print(f"Student saved to {student_path}")
+
+    print("Comparing teacher and student on the test pairs...")
+    student = load_inference_model(student_path, custom_objects={'contrastive_loss': contrastive_loss})
+    report = {
+        "teacher": _profile(teacher, images, test_pairs, config.BATCH_SIZE, teacher_path),
+        "student": _profile(student, images, test_pairs, config.BATCH_SIZE, student_path),
+        "epochs": len(history.history["loss"]),
+        "best_val_mse": float(min(history.history["val_loss"])),
+        "distill_seconds": distill_seconds,
+        "test_pairs": int(len(test_pairs))
+    }
+    teacher_report, student_report = report["teacher"], report["student"]
+    report["eer_delta"] = student_report["eer"] - teacher_report["eer"]
+    report["speedup"] = {
+        size: teacher_report["embed_latency_ms_p50"][size] / student_report["embed_latency_ms_p50"][size]
+        for size in student_report["embed_latency_ms_p50"]
+    }
+    with open(config.DISTILL_REPORT_PATH, "w") as f:
+        json.dump(report, f, indent=2)
+
+    header = "".join(f"{f'p50 ms @{size}':>13}" for size in LATENCY_BATCH_SIZES)
+    print(f"\n{'model':<10}{'params':>12}{'size MB':>10}{header}{'AUC':>8}{'EER':>8}")
+    for name in ("teacher", "student"):
+        result = report[name]
+        latencies = "".join(f"{result['embed_latency_ms_p50'][str(size)]:>13.2f}" for size in LATENCY_BATCH_SIZES)
+        print(f"{name:<10}{result['tower_parameters']:>12,}{result['size_mb']:>10.1f}{latencies}"
+              f"{result['auc']:>8.4f}{result['eer'] * 100:>7.2f}%")
+    print(f"\nReport written to {config.DISTILL_REPORT_PATH}")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distill the trained SigNet into the compact architecture")
+    parser.add_argument("--teacher", default=None, help="Trained h5 model (defaults to Config.MODEL_SAVE_PATH)")
+    parser.add_argument("--output", default=None, help="Student h5 model (defaults to Config.DISTILLED_MODEL_PATH)")
+    parser.add_argument("--epochs", type=int, default=None, help="Defaults to Config.DISTILL_EPOCHS")
+    args = parser.parse_args()
+    distill_model(args.teacher, args.output, args.epochs)
@@ -0,0 +1,122 @@
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+def free_ports(count):
+    """Reserve ``count`` free localhost ports (released right before the workers bind them)"""
+    sockets = [socket.socket() for _ in range(count)]
+    for sock in sockets:
+        sock.bind(("localhost", 0))
+    ports = [sock.getsockname()[1] for sock in sockets]
+    for sock in sockets:
+        sock.close()
+    return ports
+
+def launch(num_workers, threads_per_worker=None, epochs=None, model_save_path=None, report_dir=None):
+    """Train with ``num_workers`` local processes under MultiWorkerMirroredStrategy.
+
+    Each worker gets a TF_CONFIG for a localhost cluster and its share of the
+    CPU cores. Returns the per-worker throughput reports.
+    """
+    threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // num_workers)
+    report_dir = report_dir or tempfile.mkdtemp(prefix="signet-workers-")
+    cluster = {"worker": [f"localhost:{port}" for port in free_ports(num_workers)]}
+
+    processes = []
+    for index in range(num_workers):
+        env = dict(os.environ, TF_CONFIG=json.dumps({"cluster": cluster, "task": {"type": "worker", "index": index}}))
+        command = [sys.executable, os.path.abspath(__file__), "worker",
+                   "--threads", str(threads_per_worker), "--report", os.path.join(report_dir, f"worker-{index}.json")]
+        if epochs:
+            command += ["--epochs", str(epochs)]
+        if model_save_path:
+            command += ["--model", model_save_path]
+        processes.append(subprocess.Popen(command, env=env))
+
+    # If one worker dies the others block in collectives; take them down too
+    failed = False
+    while any(process.poll() is None for process in processes):
+        if any(process.returncode not in (None, 0) for process in processes):
+            failed = True
+            for process in processes:
+                if process.poll() is None:
+                    process.terminate()
+        time.sleep(1)
+    if failed or any(process.returncode != 0 for process in processes):
+        raise RuntimeError(f"Worker exit codes: {[process.returncode for process in processes]}")
+
+    reports = []
+    for index in range(num_workers):
+        with open(os.path.join(report_dir, f"worker-{index}.json")) as f:
+            reports.append(json.load(f))
+    return reports
+
+def run_worker(threads, report_path, epochs=None, model_save_path=None):
+    """Entry point of one worker process"""
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(max(1, threads // 2))
+
+    from config.config import Config
+    from train import train_model
+    from utils.callbacks import ThroughputCallback
+    if epochs:
+        Config.EPOCHS = epochs
+
+    tf_config = json.loads(os.environ["TF_CONFIG"])
+    index, num_workers = tf_config["task"]["index"], len(tf_config["cluster"]["worker"])
+    config = Config()
+    samples_per_step = (2 * config.IN_BATCH_WRITERS * config.IN_BATCH_SAMPLES
+                        if config.TRAINING_MODE == "in_batch" else config.BATCH_SIZE)
+    throughput = ThroughputCallback(samples_per_step, index, num_workers)
+    train_model(model_save_path=model_save_path, callbacks=[throughput], plot_history=False)
+
+    with open(report_path, "w") as f:
+        json.dump({"worker": index, "workers": num_workers, "threads": threads,
+                   "samples_per_sec": throughput.samples_per_sec}, f)
+
+def _total_throughput(reports):
+    """Cluster samples/sec of the last epoch (the first one includes tracing)"""
+    return sum(report["samples_per_sec"][-1] for report in reports)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Data-parallel multi-worker CPU training on one machine")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    train_parser = subparsers.add_parser("train", help="Train with several local worker processes")
+    train_parser.add_argument("--workers", type=int, default=2)
+    train_parser.add_argument("--threads-per-worker", type=int, default=None,
+                              help="TensorFlow threads per worker (defaults to cores / workers)")
+    train_parser.add_argument("--epochs", type=int, default=None, help="Override Config.EPOCHS")
+    train_parser.add_argument("--model", default=None, help="Where the chief saves the model")
+    scaling_parser = subparsers.add_parser("scaling", help="Measure samples/sec for 1..N workers")
+    scaling_parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+    scaling_parser.add_argument("--epochs", type=int, default=2)
+    worker_parser = subparsers.add_parser("worker", help=argparse.SUPPRESS)
+    worker_parser.add_argument("--threads", type=int, required=True)
+    worker_parser.add_argument("--report", required=True)
+    worker_parser.add_argument("--epochs", type=int, default=None)
+    worker_parser.add_argument("--model", default=None)
+    args = parser.parse_args()
+
+    if args.command == "worker":
+        run_worker(args.threads, args.report, args.epochs, args.model)
+    elif args.command == "train":
+        reports = launch(args.workers, args.threads_per_worker, args.epochs, args.model)
+        print(f"Cluster throughput: {_total_throughput(reports):.1f} samples/sec over {args.workers} workers")
+    else:
+        # One core per worker, so the comparison isolates data-parallel scaling
+        scratch = tempfile.mkdtemp(prefix="signet-scaling-")
+        results = []
+        for workers in range(1, args.max_workers + 1):
+            reports = launch(workers, threads_per_worker=1, epochs=args.epochs,
+                             model_save_path=os.path.join(scratch, "siamese_model.h5"))
+            results.append((workers, _total_throughput(reports)))
+        print(f"\n{'workers':>8}{'samples/sec':>14}{'speedup':>10}{'efficiency':>12}")
+        for workers, throughput in results:
+            speedup = throughput / results[0][1]
+            print(f"{workers:>8}{throughput:>14.1f}{speedup:>10.2f}{speedup / workers:>12.0%}")
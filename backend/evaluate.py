@@ -1,24 +1,161 @@
-import tensorflow as tf
+import argparse
+import json
+import time
+import numpy as np
 from config.config import Config
+from data.data_preprocessing import DataPreprocessor, gather_float_images
 from utils.losses import contrastive_loss
 
-def evaluate_model(model_path=None, test_pairs=None, test_labels=None):
+def embed_unique_images(inference_model, images, image_ids, batch_size):
+    """Embed every image in ``image_ids`` exactly once; returns an id -> row lookup and the embeddings"""
+    image_ids = np.unique(image_ids)
+    embeddings = np.concatenate([
+        inference_model.embed(gather_float_images(images, image_ids[i:i + batch_size]))
+        for i in range(0, len(image_ids), batch_size)
+    ]) if len(image_ids) else np.zeros((0, inference_model.embedding_dim), np.float32)
+    return image_ids, embeddings
+
+def score_pairs(inference_model, image_ids, embeddings, pairs, chunk=65536):
+    """Score pair triples from cached embeddings with the Siamese head, in vectorized chunks"""
+    rows_a = np.searchsorted(image_ids, pairs[:, 0])
+    rows_b = np.searchsorted(image_ids, pairs[:, 1])
+    return np.concatenate([
+        inference_model.score_embeddings(embeddings[rows_a[i:i + chunk]], embeddings[rows_b[i:i + chunk]])
+        for i in range(0, len(pairs), chunk)
+    ]) if len(pairs) else np.zeros(0, np.float32)
+
+def verification_metrics(scores, labels, curve_points=101):
+    """ROC/AUC, equal error rate and FAR/FRR curves for genuine (1) vs. forged (0) pair scores.
+
+    A pair is accepted as genuine when its score is at or above the threshold
+    (``>=``, as ``roc_curve`` counts it and the API decides), so FAR is the
+    fraction of forged pairs scored at or above a threshold and FRR the fraction
+    of genuine pairs scored below it. The recommended threshold is the one where
+    both are equal (the EER operating point).
+    """
+    from sklearn.metrics import roc_auc_score, roc_curve
+
+    scores = np.asarray(scores, dtype=np.float64)
+    labels = np.asarray(labels).astype(bool)
+    far, tpr, thresholds = roc_curve(labels, scores)
+    frr = 1.0 - tpr
+    thresholds = np.clip(thresholds, 0.0, 1.0)
+
+    eer_index = int(np.argmin(np.abs(far - frr)))
+    eer = float((far[eer_index] + frr[eer_index]) / 2)
+    threshold = float(thresholds[eer_index])
+
+    # FAR/FRR at evenly spaced thresholds, cheap to plot or ship in a response
+    grid = np.linspace(0.0, 1.0, curve_points)
+    forged, genuine = np.sort(scores[~labels]), np.sort(scores[labels])
+    far_curve = 1.0 - np.searchsorted(forged, grid, side='left') / max(len(forged), 1)
+    frr_curve = np.searchsorted(genuine, grid, side='left') / max(len(genuine), 1)
+
+    def at(t):
+        return {
+            'threshold': float(t),
+            'far': float(np.mean(scores[~labels] >= t)),
+            'frr': float(np.mean(scores[labels] < t)),
+            'accuracy': float(np.mean((scores >= t) == labels))
+        }
+
+    return {
+        'auc': float(roc_auc_score(labels, scores)),
+        'eer': eer,
+        'threshold': threshold,
+        'recommended': at(threshold),
+        'at_0.5': at(0.5),
+        'roc': {'far': far.tolist(), 'tpr': tpr.tolist(), 'thresholds': thresholds.tolist()},
+        'curves': {'thresholds': grid.tolist(), 'far': far_curve.tolist(), 'frr': frr_curve.tolist()}
+    }
+
+def load_evaluation(config=None, model_version=None):
+    """Return the saved evaluation report, or None if there is none for ``model_version``"""
+    config = config or Config()
+    try:
+        with open(config.EVALUATION_PATH) as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if model_version is not None and report.get('model_version') != model_version:
+        return None
+    return report
+
+def evaluate_model(model_path=None, images=None, test_pairs=None, mode="embeddings", save=True):
+    """Evaluate a trained model on the test pairs.
+
+    The default ``embeddings`` mode embeds each unique test image once with the
+    base tower and scores every pair from the cached embeddings, so its cost
+    grows with the number of images rather than pairs. It reports ROC/AUC, EER,
+    FAR/FRR and a recommended decision threshold, written to
+    ``Config.EVALUATION_PATH`` for the API to pick up. ``keras`` runs
+    ``model.evaluate`` over the materialized pairs instead.
+    """
     config = Config()
-    
+
     if model_path is None:
         model_path = config.MODEL_SAVE_PATH
-    
-    # Load model
+
+    preprocessor = DataPreprocessor(config)
+    if images is None or test_pairs is None:
+        from data.dataset_loader import DatasetLoader
+        from train import load_training_data
+        images, image_index = load_training_data(config, DatasetLoader(config), preprocessor)
+        _, _, test_pairs = preprocessor.split_data(preprocessor.create_pairs(image_index))
+
+    if mode == "keras":
+        import tensorflow as tf
+        import models.layers  # noqa: F401  (registers the custom SigNet layers for deserialization)
+        print("Loading model...")
+        model = tf.keras.models.load_model(model_path, custom_objects={'contrastive_loss': contrastive_loss})
+        print("Evaluating model...")
+        loss, accuracy = model.evaluate(preprocessor.make_pair_dataset(images, test_pairs), verbose=1)
+        print(f"Test Accuracy: {accuracy * 100:.2f}%")
+        print(f"Test Loss: {loss:.4f}")
+        return {'loss': float(loss), 'accuracy': float(accuracy)}
+
+    from serving.inference import load_inference_model
     print("Loading model...")
-    model = tf.keras.models.load_model(model_path, custom_objects={'contrastive_loss': contrastive_loss})
-    
-    # Evaluate model
-    print("Evaluating model...")
-    loss, accuracy = model.evaluate([test_pairs[:, 0], test_pairs[:, 1]], test_labels, verbose=1)
-    print(f"Test Accuracy: {accuracy * 100:.2f}%")
-    print(f"Test Loss: {loss:.4f}")
-    
-    return loss, accuracy
+    inference_model = load_inference_model(model_path, custom_objects={'contrastive_loss': contrastive_loss})
+
+    print("Embedding test images...")
+    start = time.perf_counter()
+    image_ids, embeddings = embed_unique_images(inference_model, images, test_pairs[:, :2], config.BATCH_SIZE)
+    embed_seconds = time.perf_counter() - start
+
+    print("Scoring test pairs...")
+    start = time.perf_counter()
+    scores = score_pairs(inference_model, image_ids, embeddings, test_pairs)
+    score_seconds = time.perf_counter() - start
+
+    report = verification_metrics(scores, test_pairs[:, 2])
+    report.update({
+        'model_path': model_path,
+        'model_version': inference_model.version,
+        'pairs': int(len(test_pairs)),
+        'images': int(len(image_ids)),
+        'embed_seconds': embed_seconds,
+        'score_seconds': score_seconds,
+        'evaluated_at': time.strftime("%Y-%m-%dT%H:%M:%S")
+    })
+
+    print(f"Embedded {len(image_ids)} images in {embed_seconds:.2f}s, scored {len(test_pairs)} pairs in {score_seconds:.2f}s")
+    print(f"AUC: {report['auc']:.4f}")
+    print(f"EER: {report['eer'] * 100:.2f}% at threshold {report['threshold']:.4f}")
+    print(f"At that threshold: FAR {report['recommended']['far'] * 100:.2f}%, "
+          f"FRR {report['recommended']['frr'] * 100:.2f}%, accuracy {report['recommended']['accuracy'] * 100:.2f}%")
+    print(f"At threshold 0.5: accuracy {report['at_0.5']['accuracy'] * 100:.2f}%")
+
+    if save:
+        with open(config.EVALUATION_PATH, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Evaluation report written to {config.EVALUATION_PATH}")
+    return report
 
 if __name__ == "__main__":
-    evaluate_model()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Evaluate the trained Siamese model on the test pairs")
+    parser.add_argument("--model", default=None, help="Model or export directory (defaults to Config.MODEL_SAVE_PATH)")
+    parser.add_argument("--mode", choices=("embeddings", "keras"), default="embeddings",
+                        help="Embed each image once and report ROC/EER (default) or run model.evaluate per pair")
+    args = parser.parse_args()
+    evaluate_model(args.model, mode=args.mode)
@@ -0,0 +1,166 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+import tensorflow as tf
+from config.config import Config
+from data.dataset_loader import DatasetLoader
+from data.data_preprocessing import DataPreprocessor, gather_float_images
+from models.siamese import SiameseModel
+from serving.inference import InferenceModel, load_inference_model
+from train import load_training_data
+from utils.losses import contrastive_loss
+
+FORMATS = ("savedmodel", "float32", "float16", "int8")
+
+class _ServingModule(tf.Module):
+    """Inference-only SavedModel with a pair-scoring and an embedding signature"""
+
+    def __init__(self, siamese_model, base_model, input_shape):
+        super().__init__()
+        self.siamese_model = siamese_model
+        self.base_model = base_model
+        spec = tf.TensorSpec((None,) + tuple(input_shape), tf.float32)
+        self.verify = tf.function(self._verify, input_signature=[spec, spec])
+        self.embed = tf.function(self._embed, input_signature=[spec])
+
+    def _verify(self, image_a, image_b):
+        return {"similarity": self.siamese_model([image_a, image_b], training=False)[:, 0]}
+
+    def _embed(self, images):
+        return {"embedding": self.base_model(images, training=False)}
+
+def _size_mb(path):
+    if os.path.isdir(path):
+        return sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(path)
+            for name in names
+        ) / 2**20
+    return os.path.getsize(path) / 2**20
+
+def _save_head(directory, siamese_model):
+    kernel, bias = SiameseModel.get_head_weights(siamese_model)
+    np.savez(os.path.join(directory, "head.npz"), kernel=kernel, bias=bias)
+
+def export_savedmodel(siamese_model, directory, config):
+    """Write an inference-only SavedModel (no Dropout, no Python Lambdas)"""
+    module = _ServingModule(siamese_model, SiameseModel.get_base_model(siamese_model), config.INPUT_SHAPE)
+    tf.saved_model.save(module, directory, signatures={"serving_default": module.verify, "embed": module.embed})
+    _save_head(directory, siamese_model)
+
+def export_tflite(siamese_model, directory, precision, calibration_images=None):
+    """Convert the SigNet tower to TFLite in float32, float16 or int8 (with calibration images)"""
+    converter = tf.lite.TFLiteConverter.from_keras_model(SiameseModel.get_base_model(siamese_model))
+    if precision == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif precision == "int8":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([image[np.newaxis]] for image in calibration_images)
+        # Ops without an int8 kernel (local response normalization) fall back to float
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8, tf.lite.OpsSet.TFLITE_BUILTINS]
+
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "tower.tflite"), "wb") as f:
+        f.write(converter.convert())
+    _save_head(directory, siamese_model)
+
+def _benchmark(inference_model, images_a, images_b, labels, repeats=20, chunk=64):
+    """Single-pair CPU latency and accuracy at the 0.5 threshold"""
+    inference_model.predict_pairs(images_a[:1], images_b[:1])
+    latencies = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        inference_model.predict_pairs(images_a[i % len(images_a)][np.newaxis], images_b[i % len(images_b)][np.newaxis])
+        latencies.append(time.perf_counter() - start)
+
+    scores = np.concatenate([
+        inference_model.predict_pairs(images_a[i:i + chunk], images_b[i:i + chunk])
+        for i in range(0, len(images_a), chunk)
+    ])
+    return scores, {
+        "latency_ms_p50": float(np.percentile(latencies, 50) * 1000),
+        "latency_ms_p95": float(np.percentile(latencies, 95) * 1000),
+        "accuracy": float(np.mean((scores > 0.5) == (labels == 1)))
+    }
+
+def export_model(model_path=None, output_dir=None, formats=FORMATS, calibration_samples=200, eval_pairs=1000):
+    config = Config()
+    model_path = model_path or config.MODEL_SAVE_PATH
+    output_dir = output_dir or config.EXPORT_PATH
+    os.makedirs(output_dir, exist_ok=True)
+
+    print(f"Loading {model_path}...")
+    start = time.perf_counter()
+    trained_model = tf.keras.models.load_model(model_path, custom_objects={'contrastive_loss': contrastive_loss})
+    baseline_load = time.perf_counter() - start
+    siamese_model = SiameseModel(config).create_inference_model(trained_model)
+
+    # Calibration images and evaluation pairs come from the training data
+    preprocessor = DataPreprocessor(config)
+    images, image_index = load_training_data(config, DatasetLoader(config), preprocessor)
+    train_pairs, _, test_pairs = preprocessor.split_data(preprocessor.create_pairs(image_index))
+    rng = np.random.RandomState(config.RANDOM_STATE_TRAIN)
+    calibration_ids = np.unique(train_pairs[:, :2])
+    calibration_ids = np.sort(rng.choice(calibration_ids, min(calibration_samples, len(calibration_ids)), replace=False))
+    calibration_images = gather_float_images(images, calibration_ids)
+    test_pairs = test_pairs[rng.permutation(len(test_pairs))[:eval_pairs]]
+    images_a, images_b = gather_float_images(images, test_pairs[:, 0]), gather_float_images(images, test_pairs[:, 1])
+    labels = test_pairs[:, 2]
+
+    print("Benchmarking h5 baseline...")
+    baseline_scores, baseline = _benchmark(InferenceModel(trained_model), images_a, images_b, labels)
+    baseline.update({"path": model_path, "size_mb": _size_mb(model_path), "load_seconds": baseline_load})
+    report = {"baseline": baseline, "artifacts": {}, "eval_pairs": len(test_pairs),
+              "calibration_samples": len(calibration_images)}
+
+    for fmt in formats:
+        if fmt == "savedmodel":
+            directory = os.path.join(output_dir, "savedmodel")
+            print(f"Exporting SavedModel to {directory}...")
+            export_savedmodel(siamese_model, directory, config)
+        else:
+            directory = os.path.join(output_dir, f"tflite-{fmt}")
+            print(f"Exporting TFLite {fmt} to {directory}...")
+            export_tflite(siamese_model, directory, fmt, calibration_images)
+
+        start = time.perf_counter()
+        artifact = load_inference_model(directory)
+        load_seconds = time.perf_counter() - start
+        scores, result = _benchmark(artifact, images_a, images_b, labels)
+        result.update({
+            "path": directory,
+            "size_mb": _size_mb(directory),
+            "load_seconds": load_seconds,
+            "accuracy_delta": result["accuracy"] - baseline["accuracy"],
+            "mean_abs_score_diff": float(np.mean(np.abs(scores - baseline_scores))),
+            "speedup": baseline["latency_ms_p50"] / result["latency_ms_p50"]
+        })
+        report["artifacts"][fmt] = result
+
+    with open(os.path.join(output_dir, "report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n{'artifact':<12}{'size MB':>10}{'load s':>9}{'p50 ms':>9}{'accuracy':>10}{'acc delta':>11}{'|score diff|':>14}")
+    print(f"{'h5':<12}{baseline['size_mb']:>10.1f}{baseline['load_seconds']:>9.2f}"
+          f"{baseline['latency_ms_p50']:>9.2f}{baseline['accuracy']:>10.4f}{'':>11}{'':>14}")
+    for fmt, result in report["artifacts"].items():
+        print(f"{fmt:<12}{result['size_mb']:>10.1f}{result['load_seconds']:>9.2f}{result['latency_ms_p50']:>9.2f}"
+              f"{result['accuracy']:>10.4f}{result['accuracy_delta']:>+11.4f}{result['mean_abs_score_diff']:>14.6f}")
+    print(f"\nReport written to {os.path.join(output_dir, 'report.json')}")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the trained Siamese model for inference")
+    parser.add_argument("--model", default=None, help="Trained h5 model (defaults to Config.MODEL_SAVE_PATH)")
+    parser.add_argument("--output", default=None, help="Output directory (defaults to Config.EXPORT_PATH)")
+    parser.add_argument("--formats", default=",".join(FORMATS),
+                        help=f"Comma-separated subset of: {', '.join(FORMATS)}")
+    parser.add_argument("--calibration-samples", type=int, default=200,
+                        help="Training images used to calibrate int8 quantization")
+    parser.add_argument("--eval-pairs", type=int, default=1000,
+                        help="Test pairs used for the accuracy comparison")
+    args = parser.parse_args()
+    export_model(args.model, args.output, tuple(args.formats.split(",")), args.calibration_samples, args.eval_pairs)
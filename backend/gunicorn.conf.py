@@ -0,0 +1,32 @@
+"""Gunicorn settings for the signature verification API.
+
+    gunicorn -c gunicorn.conf.py app:app
+
+With ``preload_app`` the master imports the app and its heavy dependencies
+(TensorFlow, OpenCV) once, and forked workers share them copy-on-write. The
+TensorFlow runtime is not fork-safe once it has executed an op, so every worker
+still loads and warms up its own Keras/SavedModel copy, in the background, after
+the fork; TFLite exports are read in the master and their flatbuffers shared.
+Workers answer /api/health immediately and /api/ready once their model is
+warmed up.
+"""
+import gc
+import os
+
+bind = os.environ.get("SIGNET_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("SIGNET_WORKERS", "2"))
+# Concurrent requests within a worker are grouped into batches by the micro-batcher
+threads = int(os.environ.get("SIGNET_THREADS", "8"))
+timeout = 300
+preload_app = os.environ.get("SIGNET_PRELOAD", "1") == "1"
+
+def when_ready(server):
+    if preload_app:
+        import app
+        app.preload()
+        # Keep preloaded objects out of the collector so it does not touch (and copy) their pages
+        gc.freeze()
+
+def post_fork(server, worker):
+    import app
+    app.load_model(background=True)
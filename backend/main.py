@@ -9,11 +9,11 @@ def main():
     
     # Train model
     print("Starting training...")
-    model, (test_pairs, test_labels) = train_model()
+    model, (images, test_pairs) = train_model()
     
     # Evaluate model
     print("Starting evaluation...")
-    evaluate_model(test_pairs=test_pairs, test_labels=test_labels)
+    evaluate_model(images=images, test_pairs=test_pairs)  # Also saves the recommended decision threshold
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
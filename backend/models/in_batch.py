@@ -0,0 +1,129 @@
+import tensorflow as tf
+from config.config import Config
+from models.siamese import SiameseModel
+from utils.losses import contrastive_loss, triplet_loss
+
+MINING_MODES = ("all", "hard", "semi-hard")
+
+class InBatchSiameseTrainer(tf.keras.Model):
+    """Train a Siamese model on all pairs formed inside writer-balanced batches.
+
+    Every step embeds the batch once with the shared tower and scores all N x N
+    pairs with the Dense head. Genuine pairs are two originals of the same
+    writer. Negatives pair an original (the anchor) with a forgery of the same
+    writer and, with ``IN_BATCH_CROSS_WRITER``, with another writer's original.
+    ``MINING`` chooses which negatives of each anchor enter the loss: all of
+    them, the ``MINING_HARD_NEGATIVES`` most similar ones, or the semi-hard
+    ones scoring within ``MINING_MARGIN`` below the anchor's hardest genuine pair.
+
+    Validation runs on ordinary ((image_a, image_b), label) pair batches.
+    """
+
+    def __init__(self, siamese_model, config=None, **kwargs):
+        super().__init__(**kwargs)
+        config = config or Config()
+        if config.MINING not in MINING_MODES:
+            raise ValueError(f"Unknown mining mode {config.MINING!r}, expected one of {MINING_MODES}")
+        self.siamese_model = siamese_model
+        self.base_model = SiameseModel.get_base_model(siamese_model)
+        self.head = SiameseModel.get_head(siamese_model)
+        self.mining = config.MINING
+        self.hard_negatives = config.MINING_HARD_NEGATIVES
+        self.mining_margin = config.MINING_MARGIN
+        self.cross_writer = config.IN_BATCH_CROSS_WRITER
+        self.loss_type = config.IN_BATCH_LOSS
+        self.triplet_margin = config.TRIPLET_MARGIN
+        self.contrastive_args = {"margin": config.MARGIN, "alpha": config.ALPHA, "beta": config.BETA}
+        self.loss_tracker = tf.keras.metrics.Mean(name="loss")
+        self.accuracy_tracker = tf.keras.metrics.Mean(name="accuracy")
+        self.pairs_tracker = tf.keras.metrics.Mean(name="pairs")
+
+    @property
+    def metrics(self):
+        return [self.loss_tracker, self.accuracy_tracker, self.pairs_tracker]
+
+    def call(self, images, training=False):
+        """Embed a batch of images with the shared tower"""
+        return self.base_model(images, training=training)
+
+    def pair_scores(self, embeddings):
+        """Siamese similarity of every pair of embeddings in the batch, [N, N]"""
+        differences = tf.abs(embeddings[:, tf.newaxis, :] - embeddings[tf.newaxis, :, :])
+        return self.head(differences)[..., 0]
+
+    def pair_masks(self, writers, forged, image_ids):
+        """Boolean [N, N] masks of genuine pairs and of (original anchor, negative) pairs"""
+        same_writer = tf.equal(writers[:, tf.newaxis], writers[tf.newaxis, :])
+        original = tf.logical_not(forged)
+        both_original = original[:, tf.newaxis] & original[tf.newaxis, :]
+        distinct = tf.not_equal(image_ids[:, tf.newaxis], image_ids[tf.newaxis, :])
+
+        positive = same_writer & both_original & distinct
+        negative = same_writer & original[:, tf.newaxis] & forged[tf.newaxis, :]
+        if self.cross_writer:
+            negative = negative | (tf.logical_not(same_writer) & both_original)
+        return positive, negative
+
+    def mine_negatives(self, scores, positive, negative):
+        """Select the negatives of each anchor (row) that enter the loss"""
+        if self.mining == "all":
+            return negative
+
+        negative_scores = tf.where(negative, scores, -float("inf"))
+        hardest = negative & (scores >= tf.reduce_max(negative_scores, axis=1, keepdims=True))
+        if self.mining == "hard":
+            k = tf.minimum(self.hard_negatives, tf.shape(scores)[1])
+            kth = tf.math.top_k(negative_scores, k=k).values[:, -1:]
+            return negative & (scores >= kth)
+
+        # Semi-hard: less similar than the anchor's hardest genuine pair, but within the margin
+        hardest_positive = tf.reduce_min(tf.where(positive, scores, float("inf")), axis=1, keepdims=True)
+        semi_hard = negative & (scores < hardest_positive) & (scores > hardest_positive - self.mining_margin)
+        # Anchors without a semi-hard negative fall back to their hardest one
+        return tf.where(tf.reduce_any(semi_hard, axis=1, keepdims=True), semi_hard, hardest)
+
+    def mined_loss(self, scores, writers, forged, image_ids):
+        """Loss over the mined pairs; also returns the labels and scores of those pairs"""
+        positive, negative = self.pair_masks(writers, forged, image_ids)
+        selected = self.mine_negatives(scores, positive, negative)
+        mask = positive | selected
+        labels = tf.boolean_mask(tf.cast(positive, tf.float32), mask)
+        pair_scores = tf.boolean_mask(scores, mask)
+
+        if self.loss_type == "triplet":
+            # Every (anchor, genuine, mined negative) triple of the batch
+            triples = positive[:, :, tf.newaxis] & selected[:, tf.newaxis, :]
+            positive_scores = tf.broadcast_to(scores[:, :, tf.newaxis], tf.shape(triples))
+            negative_scores = tf.broadcast_to(scores[:, tf.newaxis, :], tf.shape(triples))
+            loss = triplet_loss(
+                tf.boolean_mask(positive_scores, triples),
+                tf.boolean_mask(negative_scores, triples),
+                margin=self.triplet_margin
+            )
+        else:
+            loss = contrastive_loss(labels, pair_scores, **self.contrastive_args)
+        return loss, labels, pair_scores
+
+    def _update_metrics(self, loss, labels, scores):
+        self.loss_tracker.update_state(loss)
+        self.accuracy_tracker.update_state(tf.reduce_mean(tf.cast(tf.equal(scores > 0.5, labels > 0.5), tf.float32)))
+        self.pairs_tracker.update_state(tf.cast(tf.size(labels), tf.float32))
+        return {metric.name: metric.result() for metric in self.metrics}
+
+    def train_step(self, data):
+        images, (writers, forged, image_ids) = data
+        with tf.GradientTape() as tape:
+            # One tower pass per image, however many pairs it takes part in
+            embeddings = self.base_model(images, training=True)
+            loss, labels, scores = self.mined_loss(self.pair_scores(embeddings), writers, forged, image_ids)
+            # Gradients are summed over replicas by the distribution strategy
+            replica_loss = loss / tf.distribute.get_strategy().num_replicas_in_sync
+        gradients = tape.gradient(replica_loss, self.trainable_variables)
+        self.optimizer.apply_gradients(zip(gradients, self.trainable_variables))
+        return self._update_metrics(loss, labels, scores)
+
+    def test_step(self, data):
+        (images_a, images_b), labels = data
+        labels = tf.cast(labels, tf.float32)
+        scores = self.siamese_model([images_a, images_b], training=False)[:, 0]
+        return self._update_metrics(contrastive_loss(labels, scores, **self.contrastive_args), labels, scores)
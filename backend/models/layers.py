@@ -0,0 +1,39 @@
+import tensorflow as tf
+
+@tf.keras.utils.register_keras_serializable(package="signet")
+class LocalResponseNormalization(tf.keras.layers.Layer):
+    """Serializable replacement for the Lambda wrapping tf.nn.local_response_normalization"""
+
+    def __init__(self, depth_radius=5, bias=2.0, alpha=1e-4, beta=0.75, **kwargs):
+        super().__init__(**kwargs)
+        self.depth_radius = depth_radius
+        self.bias = bias
+        self.alpha = alpha
+        self.beta = beta
+
+    def call(self, inputs):
+        return tf.nn.local_response_normalization(
+            inputs, depth_radius=self.depth_radius, bias=self.bias, alpha=self.alpha, beta=self.beta)
+
+    def compute_output_shape(self, input_shape):
+        return input_shape
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({
+            "depth_radius": self.depth_radius,
+            "bias": self.bias,
+            "alpha": self.alpha,
+            "beta": self.beta
+        })
+        return config
+
+@tf.keras.utils.register_keras_serializable(package="signet")
+class AbsoluteDifference(tf.keras.layers.Layer):
+    """Serializable replacement for the Lambda computing abs(feature_1 - feature_2)"""
+
+    def call(self, inputs):
+        return tf.abs(inputs[0] - inputs[1])
+
+    def compute_output_shape(self, input_shape):
+        return input_shape[0]
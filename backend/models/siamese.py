@@ -1,5 +1,6 @@
 import tensorflow as tf
-from models.signet import SigNetModel
+from models.signet import ARCHITECTURES, SigNetModel
+from models.layers import AbsoluteDifference
 from config.config import Config
 
 class SiameseModel:
@@ -7,9 +8,9 @@ class SiameseModel:
         self.config = config or Config()
         self.signet = SigNetModel(config)
     
-    def create_siamese_model(self):
-        """Create the Siamese model using SigNet as base"""
-        base_model = self.signet.create_base_model()
+    def create_siamese_model(self, include_dropout=True, architecture=None):
+        """Create the Siamese model around a SigNet (or ``architecture``) base tower"""
+        base_model = self.signet.create_base_model(include_dropout=include_dropout, architecture=architecture)
         
         input_a = tf.keras.Input(shape=self.config.INPUT_SHAPE)
         input_b = tf.keras.Input(shape=self.config.INPUT_SHAPE)
@@ -17,10 +18,43 @@ class SiameseModel:
         feature_1 = base_model(input_a)
         feature_2 = base_model(input_b)
         
-        distance = tf.keras.layers.Lambda(
-            lambda tensors: tf.abs(tensors[0] - tensors[1])
-        )([feature_1, feature_2])
+        distance = AbsoluteDifference()([feature_1, feature_2])
         
         output = tf.keras.layers.Dense(1, activation='sigmoid')(distance)
         
-        return tf.keras.Model([input_a, input_b], output)
\ No newline at end of file
+        return tf.keras.Model([input_a, input_b], output)
+    
+    def create_inference_model(self, trained_model):
+        """Rebuild a trained Siamese model without Dropout and copy its weights over"""
+        inference_model = self.create_siamese_model(include_dropout=False,
+                                                    architecture=self.get_architecture(trained_model))
+        inference_model.set_weights(trained_model.get_weights())
+        return inference_model
+
+    @staticmethod
+    def get_base_model(siamese_model):
+        """Return the shared SigNet tower of a Siamese model"""
+        for layer in siamese_model.layers:
+            if isinstance(layer, tf.keras.Model):
+                return layer
+        raise ValueError("Siamese model has no nested base model")
+
+    @staticmethod
+    def get_architecture(siamese_model):
+        """Return the tower architecture of a Siamese model (models saved before the variants existed are SigNet)"""
+        name = SiameseModel.get_base_model(siamese_model).name
+        return name if name in ARCHITECTURES else "signet"
+
+    @staticmethod
+    def get_head(siamese_model):
+        """Return the Dense head applied to abs(feature_1 - feature_2)"""
+        for layer in reversed(siamese_model.layers):
+            if isinstance(layer, tf.keras.layers.Dense):
+                return layer
+        raise ValueError("Siamese model has no Dense head")
+
+    @staticmethod
+    def get_head_weights(siamese_model):
+        """Return (kernel, bias) of the Dense head applied to abs(feature_1 - feature_2)"""
+        kernel, bias = SiameseModel.get_head(siamese_model).get_weights()
+        return kernel, bias
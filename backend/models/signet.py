@@ -1,37 +1,82 @@
-import tensorflow as tf
 from tensorflow import keras
 from keras.models import Sequential
 from keras import layers
 from config.config import Config
+from models.layers import LocalResponseNormalization
+
+# Tower architectures selectable with Config.ARCHITECTURE; each tower model is named after its architecture
+ARCHITECTURES = ("signet", "compact")
 
 class SigNetModel:
     def __init__(self, config=None):
         self.config = config or Config()
     
-    def create_base_model(self):
-        """Create the base SigNet model"""
+    def create_base_model(self, include_dropout=True, architecture=None):
+        """Create the base tower of ``architecture`` (default ``Config.ARCHITECTURE``)"""
+        architecture = architecture or self.config.ARCHITECTURE
+        if architecture == "signet":
+            return self.create_signet_model(include_dropout)
+        if architecture == "compact":
+            return self.create_compact_model(include_dropout)
+        raise ValueError(f"Unknown architecture {architecture!r}; expected one of {ARCHITECTURES}")
+    
+    def create_signet_model(self, include_dropout=True):
+        """Create the base SigNet model (without Dropout layers for inference-only graphs)"""
+        dropout = (lambda rate: [layers.Dropout(rate=rate)]) if include_dropout else (lambda rate: [])
         model = Sequential([
             layers.Conv2D(96, (11, 11), padding="same", activation="relu", 
                          input_shape=self.config.INPUT_SHAPE),
-            layers.Lambda(lambda x: tf.nn.local_response_normalization(
-                x, depth_radius=5, bias=2, alpha=1e-4, beta=0.75)),
+            LocalResponseNormalization(depth_radius=5, bias=2, alpha=1e-4, beta=0.75),
             layers.MaxPooling2D((3, 3), strides=2),
             
             layers.Conv2D(256, (5, 5), padding="same", activation="relu"),
-            layers.Lambda(lambda x: tf.nn.local_response_normalization(
-                x, depth_radius=5, bias=2, alpha=1e-4, beta=0.75)),
+            LocalResponseNormalization(depth_radius=5, bias=2, alpha=1e-4, beta=0.75),
             layers.MaxPool2D((3, 3), strides=2),
-            layers.Dropout(rate=0.3),
+            *dropout(0.3),
             
             layers.Conv2D(384, (3, 3), padding="same", activation="relu"),
             layers.Conv2D(256, (3, 3), padding="same", activation="relu"),
             layers.MaxPool2D((3, 3), strides=2),
-            layers.Dropout(rate=0.3),
+            *dropout(0.3),
             
             layers.Flatten(),
             layers.Dense(1024, activation="relu"),
-            layers.Dropout(0.5),
+            *dropout(0.5),
+            layers.Dense(128, activation="relu")
+        ], name="signet")
+        
+        return model
+    
+    def create_compact_model(self, include_dropout=True):
+        """Create the compact tower: a strided stem, depthwise-separable convolutions and global pooling.
+        
+        The stem halves the resolution before any wide convolution runs, and global
+        average pooling replaces SigNet's Flatten + Dense(1024), which holds most of
+        its parameters. The 128-d ReLU embedding matches SigNet's, so the tower can
+        be distilled from a trained SigNet (see distill.py) and reuse its head.
+        """
+        dropout = (lambda rate: [layers.Dropout(rate=rate)]) if include_dropout else (lambda rate: [])
+        separable = lambda filters: [
+            layers.SeparableConv2D(filters, (3, 3), padding="same", use_bias=False),
+            layers.BatchNormalization(),
+            layers.ReLU()
+        ]
+        model = Sequential([
+            layers.Conv2D(32, (5, 5), strides=2, padding="same", use_bias=False,
+                          input_shape=self.config.INPUT_SHAPE),
+            layers.BatchNormalization(),
+            layers.ReLU(),
+            
+            *separable(64),
+            layers.MaxPool2D((2, 2)),
+            *separable(128),
+            layers.MaxPool2D((2, 2)),
+            *separable(256),
+            *separable(256),
+            
+            layers.GlobalAveragePooling2D(),
+            *dropout(0.3),
             layers.Dense(128, activation="relu")
-        ])
+        ], name="compact")
         
-        return model
\ No newline at end of file
+        return model
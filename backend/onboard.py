@@ -0,0 +1,305 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+import numpy as np
+import tensorflow as tf
+from config.config import Config
+from data.dataset_loader import DatasetLoader
+from data.data_preprocessing import DataPreprocessor, gather_float_images
+from data.shards import ShardedDataset
+from evaluate import score_pairs, verification_metrics
+from models.layers import AbsoluteDifference
+from models.siamese import SiameseModel
+from serving.inference import BaseInferenceModel, load_inference_model, model_version
+from train import load_training_data
+from utils.losses import contrastive_loss, configured_contrastive_loss
+
+def add_writers(config, preprocessor, images, image_index, new_data_path):
+    """Append the writers found under ``new_data_path`` to the dataset.
+
+    ``new_data_path`` has the layout of the training data (``full_org/original_<writer>_<n>.png``
+    and ``full_forg/forgeries_<writer>_<n>.png``). Its writers are renumbered after the
+    existing ones. With the packed dataset the new images are appended to the shards, so a
+    later full retrain includes them; images packed by an earlier run are not added again.
+    Returns the images, the image index and the ids of the new writers.
+    """
+    new_config = Config()
+    new_config.EXTRACT_PATH = new_data_path
+    dataset, orig, _ = DatasetLoader(new_config).load_dataset_paths()
+    if not dataset:
+        raise ValueError(f"No signatures found under {new_data_path}")
+    first_writer = max(image_index) + 1 if image_index else 0
+    dataset = {first_writer + i: paths for i, paths in enumerate(dataset.values())}
+    orig = {first_writer + i: paths for i, paths in enumerate(orig.values())}
+
+    shards = ShardedDataset(config)
+    if config.USE_PACKED_DATASET and shards.exists():
+        print(f"Packed {shards.pack(dataset, orig, preprocessor)} new images into {shards.root}")
+        new_paths = {str(path) for paths in dataset.values() for path in paths}
+        new_writers = {entry["writer"] for entry in shards.manifest["entries"] if entry["path"] in new_paths}
+        images, image_index = shards.open()
+        return images, image_index, sorted(new_writers)
+
+    new_images, new_index = preprocessor.build_image_index(preprocessor.preprocess_dataset(dataset, orig))
+    offset = len(images)
+    images = np.concatenate([gather_float_images(images, np.arange(offset)), new_images])
+    image_index = dict(image_index)
+    for writer, values in new_index.items():
+        image_index[writer] = {kind: indices + offset for kind, indices in values.items()}
+    return images, image_index, sorted(new_index)
+
+def split_tower(tower, unfreeze_dense):
+    """Split the tower before its last ``unfreeze_dense`` Dense layers into a frozen prefix and a trainable tail"""
+    dense = [i for i, layer in enumerate(tower.layers) if isinstance(layer, tf.keras.layers.Dense)]
+    if not 0 <= unfreeze_dense <= len(dense):
+        raise ValueError(f"The {tower.name} tower has {len(dense)} Dense layers; cannot unfreeze {unfreeze_dense}")
+    split = dense[-unfreeze_dense] if unfreeze_dense else len(tower.layers)
+    return tower.layers[:split], tower.layers[split:]
+
+def _apply(layers, inputs, training=False):
+    for layer in layers:
+        inputs = layer(inputs, training=training)
+    return inputs
+
+def _weights_digest(tower, layers):
+    """Hash of the frozen layers' weights: cached features stay valid for as long as it does not change"""
+    digest = hashlib.sha256(f"{tower.name}:{len(layers)}".encode())
+    for layer in layers:
+        for weight in layer.get_weights():
+            digest.update(np.ascontiguousarray(weight).tobytes())
+    return digest.hexdigest()[:16]
+
+def _image_keys(images, indices):
+    """Content hash of each preprocessed image (as uint8, whether the dataset is packed or not)"""
+    batch = np.asarray(images[np.asarray(indices)])
+    if batch.dtype != np.uint8:
+        batch = np.round(np.clip(batch, 0.0, 1.0) * 255).astype(np.uint8)
+    return [hashlib.blake2b(image.tobytes(), digest_size=16).digest() for image in batch]
+
+def cached_features(tower, frozen_layers, images, cache_dir, batch_size):
+    """Outputs of the frozen part of the tower for every image, computing only images not cached yet.
+
+    The cache lives in ``cache_dir/<weights digest>.npz`` and is keyed by image
+    content, so it survives head-only updates (which leave the tower alone),
+    re-packing and renumbered writers. Returns the features and how many
+    images had to be embedded.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_path = os.path.join(cache_dir, f"{_weights_digest(tower, frozen_layers)}.npz")
+    cache = {}
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as stored:
+            keys = stored["keys"]
+            # Keys are [N, 16] uint8 rows; earlier versions stored them as S16, which drops
+            # trailing NUL bytes, so those shortened keys are left out and recomputed
+            keys = [bytes(row) for row in keys] if keys.dtype == np.uint8 else keys.tolist()
+            cache = {key: feature for key, feature in zip(keys, stored["features"]) if len(key) == 16}
+
+    keys = [key for start in range(0, len(images), batch_size)
+            for key in _image_keys(images, np.arange(start, min(start + batch_size, len(images))))]
+    missing = np.array([i for i, key in enumerate(keys) if key not in cache], dtype=np.int64)
+    if len(missing):
+        spec = tf.TensorSpec((None,) + tuple(tower.input_shape[1:]), tf.float32)
+        frozen_fn = tf.function(lambda batch: _apply(frozen_layers, batch), input_signature=[spec])
+        for start in range(0, len(missing), batch_size):
+            rows = missing[start:start + batch_size]
+            for row, feature in zip(rows, frozen_fn(gather_float_images(images, rows)).numpy()):
+                cache[keys[row]] = feature
+        tmp_path = f"{cache_path}.tmp.npz"
+        np.savez(tmp_path, keys=np.frombuffer(b"".join(cache), np.uint8).reshape(len(cache), 16),
+                 features=np.stack(list(cache.values())))
+        os.replace(tmp_path, cache_path)
+    return np.stack([cache[key] for key in keys]), len(missing)
+
+def tail_embeddings(tail_layers, features, batch_size):
+    """Run the trainable tail of the tower over cached features (the features themselves if it is empty)"""
+    if not tail_layers:
+        return features
+    return np.concatenate([
+        _apply(tail_layers, tf.constant(features[start:start + batch_size])).numpy()
+        for start in range(0, len(features), batch_size)
+    ])
+
+def _pair_metrics(scorer, embeddings, pairs, writers, new_writers):
+    """Verification metrics over all pairs, the existing writers' pairs and the new writers' pairs"""
+    image_ids = np.arange(len(embeddings))
+    is_new = np.isin(writers[pairs[:, 0]], new_writers)
+    results = {}
+    for name, subset in (("all", pairs), ("existing", pairs[~is_new]), ("new", pairs[is_new])):
+        if len(np.unique(subset[:, 2])) < 2:
+            continue
+        metrics = verification_metrics(score_pairs(scorer, image_ids, embeddings, subset), subset[:, 2])
+        results[name] = {"eer": metrics["eer"], "auc": metrics["auc"], "pairs": int(len(subset))}
+    return results
+
+def onboard_writers(new_data_path, model_path=None, output_path=None, unfreeze_dense=None, epochs=None,
+                    publish=True):
+    """Add new writers by fine-tuning the Siamese head on cached, frozen tower features.
+
+    Instead of retraining every convolution from scratch, the tower of the
+    current model stays frozen and its outputs for every existing and new image
+    are cached (see ``cached_features``). Only the Dense head, plus the tower's
+    last ``unfreeze_dense`` Dense layers if asked, is trained on pairs built from
+    those features, so an update costs the new images' forward passes and a few
+    seconds of training. Validation EER is reported before and after, for all,
+    existing and new writers; when the update leaves the new writers well behind
+    the existing ones, or costs the existing writers accuracy, a full retrain is
+    recommended. The model is then saved (a new model version), evaluated on the
+    test pairs for the served threshold and, with ``publish``, moved to
+    ``Config.MODEL_SAVE_PATH``. The report goes to ``Config.ONBOARD_REPORT_PATH``.
+    """
+    config = Config()
+    model_path = model_path or config.MODEL_SAVE_PATH
+    unfreeze_dense = config.ONBOARD_UNFREEZE_DENSE if unfreeze_dense is None else unfreeze_dense
+    epochs = epochs or config.ONBOARD_EPOCHS
+    if output_path is None:
+        directory = os.path.dirname(config.MODEL_SAVE_PATH) or "."
+        output_path = os.path.join(directory, f"siamese_model.onboard-{time.strftime('%Y%m%d-%H%M%S')}.h5")
+    timings = {}
+
+    start = time.perf_counter()
+    preprocessor = DataPreprocessor(config)
+    images, image_index = load_training_data(config, DatasetLoader(config), preprocessor)
+    images, image_index, new_writers = add_writers(config, preprocessor, images, image_index, new_data_path)
+    train_pairs, val_pairs, test_pairs = preprocessor.split_data(preprocessor.create_pairs(image_index))
+    writers = np.empty(len(images), dtype=np.int64)
+    for writer, values in image_index.items():
+        for indices in values.values():
+            writers[indices] = writer
+    timings["data"] = time.perf_counter() - start
+    print(f"{len(new_writers)} new writers, {len(image_index)} in total; "
+          f"{len(train_pairs)} training and {len(val_pairs)} validation pairs")
+
+    start = time.perf_counter()
+    base = load_inference_model(model_path, custom_objects={'contrastive_loss': contrastive_loss})
+    siamese_model = base.model
+    tower = SiameseModel.get_base_model(siamese_model)
+    head = SiameseModel.get_head(siamese_model)
+    frozen_layers, tail_layers = split_tower(tower, unfreeze_dense)
+    features, embedded = cached_features(tower, frozen_layers, images, config.ONBOARD_CACHE_DIR, config.BATCH_SIZE)
+    timings["features"] = time.perf_counter() - start
+    print(f"Tower features: {embedded} images embedded, {len(images) - embedded} from the cache")
+
+    embed_tail = lambda: tail_embeddings(tail_layers, features, config.ONBOARD_BATCH_SIZE)
+    scorer = lambda: BaseInferenceModel(*head.get_weights())
+    before = _pair_metrics(scorer(), embed_tail(), val_pairs, writers, new_writers)
+
+    # Train the tail and head on feature pairs; the frozen layers are not part of this graph. Flags
+    # are set explicitly since a saved model may carry frozen layers (e.g. a distilled student's head)
+    tower.trainable = True
+    for layer in frozen_layers:
+        layer.trainable = False
+    for layer in tail_layers + [head]:
+        layer.trainable = True
+    input_a = tf.keras.Input(shape=features.shape[1:])
+    input_b = tf.keras.Input(shape=features.shape[1:])
+    distance = AbsoluteDifference()([_apply(tail_layers, input_a, None), _apply(tail_layers, input_b, None)])
+    update_model = tf.keras.Model([input_a, input_b], head(distance))
+    update_model.compile(
+        optimizer=tf.keras.optimizers.AdamW(learning_rate=config.ONBOARD_LEARNING_RATE,
+                                            weight_decay=config.WEIGHT_DECAY),
+        loss=configured_contrastive_loss(config),
+        metrics=['accuracy']
+    )
+    table = tf.constant(features)
+
+    def pair_dataset(pairs, shuffle=False):
+        dataset = tf.data.Dataset.from_tensor_slices((pairs[:, 0], pairs[:, 1], pairs[:, 2].astype(np.float32)))
+        if shuffle:
+            dataset = dataset.shuffle(len(pairs), seed=config.RANDOM_STATE_TRAIN, reshuffle_each_iteration=True)
+        return dataset.batch(config.ONBOARD_BATCH_SIZE).map(
+            lambda a, b, label: ((tf.gather(table, a), tf.gather(table, b)), label),
+            num_parallel_calls=tf.data.AUTOTUNE
+        ).prefetch(tf.data.AUTOTUNE)
+
+    print(f"Fine-tuning the head{f' and the last {unfreeze_dense} Dense layers' if unfreeze_dense else ''}...")
+    start = time.perf_counter()
+    history = update_model.fit(
+        pair_dataset(train_pairs, shuffle=True),
+        validation_data=pair_dataset(val_pairs),
+        epochs=epochs,
+        callbacks=[tf.keras.callbacks.EarlyStopping(patience=config.ONBOARD_PATIENCE, restore_best_weights=True)],
+        verbose=2
+    )
+    timings["fine_tune"] = time.perf_counter() - start
+
+    embeddings = embed_tail()
+    after = _pair_metrics(scorer(), embeddings, val_pairs, writers, new_writers)
+    margin = config.ONBOARD_RETRAIN_EER_MARGIN
+    reasons, regressed = [], False
+    if "new" in after and "existing" in after and after["new"]["eer"] > after["existing"]["eer"] + margin:
+        reasons.append("the new writers' validation EER is more than "
+                       f"{margin * 100:.1f} points above the existing writers'")
+    if "existing" in after and after["existing"]["eer"] > before["existing"]["eer"] + margin:
+        regressed = True
+        reasons.append(f"the existing writers' validation EER rose by more than {margin * 100:.1f} points")
+
+    siamese_model.save(output_path)
+    test_ids = np.arange(len(embeddings))
+    evaluation = verification_metrics(score_pairs(scorer(), test_ids, embeddings, test_pairs), test_pairs[:, 2])
+    report = {
+        "base_model": model_path,
+        "base_version": base.version,
+        "model_path": output_path,
+        "model_version": model_version(output_path),
+        "new_writers": [int(writer) for writer in new_writers],
+        "writers": len(image_index),
+        "unfreeze_dense": unfreeze_dense,
+        "images_embedded": int(embedded),
+        "images_cached": int(len(images) - embedded),
+        "epochs": len(history.history["loss"]),
+        "val_before": before,
+        "val_after": after,
+        "test_eer": evaluation["eer"],
+        "full_retrain_recommended": bool(reasons),
+        "full_retrain_reasons": reasons,
+        "published": False,
+        "seconds": timings
+    }
+
+    if publish and regressed:
+        print(f"Not publishing {output_path}: {reasons[-1]}")
+    elif publish:
+        # The served threshold is looked up by model version (see app.threshold_for). Write it before the
+        # model file is replaced, since running servers install the new file as soon as they see it.
+        evaluation.update({
+            "model_path": config.MODEL_SAVE_PATH,
+            "model_version": report["model_version"],
+            "pairs": int(len(test_pairs)),
+            "images": int(len(np.unique(test_pairs[:, :2]))),
+            "evaluated_at": time.strftime("%Y-%m-%dT%H:%M:%S")
+        })
+        with open(config.EVALUATION_PATH, "w") as f:
+            json.dump(evaluation, f, indent=2)
+        os.replace(output_path, config.MODEL_SAVE_PATH)
+        report["model_path"] = config.MODEL_SAVE_PATH
+        report["published"] = True
+        print(f"Published model version {report['model_version']} to {config.MODEL_SAVE_PATH}")
+    with open(config.ONBOARD_REPORT_PATH, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n{'validation EER':<16}{'before':>10}{'after':>10}{'pairs':>10}")
+    for name in ("all", "existing", "new"):
+        if name in after:
+            print(f"{name:<16}{before[name]['eer'] * 100:>9.2f}%{after[name]['eer'] * 100:>9.2f}%{after[name]['pairs']:>10}")
+    print(f"Test EER {evaluation['eer'] * 100:.2f}%; "
+          + ", ".join(f"{phase} {seconds:.1f}s" for phase, seconds in timings.items()))
+    for reason in reasons:
+        print(f"Full retrain recommended: {reason}")
+    print(f"Report written to {config.ONBOARD_REPORT_PATH}")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Onboard new writers by fine-tuning the head on cached tower features")
+    parser.add_argument("new_data", help="Directory with full_org/ and full_forg/ signatures of the new writers")
+    parser.add_argument("--model", default=None, help="Model to update (defaults to Config.MODEL_SAVE_PATH)")
+    parser.add_argument("--output", default=None, help="Where to save the updated h5 model before publishing")
+    parser.add_argument("--unfreeze-dense", type=int, default=None,
+                        help="Also train the tower's last N Dense layers (defaults to Config.ONBOARD_UNFREEZE_DENSE)")
+    parser.add_argument("--epochs", type=int, default=None, help="Defaults to Config.ONBOARD_EPOCHS")
+    parser.add_argument("--no-publish", action="store_true", help="Save the updated model without publishing it")
+    args = parser.parse_args()
+    onboard_writers(args.new_data, args.model, args.output, args.unfreeze_dense, args.epochs,
+                    publish=not args.no_publish)
@@ -0,0 +1,32 @@
+import argparse
+import os
+import time
+from config.config import Config
+from data.dataset_loader import DatasetLoader
+from data.data_preprocessing import DataPreprocessor
+from data.shards import ShardedDataset
+
+def pack_dataset(extract_path=None):
+    """Preprocess the dataset once into memory-mappable shards, appending only new images"""
+    config = Config()
+    if extract_path is not None:
+        config.EXTRACT_PATH = extract_path
+    
+    loader = DatasetLoader(config)
+    if not os.path.isdir(config.EXTRACT_PATH):
+        loader.download_and_extract_dataset()
+    dataset, orig, forg = loader.load_dataset_paths()
+    
+    shards = ShardedDataset(config)
+    start = time.time()
+    added = shards.pack(dataset, orig, DataPreprocessor(config))
+    print(f"Packed {added} new images in {time.time() - start:.1f}s "
+          f"({len(shards)} total, {len(dataset)} writers) into {shards.root}")
+    return shards
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack the preprocessed signature dataset into shards")
+    parser.add_argument("--extract-path", default=None,
+                        help="Directory with full_org/ and full_forg/ (defaults to Config.EXTRACT_PATH)")
+    args = parser.parse_args()
+    pack_dataset(args.extract_path)
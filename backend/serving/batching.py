@@ -0,0 +1,121 @@
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class _Request:
+    __slots__ = ("inputs", "future", "enqueued_at")
+
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+class MicroBatcher:
+    """Dynamic micro-batching of concurrent inference requests.
+
+    Callers submit single examples (one array per model input, without a batch
+    dimension). A background thread stacks whatever arrives within
+    ``max_wait_ms`` of the first queued request, up to ``max_batch_size``
+    examples, into one call of ``predict_fn`` and routes row ``i`` of the
+    output back to the ``i``-th caller.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=32, max_wait_ms=2.0, name="batcher"):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._requests = 0
+        self._batches = 0
+        self._errors = 0
+        self._max_queue_depth = 0
+        self._queue_wait_total = 0.0
+        self._predict_time_total = 0.0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, *inputs):
+        """Queue one example and return a Future resolving to its output row"""
+        request = _Request(inputs)
+        self._queue.put(request)
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            self._max_queue_depth = max(self._max_queue_depth, depth)
+        return request.future
+
+    def __call__(self, *inputs, timeout=None):
+        return self.submit(*inputs).result(timeout=timeout)
+
+    def close(self):
+        """Stop the worker thread after draining already queued requests"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        running = True
+        while running:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+            self._process(batch)
+
+    def _process(self, batch):
+        started = time.perf_counter()
+        try:
+            inputs = [np.stack([r.inputs[k] for r in batch]) for k in range(len(batch[0].inputs))]
+            outputs = self.predict_fn(*inputs)
+        except Exception as e:
+            logger.error(f"{self.name}: batch of {len(batch)} failed: {str(e)}")
+            for r in batch:
+                r.future.set_exception(e)
+            with self._stats_lock:
+                self._errors += len(batch)
+            return
+        finished = time.perf_counter()
+        for i, r in enumerate(batch):
+            r.future.set_result(outputs[i])
+        with self._stats_lock:
+            self._requests += len(batch)
+            self._batches += 1
+            self._batch_sizes[len(batch)] += 1
+            self._queue_wait_total += sum(started - r.enqueued_at for r in batch)
+            self._predict_time_total += finished - started
+
+    def stats(self):
+        """Queue-depth and batch-size statistics for tuning latency against throughput"""
+        with self._stats_lock:
+            return {
+                'name': self.name,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self._max_queue_depth,
+                'requests': self._requests,
+                'batches': self._batches,
+                'errors': self._errors,
+                'mean_batch_size': self._requests / self._batches if self._batches else 0.0,
+                'batch_size_histogram': {str(k): v for k, v in sorted(self._batch_sizes.items())},
+                'mean_queue_wait_ms': 1000.0 * self._queue_wait_total / self._requests if self._requests else 0.0,
+                'mean_predict_ms': 1000.0 * self._predict_time_total / self._batches if self._batches else 0.0,
+            }
@@ -0,0 +1,104 @@
+import csv
+import io
+import zipfile
+import numpy as np
+
+class BulkInputError(ValueError):
+    """Raised when a bulk verification upload is malformed"""
+
+def iter_pairs(files, form):
+    """Yield (pair_id, signature1, signature2, reference_id) items from a bulk upload.
+
+    Supported layouts:
+      * repeated ``signature1`` file parts paired by position with repeated
+        ``signature2`` file parts or ``reference_id`` form fields;
+      * an ``archive`` part holding a .zip with a ``pairs.csv`` manifest
+        (columns ``signature1`` and ``signature2`` or ``reference_id``, plus an
+        optional ``pair_id``) naming members of the archive;
+      * an ``archive`` part holding a .npz with ``signature1`` and
+        ``signature2`` arrays of raw grayscale images, shape [N, H, W(, 1)].
+
+    Images are yielded as encoded bytes (or raw arrays for .npz) and are only
+    read when the consumer gets to them.
+    """
+    if 'archive' in files:
+        archive = files['archive']
+        name = (archive.filename or '').lower()
+        if name.endswith('.npz'):
+            yield from _iter_npz_pairs(archive.stream)
+        elif name.endswith('.zip'):
+            yield from _iter_zip_pairs(archive.stream)
+        else:
+            raise BulkInputError('archive must be a .zip or .npz file')
+        return
+    
+    first = files.getlist('signature1')
+    second = files.getlist('signature2')
+    reference_ids = form.getlist('reference_id')
+    if not first:
+        raise BulkInputError('Provide signature1 parts or an archive')
+    if len(second) not in (0, len(first)) or len(reference_ids) not in (0, len(first)) \
+            or bool(second) == bool(reference_ids):
+        raise BulkInputError('Provide one signature2 part or one reference_id per signature1 part')
+    
+    for i, part in enumerate(first):
+        if second:
+            yield str(i), part.read(), second[i].read(), None
+        else:
+            yield str(i), part.read(), None, reference_ids[i]
+
+def _iter_zip_pairs(stream):
+    try:
+        archive = zipfile.ZipFile(stream)
+    except zipfile.BadZipFile as e:
+        raise BulkInputError(f'archive is not a valid zip file: {e}')
+    with archive:
+        try:
+            manifest = archive.read('pairs.csv').decode('utf-8')
+        except KeyError:
+            raise BulkInputError('zip archive must contain a pairs.csv manifest')
+        except (zipfile.BadZipFile, UnicodeDecodeError) as e:
+            raise BulkInputError(f'pairs.csv cannot be read: {e}')
+        
+        # Check the whole manifest before the first pair is scored, so a bad row is a 400 rather than a broken stream
+        members = set(archive.namelist())
+        rows = []
+        for i, row in enumerate(csv.DictReader(io.StringIO(manifest))):
+            if not row.get('signature1') or not (row.get('signature2') or row.get('reference_id')):
+                raise BulkInputError(f'pairs.csv row {i + 1} needs signature1 and signature2 or reference_id')
+            pair_id = row.get('pair_id') or str(i)
+            for column in ('signature1', 'signature2'):
+                if row.get(column) and row[column] not in members:
+                    raise BulkInputError(f'{column} {row[column]!r} of pair {pair_id} is not in the zip archive')
+            rows.append((pair_id, row))
+        
+        for pair_id, row in rows:
+            try:
+                signature1 = archive.read(row['signature1'])
+                signature2 = archive.read(row['signature2']) if row.get('signature2') else None
+            except (KeyError, zipfile.BadZipFile) as e:
+                raise BulkInputError(f'pair {pair_id} cannot be read from the zip archive: {e}')
+            yield pair_id, signature1, signature2, row.get('reference_id') or None
+
+def _iter_npz_pairs(stream):
+    try:
+        data = np.load(stream, allow_pickle=False)
+    except (OSError, ValueError, zipfile.BadZipFile) as e:
+        raise BulkInputError(f'archive is not a valid npz file: {e}')
+    if not isinstance(data, np.lib.npyio.NpzFile):
+        raise BulkInputError('archive must be an npz file, not a single npy array')
+    with data:
+        if 'signature1' not in data or 'signature2' not in data:
+            raise BulkInputError('npz archive must contain signature1 and signature2 arrays')
+        first, second = data['signature1'], data['signature2']
+        if len(first) != len(second):
+            raise BulkInputError('signature1 and signature2 arrays must have the same length')
+        for i in range(len(first)):
+            yield str(i), first[i], second[i], None
+
+def pairs_per_chunk(config):
+    """Number of pairs per model call that keeps peak activation memory within BULK_VERIFY_MEMORY_MB"""
+    height, width, _ = config.INPUT_SHAPE
+    # The first 96-filter conv output (and its LRN copy) dominates activation memory
+    bytes_per_pair = 2 * 2 * height * width * 96 * 4
+    return max(1, min(config.BULK_VERIFY_MAX_CHUNK, config.BULK_VERIFY_MEMORY_MB * 2**20 // bytes_per_pair))
@@ -0,0 +1,154 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+import numpy as np
+
+# Rough per-entry bookkeeping (key, dict slot, array header) on top of the embedding itself
+ENTRY_OVERHEAD_BYTES = 200
+
+class EmbeddingCache:
+    """Bounded in-process LRU cache of base-tower embeddings keyed by image content.
+
+    Keys are a BLAKE2b hash of the raw (encoded) image bytes plus the model
+    version, so a re-submitted image skips decoding, preprocessing and the CNN
+    tower. Identical requests that arrive while the first one is still being
+    computed wait for its result instead of computing it again. Entries are
+    evicted least recently used first once their total size exceeds
+    ``max_bytes``. ``invalidate()`` drops everything when a new model is
+    swapped in; results still in flight for the old model are not stored.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._bytes = 0
+        self._generation = 0
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    @staticmethod
+    def content_hash(data):
+        return hashlib.blake2b(data, digest_size=16).digest()
+
+    def get_or_compute(self, data, version, compute):
+        """Cached embedding of the image ``data``, else ``compute()``'s result (which is then cached).
+
+        Exceptions raised by ``compute`` propagate to the caller and to any
+        coalesced callers, and nothing is cached.
+        """
+        key = (version, self.content_hash(data))
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return embedding
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+                generation = self._generation
+                self._misses += 1
+            else:
+                self._coalesced += 1
+        if not leader:
+            return future.result()
+
+        try:
+            embedding = np.array(compute(), copy=True)  # Own the memory, not a row of a whole batch
+            embedding.setflags(write=False)
+        except BaseException as e:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._in_flight.pop(key, None)
+            if generation == self._generation:
+                self._insert(key, embedding)
+        future.set_result(embedding)
+        return embedding
+
+    def get(self, digest, version):
+        """Non-blocking lookup by ``content_hash``, for callers that compute misses themselves (async serving).
+
+        Returns the cached embedding (or None) and the cache generation to pass
+        to ``put``.
+        """
+        key = (version, digest)
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+            else:
+                self._misses += 1
+            return embedding, self._generation
+
+    def put(self, digest, version, embedding, generation):
+        """Cache an embedding computed after ``get`` missed, unless the cache was invalidated since.
+
+        If another caller cached the same image meanwhile, its entry is kept and returned.
+        """
+        embedding = np.array(embedding, copy=True)
+        embedding.setflags(write=False)
+        key = (version, digest)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                return cached
+            if generation == self._generation:
+                self._insert(key, embedding)
+        return embedding
+
+    def record_coalesced(self):
+        """Count a lookup answered by a computation already in flight elsewhere"""
+        with self._lock:
+            self._coalesced += 1
+
+    def _insert(self, key, embedding):
+        size = embedding.nbytes + ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        replaced = self._entries.pop(key, None)
+        if replaced is not None:
+            self._bytes -= replaced.nbytes + ENTRY_OVERHEAD_BYTES
+        self._entries[key] = embedding
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.nbytes + ENTRY_OVERHEAD_BYTES
+            self._evictions += 1
+
+    def invalidate(self):
+        """Drop every entry (e.g. after a model swap)"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._generation += 1
+            self._invalidations += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses + self._coalesced
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'coalesced': self._coalesced,
+                'evictions': self._evictions,
+                'invalidations': self._invalidations,
+                'hit_rate': (self._hits + self._coalesced) / lookups if lookups else 0.0,
+            }
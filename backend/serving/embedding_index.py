@@ -0,0 +1,107 @@
+import numpy as np
+
+class _Storage:
+    """Embedding matrix kept as float32, float16 or per-dimension affine uint8 codes"""
+
+    def __init__(self, embeddings, dtype="float32"):
+        self.dtype = dtype
+        if dtype == "float32":
+            self.data = embeddings.astype(np.float32)
+        elif dtype == "float16":
+            self.data = embeddings.astype(np.float16)
+        elif dtype == "int8":
+            low = embeddings.min(axis=0)
+            scale = np.maximum(embeddings.max(axis=0) - low, 1e-12) / 255.0
+            self.offset, self.scale = low.astype(np.float32), scale.astype(np.float32)
+            self.data = np.round((embeddings - low) / scale).astype(np.uint8)
+        else:
+            raise ValueError(f"Unknown embedding storage dtype: {dtype}")
+
+    def decode(self, rows=None):
+        data = self.data if rows is None else self.data[rows]
+        if self.dtype == "int8":
+            return data.astype(np.float32) * self.scale + self.offset
+        return data.astype(np.float32, copy=False)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+class EmbeddingIndex:
+    """Vectorized nearest-neighbour search over enrolled reference embeddings.
+    
+    ``index_type="exact"`` scans the whole gallery with one matrix product.
+    ``index_type="ivf"`` clusters the gallery with k-means into ``n_lists``
+    inverted lists and only scans the ``n_probe`` lists closest to the query,
+    which keeps lookups fast for galleries of 100k+ signatures. Either way the
+    retrieved candidates are meant to be re-scored with the Siamese head.
+    """
+
+    def __init__(self, embeddings, reference_ids, writer_ids, revision=None,
+                 index_type="exact", storage_dtype="float32", n_lists=None, n_probe=8, seed=0):
+        self.reference_ids = reference_ids
+        self.writer_ids = writer_ids
+        self.revision = revision
+        self.index_type = index_type
+        self.n_probe = n_probe
+        self.storage = _Storage(embeddings, storage_dtype)
+        decoded = self.storage.decode()
+        self._norms = np.einsum("ij,ij->i", decoded, decoded)
+        
+        if index_type == "ivf" and len(embeddings):
+            n_lists = n_lists or max(1, int(np.sqrt(len(embeddings))))
+            self.centroids = self._kmeans(decoded, n_lists, np.random.RandomState(seed))
+            assignments = self._nearest_centroid(decoded)
+            order = np.argsort(assignments, kind="stable")
+            bounds = np.searchsorted(assignments[order], np.arange(len(self.centroids) + 1))
+            self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+        elif index_type not in ("exact", "ivf"):
+            raise ValueError(f"Unknown index type: {index_type}")
+
+    def __len__(self):
+        return len(self.reference_ids)
+
+    @staticmethod
+    def _kmeans(data, n_lists, rng, iterations=10, sample_size=50000):
+        sample = data[rng.choice(len(data), min(len(data), sample_size), replace=False)]
+        centroids = sample[rng.choice(len(sample), min(n_lists, len(sample)), replace=False)].copy()
+        for _ in range(iterations):
+            distances = (np.einsum("ij,ij->i", centroids, centroids)[np.newaxis]
+                         - 2.0 * sample @ centroids.T)
+            assignments = np.argmin(distances, axis=1)
+            counts = np.bincount(assignments, minlength=len(centroids))
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            nonempty = counts > 0
+            centroids[nonempty] = sums[nonempty] / counts[nonempty, np.newaxis]
+        return centroids
+
+    def _nearest_centroid(self, data, chunk=65536):
+        centroid_norms = np.einsum("ij,ij->i", self.centroids, self.centroids)
+        return np.concatenate([
+            np.argmin(centroid_norms[np.newaxis] - 2.0 * data[i:i + chunk] @ self.centroids.T, axis=1)
+            for i in range(0, len(data), chunk)
+        ])
+
+    def search(self, query, k):
+        """Return (row indices, decoded embeddings, squared L2 distances) of the k nearest references"""
+        if not len(self):
+            return np.zeros(0, np.int64), np.zeros((0, query.shape[-1]), np.float32), np.zeros(0, np.float32)
+        
+        if self.index_type == "ivf":
+            centroid_distances = np.einsum("ij,ij->i", self.centroids, self.centroids) - 2.0 * self.centroids @ query
+            probes = np.argpartition(centroid_distances, min(self.n_probe, len(self.centroids)) - 1)[:self.n_probe]
+            rows = np.concatenate([self.lists[p] for p in probes])
+            candidates = self.storage.decode(rows)
+        else:
+            rows = np.arange(len(self))
+            candidates = self.storage.decode()
+        
+        distances = self._norms[rows] - 2.0 * candidates @ query + query @ query
+        # The probed lists of an IVF index can hold fewer than k references, or none at all
+        k = min(k, len(rows))
+        if k <= 0:
+            return np.zeros(0, np.int64), np.zeros((0, query.shape[-1]), np.float32), np.zeros(0, np.float32)
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top])]
+        return rows[top], candidates[top], distances[top]
@@ -0,0 +1,295 @@
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS refs (
+    reference_id TEXT PRIMARY KEY,
+    writer_id TEXT NOT NULL,
+    image BLOB NOT NULL,
+    image_shape TEXT NOT NULL,
+    embedding BLOB NOT NULL,
+    revision INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS refs_revision ON refs (revision);
+CREATE TABLE IF NOT EXISTS removed (reference_id TEXT PRIMARY KEY, revision INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+INSERT OR IGNORE INTO meta VALUES ('revision', '0'), ('model_version', '');
+"""
+
+class EmbeddingStore:
+    """Persistent store of enrolled reference signature embeddings, shared by every server process.
+
+    Each entry is keyed by a reference id and optionally tagged with a writer id.
+    The preprocessed reference image is kept alongside its embedding (as uint8)
+    so that embeddings can be recomputed when a different model is loaded.
+
+    Entries live in a SQLite database: an enroll or removal writes one row in a
+    write-locked transaction and bumps a shared revision, so concurrent writers
+    in different processes never overwrite each other. Every process mirrors the
+    float32 embeddings in memory and, whenever the revision on disk has moved,
+    applies only the rows written since its last sync. Images stay on disk.
+    """
+
+    def __init__(self, path, timeout=300.0):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        self.model_version = None
+        self._revision = 0
+        self._ids = []
+        self._writer_ids = []
+        self._index = {}
+        self._embeddings = None
+        self._import_legacy()
+        self._sync()
+
+    @contextmanager
+    def _transaction(self, write=True):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    @staticmethod
+    def _meta(db, key):
+        return db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()[0]
+
+    @staticmethod
+    def _set_meta(db, key, value):
+        db.execute("UPDATE meta SET value = ? WHERE key = ?", (str(value), key))
+
+    def _bump(self, db):
+        revision = int(self._meta(db, "revision")) + 1
+        self._set_meta(db, "revision", revision)
+        return revision
+
+    def _import_legacy(self):
+        """One-time import of the npz file earlier versions kept next to the database"""
+        legacy_path = f"{os.path.splitext(self.path)[0]}.npz"
+        if not os.path.exists(legacy_path):
+            return
+        with self._transaction() as db:
+            if db.execute("SELECT COUNT(*) FROM refs").fetchone()[0] or int(self._meta(db, "revision")):
+                return
+            revision = self._bump(db)
+            with np.load(legacy_path, allow_pickle=False) as data:
+                images = data["images"]
+                db.executemany("INSERT OR REPLACE INTO refs VALUES (?, ?, ?, ?, ?, ?)", [
+                    (str(ref), str(writer), image.tobytes(), ",".join(map(str, image.shape)),
+                     embedding.astype(np.float32).tobytes(), revision)
+                    for ref, writer, image, embedding in zip(data["ids"], data["writer_ids"], images, data["embeddings"])
+                ])
+                self._set_meta(db, "model_version", str(data["model_version"]))
+            logger.info(f"Imported {len(images)} enrolled references from {legacy_path}")
+
+    def _sync(self):
+        """Apply the changes other processes (or this one) committed since the last sync"""
+        with self._lock:
+            if int(self._meta(self._db, "revision")) == self._revision:
+                return
+            with self._transaction(write=False) as db:
+                revision = int(self._meta(db, "revision"))
+                model_version = self._meta(db, "model_version") or None
+                removed = db.execute("SELECT reference_id FROM removed WHERE revision > ?", (self._revision,)).fetchall()
+                changed = db.execute("SELECT reference_id, writer_id, embedding FROM refs WHERE revision > ? ORDER BY rowid",
+                                     (self._revision,)).fetchall()
+                width = None if self._embeddings is None or not self._ids else self._embeddings.shape[1]
+                if width is not None and any(len(embedding) != 4 * width for _, _, embedding in changed):
+                    # A model with another embedding size was swapped in: rebuild the mirror from scratch
+                    removed = []
+                    changed = db.execute("SELECT reference_id, writer_id, embedding FROM refs ORDER BY rowid").fetchall()
+                    self._ids, self._writer_ids, self._index, self._embeddings = [], [], {}, None
+            for (reference_id,) in removed:
+                self._remove_row(reference_id)
+            for reference_id, writer_id, embedding in changed:
+                self._put_row(reference_id, writer_id, np.frombuffer(embedding, dtype=np.float32))
+            if changed or removed:
+                logger.info(f"Synced enrolled references to revision {revision}: "
+                            f"{len(changed)} written, {len(removed)} removed, {len(self._ids)} in total")
+            self._revision, self.model_version = revision, model_version
+
+    def _put_row(self, reference_id, writer_id, embedding):
+        if self._ids and self._embeddings.shape[1] != len(embedding):
+            raise ValueError(f"Embedding of {reference_id!r} has {len(embedding)} dimensions, "
+                             f"the others {self._embeddings.shape[1]}")
+        i = self._index.get(reference_id)
+        if i is None:
+            i = len(self._ids)
+            if self._embeddings is None or i == len(self._embeddings) or self._embeddings.shape[1] != len(embedding):
+                # Grow geometrically so appending stays amortized O(1)
+                grown = np.empty((max(16, 2 * i), len(embedding)), np.float32)
+                if i:
+                    grown[:i] = self._embeddings[:i]
+                self._embeddings = grown
+            self._index[reference_id] = i
+            self._ids.append(reference_id)
+            self._writer_ids.append(writer_id)
+        self._embeddings[i] = embedding
+        self._writer_ids[i] = writer_id
+
+    def _remove_row(self, reference_id):
+        i = self._index.pop(reference_id, None)
+        if i is None:
+            return
+        last = len(self._ids) - 1
+        if i != last:
+            # Move the last row into the hole instead of shifting every row after it
+            self._ids[i], self._writer_ids[i] = self._ids[last], self._writer_ids[last]
+            self._embeddings[i] = self._embeddings[last]
+            self._index[self._ids[i]] = i
+        self._ids.pop()
+        self._writer_ids.pop()
+
+    @property
+    def revision(self):
+        """Revision of the store on disk, bumped on every change so derived indexes know when to rebuild"""
+        self._sync()
+        return self._revision
+
+    def __len__(self):
+        self._sync()
+        return len(self._ids)
+
+    def __contains__(self, reference_id):
+        self._sync()
+        return reference_id in self._index
+
+    def enroll(self, reference_id, image, embedding, writer_id=None, model_version=None):
+        """Add or replace a reference embedding"""
+        image_u8 = np.round(np.clip(image, 0.0, 1.0) * 255).astype(np.uint8)
+        embedding = np.asarray(embedding, dtype=np.float32)
+        writer_id = "" if writer_id is None else str(writer_id)
+        with self._transaction() as db:
+            stored_version = self._meta(db, "model_version") or None
+            if db.execute("SELECT COUNT(*) FROM refs").fetchone()[0] and model_version != stored_version:
+                raise ValueError("Store holds embeddings from a different model; refresh it first")
+            revision = self._bump(db)
+            self._set_meta(db, "model_version", model_version or "")
+            db.execute("INSERT OR REPLACE INTO refs VALUES (?, ?, ?, ?, ?, ?)", (
+                reference_id, writer_id, image_u8.tobytes(), ",".join(map(str, image_u8.shape)),
+                embedding.tobytes(), revision
+            ))
+            db.execute("DELETE FROM removed WHERE reference_id = ?", (reference_id,))
+        self._sync()
+
+    def remove(self, reference_id):
+        """Delete a reference; returns False if it was not enrolled"""
+        with self._transaction() as db:
+            if db.execute("SELECT 1 FROM refs WHERE reference_id = ?", (reference_id,)).fetchone() is None:
+                return False
+            revision = self._bump(db)
+            db.execute("DELETE FROM refs WHERE reference_id = ?", (reference_id,))
+            db.execute("INSERT OR REPLACE INTO removed VALUES (?, ?)", (reference_id, revision))
+        self._sync()
+        return True
+
+    def get(self, reference_id):
+        """Return (embedding, writer_id) for a reference, or None"""
+        with self._lock:
+            self._sync()
+            i = self._index.get(reference_id)
+            if i is None:
+                return None
+            return self._embeddings[i].copy(), self._writer_ids[i] or None
+
+    def get_many(self, reference_ids):
+        """(reference ids, writer ids, float32 embeddings) of those ``reference_ids`` that are still enrolled"""
+        with self._lock:
+            self._sync()
+            rows = [self._index[ref] for ref in reference_ids if ref in self._index]
+            return (
+                [self._ids[i] for i in rows],
+                [self._writer_ids[i] or None for i in rows],
+                self._embeddings[rows] if rows else np.zeros((0, 0), np.float32)
+            )
+
+    def entries(self):
+        """List enrolled references"""
+        with self._lock:
+            self._sync()
+            return [
+                {"reference_id": ref, "writer_id": writer or None}
+                for ref, writer in zip(self._ids, self._writer_ids)
+            ]
+
+    def snapshot(self):
+        """Consistent copy of (revision, reference ids, writer ids, embeddings)"""
+        with self._lock:
+            self._sync()
+            return (
+                self._revision,
+                list(self._ids),
+                [writer or None for writer in self._writer_ids],
+                self._embeddings[:len(self._ids)].copy() if self._ids else np.zeros((0, 0), np.float32)
+            )
+
+    def refresh(self, inference_model, batch_size=64):
+        """Re-embed all stored references if they were computed by another model version.
+
+        Images are read in short read transactions and embedded without holding
+        any lock, so lookups keep being served meanwhile; only the final UPDATE
+        takes the write lock. References written while re-embedding are picked up
+        by another pass. When several processes swap in the same model, the first
+        to commit re-embeds and the others just sync its result.
+        """
+        version = inference_model.version
+        embeddings, since = {}, 0
+        while True:
+            with self._transaction(write=False) as db:
+                if (self._meta(db, "model_version") or None) == version:
+                    updated = False
+                    break
+                revision = int(self._meta(db, "revision"))
+                pending = [ref for (ref,) in db.execute(
+                    "SELECT reference_id FROM refs WHERE revision > ? ORDER BY rowid", (since,))]
+            if pending:
+                logger.info(f"Re-embedding {len(pending)} references for model {version}")
+            for start in range(0, len(pending), batch_size):
+                batch = pending[start:start + batch_size]
+                with self._transaction(write=False) as db:
+                    rows = db.execute(
+                        f"SELECT reference_id, image, image_shape FROM refs WHERE reference_id IN ({','.join('?' * len(batch))})",
+                        batch
+                    ).fetchall()
+                if not rows:
+                    continue
+                images = np.stack([
+                    np.frombuffer(image, dtype=np.uint8).reshape(tuple(map(int, shape.split(","))))
+                    for _, image, shape in rows
+                ]).astype(np.float32) / 255.0
+                for (ref, _, _), embedding in zip(rows, inference_model.embed(images)):
+                    embeddings[ref] = np.asarray(embedding, dtype=np.float32)
+
+            with self._transaction() as db:
+                if (self._meta(db, "model_version") or None) == version:
+                    updated = False
+                    break
+                if int(self._meta(db, "revision")) != revision:
+                    # Enrolled or replaced meanwhile, still with the old model: embed those rows too
+                    since = revision
+                    continue
+                if embeddings:
+                    revision = self._bump(db)
+                    db.executemany("UPDATE refs SET embedding = ?, revision = ? WHERE reference_id = ?", [
+                        (embedding.tobytes(), revision, ref) for ref, embedding in embeddings.items()
+                    ])
+                self._set_meta(db, "model_version", version or "")
+                updated = bool(embeddings)
+                break
+        self._sync()
+        return updated
@@ -0,0 +1,202 @@
+import hashlib
+import os
+import threading
+import numpy as np
+
+# TFLite flatbuffers read by preload_artifact() before a pre-forking server starts its workers
+_preloaded = {}
+
+def model_version(model_path):
+    """Short content hash identifying a saved model file or exported artifact directory"""
+    digest = hashlib.sha256()
+    if os.path.isdir(model_path):
+        paths = sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(model_path)
+            for name in names
+        )
+    else:
+        paths = [model_path]
+    for path in paths:
+        digest.update(os.path.relpath(path, model_path).encode())
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+class BaseInferenceModel:
+    """Common interface of every servable artifact: tower embeddings plus the abs(diff) + Dense head"""
+
+    def __init__(self, head_kernel, head_bias, version=None):
+        self.head_kernel = np.asarray(head_kernel, dtype=np.float32)
+        self.head_bias = np.asarray(head_bias, dtype=np.float32)
+        self.version = version
+
+    @property
+    def embedding_dim(self):
+        return self.head_kernel.shape[0]
+
+    def embed(self, images):
+        raise NotImplementedError
+
+    def score_embeddings(self, embeddings_a, embeddings_b):
+        """Apply the abs(diff) + Dense(sigmoid) head to precomputed embeddings"""
+        logits = np.abs(embeddings_a - embeddings_b) @ self.head_kernel + self.head_bias
+        return 1.0 / (1.0 + np.exp(-logits[:, 0]))
+
+    def warmup(self, batch_sizes, input_shape):
+        """Run every entry point once per batch size so no request pays tracing or compilation"""
+        probe = np.zeros((max(batch_sizes),) + tuple(input_shape), dtype=np.float32)
+        for batch_size in batch_sizes:
+            self.embed(probe[:batch_size])
+            self.predict_pairs(probe[:batch_size], probe[:batch_size])
+
+    def predict_pairs(self, images_a, images_b):
+        """Score batches of image pairs with one tower pass over both sides"""
+        embeddings = self.embed(np.concatenate([images_a, images_b]))
+        return self.score_embeddings(embeddings[:len(images_a)], embeddings[len(images_a):])
+
+class InferenceModel(BaseInferenceModel):
+    """Serving wrapper exposing the SigNet tower and the Dense head of a Keras Siamese model separately.
+    
+    Both are traced once into ``tf.function``s with a fixed ``[None, H, W, 1]`` input
+    signature, which skips the data-adapter and callback machinery ``model.predict``
+    sets up on every call. With ``jit_compile`` the functions are XLA-compiled; XLA
+    specializes on the batch size, so batches are padded up to the nearest of
+    ``batch_buckets`` to keep the number of compiled programs bounded.
+    """
+
+    def __init__(self, siamese_model, version=None, jit_compile=False, batch_buckets=None):
+        import tensorflow as tf
+        from models.siamese import SiameseModel
+        kernel, bias = SiameseModel.get_head_weights(siamese_model)
+        super().__init__(kernel, bias, version=version)
+        self.model = siamese_model
+        self.base_model = SiameseModel.get_base_model(siamese_model)
+        self.jit_compile = jit_compile
+        self.batch_buckets = tuple(sorted(batch_buckets)) if batch_buckets else None
+        
+        spec = tf.TensorSpec((None,) + tuple(self.base_model.input_shape[1:]), tf.float32)
+        self._embed_fn = tf.function(
+            lambda images: self.base_model(images, training=False),
+            input_signature=[spec], jit_compile=jit_compile, reduce_retracing=True
+        )
+        self._pair_fn = tf.function(
+            lambda images_a, images_b: self.model([images_a, images_b], training=False)[:, 0],
+            input_signature=[spec, spec], jit_compile=jit_compile, reduce_retracing=True
+        )
+
+    def _padded_calls(self, fn, *batches):
+        """Call ``fn`` on batch-bucket sized slices, padding the last one, and trim the result"""
+        batches = [np.asarray(batch, dtype=np.float32) for batch in batches]
+        total = len(batches[0])
+        if not self.jit_compile or not self.batch_buckets:
+            return fn(*batches).numpy()
+        
+        outputs, largest = [], self.batch_buckets[-1]
+        for start in range(0, total, largest):
+            chunk = [batch[start:start + largest] for batch in batches]
+            size = len(chunk[0])
+            bucket = next(b for b in self.batch_buckets if b >= size)
+            if bucket > size:
+                chunk = [np.concatenate([c, np.zeros((bucket - size,) + c.shape[1:], np.float32)]) for c in chunk]
+            outputs.append(fn(*chunk).numpy()[:size])
+        return np.concatenate(outputs)
+
+    def embed(self, images):
+        """Run only the base tower on a batch of preprocessed images"""
+        return self._padded_calls(self._embed_fn, images)
+
+    def predict_pairs(self, images_a, images_b):
+        """Run the full Siamese model on batches of image pairs"""
+        return self._padded_calls(self._pair_fn, images_a, images_b)
+
+class SavedModelInferenceModel(BaseInferenceModel):
+    """Inference-only SavedModel written by export.py"""
+
+    def __init__(self, path, version=None):
+        import tensorflow as tf
+        head = np.load(os.path.join(path, "head.npz"))
+        super().__init__(head["kernel"], head["bias"], version=version)
+        self.model = tf.saved_model.load(path)
+        self._embed = self.model.signatures["embed"]
+        self._verify = self.model.signatures["serving_default"]
+
+    def embed(self, images):
+        return self._embed(images=np.asarray(images, dtype=np.float32))["embedding"].numpy()
+
+    def predict_pairs(self, images_a, images_b):
+        outputs = self._verify(
+            image_a=np.asarray(images_a, dtype=np.float32),
+            image_b=np.asarray(images_b, dtype=np.float32)
+        )
+        return outputs["similarity"].numpy()
+
+class TFLiteInferenceModel(BaseInferenceModel):
+    """TFLite SigNet tower (float32, float16 or int8) written by export.py; the head runs in NumPy"""
+
+    def __init__(self, path, version=None, num_threads=None):
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+        head = np.load(os.path.join(path, "head.npz"))
+        super().__init__(head["kernel"], head["bias"], version=version)
+        tower_path = os.path.join(path, "tower.tflite")
+        if tower_path in _preloaded:
+            self.model = Interpreter(model_content=_preloaded[tower_path], num_threads=num_threads or os.cpu_count())
+        else:
+            self.model = Interpreter(model_path=tower_path, num_threads=num_threads or os.cpu_count())
+        self._input = self.model.get_input_details()[0]["index"]
+        self._output = self.model.get_output_details()[0]["index"]
+        self._batch_size = None
+        # A TFLite interpreter must not be invoked from several threads at once
+        self._lock = threading.Lock()
+
+    def embed(self, images):
+        images = np.asarray(images, dtype=np.float32)
+        with self._lock:
+            if self._batch_size != len(images):
+                self.model.resize_tensor_input(self._input, images.shape)
+                self.model.allocate_tensors()
+                self._batch_size = len(images)
+            self.model.set_tensor(self._input, images)
+            self.model.invoke()
+            return self.model.get_tensor(self._output).copy()
+
+def preload_artifact(path):
+    """Read a TFLite export into memory so forked workers share its flatbuffer copy-on-write.
+    
+    Keras models and SavedModels cannot be shared this way: the TensorFlow runtime
+    is not fork-safe once it has run an op, so each worker loads its own copy.
+    Returns whether anything was preloaded.
+    """
+    tower_path = os.path.join(path, "tower.tflite")
+    if not os.path.isfile(tower_path):
+        return False
+    with open(tower_path, "rb") as f:
+        _preloaded[tower_path] = f.read()
+    return True
+
+def load_inference_model(path, custom_objects=None, jit_compile=False, batch_buckets=None):
+    """Load any servable artifact: a Keras .h5/.keras model or a SavedModel/TFLite export directory.
+    
+    ``jit_compile`` and ``batch_buckets`` only apply to Keras models.
+    """
+    version = model_version(path)
+    if os.path.isdir(path):
+        if os.path.exists(os.path.join(path, "tower.tflite")):
+            return TFLiteInferenceModel(path, version=version)
+        if os.path.exists(os.path.join(path, "saved_model.pb")):
+            return SavedModelInferenceModel(path, version=version)
+        raise ValueError(f"{path} is not a SavedModel or TFLite export directory")
+
+    import tensorflow as tf
+    import models.layers  # noqa: F401  (registers the custom SigNet layers for deserialization)
+    return InferenceModel(
+        tf.keras.models.load_model(path, custom_objects=custom_objects),
+        version=version,
+        jit_compile=jit_compile,
+        batch_buckets=batch_buckets
+    )
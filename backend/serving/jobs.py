@@ -0,0 +1,256 @@
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+import uuid
+
+logger = logging.getLogger(__name__)
+
+def _run_training_job(model_save_path, progress_queue, num_threads):
+    """Entry point of the training process"""
+    try:
+        # Stay out of the way of the serving process
+        if hasattr(os, 'nice'):
+            os.nice(10)
+        import tensorflow as tf
+        if num_threads:
+            tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+            tf.config.threading.set_inter_op_parallelism_threads(max(1, num_threads // 2))
+        
+        from train import train_model
+        from utils.callbacks import TrainingProgressCallback
+        train_model(
+            model_save_path=model_save_path,
+            callbacks=[TrainingProgressCallback(progress_queue.put)],
+            plot_history=False
+        )
+        progress_queue.put({'event': 'done', 'model_path': model_save_path})
+    except Exception as e:
+        progress_queue.put({'event': 'failed', 'error': str(e), 'traceback': traceback.format_exc()})
+
+ACTIVE_STATUSES = ('queued', 'running', 'installing')
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+class TrainingJob:
+    def __init__(self, job_id, model_path, owner_pid=None):
+        self.job_id = job_id
+        self.model_path = model_path
+        self.owner_pid = owner_pid or os.getpid()
+        self.status = 'queued'
+        self.progress = {}
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'epoch': self.progress.get('epoch'),
+            'epochs': self.progress.get('epochs'),
+            'batch': self.progress.get('batch'),
+            'steps': self.progress.get('steps'),
+            'loss': self.progress.get('loss'),
+            'val_loss': self.progress.get('val_loss'),
+            'accuracy': self.progress.get('accuracy'),
+            'eta_seconds': self.progress.get('eta_seconds'),
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'error': self.error
+        }
+
+    @classmethod
+    def from_record(cls, record):
+        job = cls(record['job_id'], record['model_path'], owner_pid=record['owner_pid'])
+        for key in ('status', 'error', 'submitted_at', 'started_at', 'finished_at'):
+            setattr(job, key, record[key])
+        job.progress = record['progress']
+        # The server process running the job's monitor died (e.g. a restarted worker)
+        if job.status in ACTIVE_STATUSES and not _process_alive(job.owner_pid):
+            job.status, job.error = 'failed', 'The server process running this job exited'
+            job.finished_at = job.finished_at or time.time()
+        return job
+
+    def record(self):
+        return dict(
+            {key: getattr(self, key) for key in ('job_id', 'model_path', 'owner_pid', 'status', 'error',
+                                                  'submitted_at', 'started_at', 'finished_at')},
+            progress=self.progress
+        )
+
+class TrainingJobManager:
+    """Runs train_model() in a separate process and hands the result to ``on_model_ready``.
+    
+    ``on_model_ready(model_path)`` is called from a monitor thread once the
+    training process has saved its model; it is expected to validate, warm up
+    and install the new model, raising to mark the job as failed.
+    
+    Job state lives in ``Config.TRAINING_JOBS_DIR``, one JSON file per job
+    written by the server process that started it, so every worker process of
+    the server answers status requests for every job. Only one job runs at a
+    time across all of them: ``submit`` claims an ``active`` marker file with
+    an exclusive create, which is released when the job ends (or taken over
+    when the process that held it is gone).
+    """
+
+    ACTIVE_MARKER = 'active'
+
+    def __init__(self, config, on_model_ready):
+        self.config = config
+        self.on_model_ready = on_model_ready
+        self.directory = config.TRAINING_JOBS_DIR
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # Spawn rather than fork: the serving process already holds TensorFlow state
+        self._context = multiprocessing.get_context('spawn')
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f'{job_id}.json')
+
+    def _save(self, job):
+        tmp_path = f'{self._path(job.job_id)}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(job.record(), f)
+        os.replace(tmp_path, self._path(job.job_id))
+
+    def _load(self, path):
+        try:
+            with open(path) as f:
+                return TrainingJob.from_record(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _claim(self, job_id):
+        """Atomically become the one active job; False if another live job holds the marker"""
+        marker = os.path.join(self.directory, self.ACTIVE_MARKER)
+        for _ in range(2):
+            try:
+                fd = os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    with open(marker) as f:
+                        holder = self.get(f.read().strip())
+                except OSError:
+                    continue
+                if holder is not None and holder.status in ACTIVE_STATUSES:
+                    return False
+                # Left behind by a job whose server process died
+                try:
+                    os.remove(marker)
+                except FileNotFoundError:
+                    pass
+                continue
+            with os.fdopen(fd, 'w') as f:
+                f.write(job_id)
+            return True
+        return False
+
+    def _release(self, job_id):
+        marker = os.path.join(self.directory, self.ACTIVE_MARKER)
+        try:
+            with open(marker) as f:
+                if f.read().strip() == job_id:
+                    os.remove(marker)
+        except OSError:
+            pass
+
+    def submit(self):
+        """Start a training job; returns None if one is already running in any server process"""
+        with self._lock:
+            job_id = uuid.uuid4().hex[:12]
+            directory = os.path.dirname(self.config.MODEL_SAVE_PATH) or '.'
+            job = TrainingJob(job_id, os.path.join(directory, f'siamese_model.job-{job_id}.h5'))
+            self._save(job)
+            if not self._claim(job_id):
+                os.remove(self._path(job_id))
+                return None
+        
+        progress_queue = self._context.Queue()
+        process = self._context.Process(
+            target=_run_training_job,
+            args=(job.model_path, progress_queue, self.config.TRAINING_JOB_THREADS),
+            daemon=True
+        )
+        try:
+            process.start()
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+            job.finished_at = time.time()
+            self._save(job)
+            self._release(job_id)
+            raise
+        job.status = 'running'
+        job.started_at = time.time()
+        self._save(job)
+        threading.Thread(target=self._monitor, args=(job, process, progress_queue), daemon=True).start()
+        return job
+
+    def get(self, job_id):
+        if not job_id.isalnum():
+            return None
+        return self._load(self._path(job_id))
+
+    def jobs(self):
+        jobs = (self._load(os.path.join(self.directory, name))
+                for name in os.listdir(self.directory) if name.endswith('.json'))
+        return sorted((job for job in jobs if job is not None), key=lambda job: job.submitted_at, reverse=True)
+
+    def _monitor(self, job, process, progress_queue):
+        try:
+            self._follow(job, process, progress_queue)
+        finally:
+            job.finished_at = time.time()
+            self._save(job)
+            self._release(job.job_id)
+
+    def _follow(self, job, process, progress_queue):
+        result = None
+        last_saved = 0.0
+        while result is None:
+            try:
+                message = progress_queue.get(timeout=1.0)
+            except Exception:
+                if not process.is_alive():
+                    result = {'event': 'failed', 'error': f'Training process exited with code {process.exitcode}'}
+                continue
+            if message['event'] in ('done', 'failed'):
+                result = message
+            elif message['event'] == 'train_begin':
+                job.progress.update(epochs=message['epochs'], steps=message['steps'])
+            else:
+                job.progress.update(message)
+            # Share progress with the other server processes, at most once a second
+            if time.time() - last_saved >= 1.0:
+                self._save(job)
+                last_saved = time.time()
+        process.join()
+        
+        if result['event'] == 'failed':
+            job.status = 'failed'
+            job.error = result['error']
+            logger.error(f"Training job {job.job_id} failed: {result.get('traceback', result['error'])}")
+        else:
+            job.status = 'installing'
+            self._save(job)
+            try:
+                self.on_model_ready(result['model_path'])
+                job.status = 'succeeded'
+                logger.info(f"Training job {job.job_id} finished and its model is now serving")
+            except Exception as e:
+                job.status = 'failed'
+                job.error = f'New model rejected: {str(e)}'
+                logger.error(f"Training job {job.job_id}: {job.error}")
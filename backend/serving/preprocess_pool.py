@@ -0,0 +1,48 @@
+import base64
+import binascii
+import os
+import time
+import numpy as np
+
+# Functions run in the decode processes of the async server (async_app.py). This module
+# must stay importable without TensorFlow, so the workers only load NumPy, OpenCV and
+# Pillow (which data.image_preprocessing uses to read image headers).
+
+def init_worker():
+    """Keep each decode process on one core; the pool itself provides the parallelism"""
+    import cv2
+    cv2.setNumThreads(1)
+    import data.image_preprocessing  # noqa: F401
+
+def worker_pid():
+    """Trivial task used to start every worker of the pool up front"""
+    return os.getpid()
+
+def preprocess_upload(image_data, image_shape, crop=False, oversampling=4):
+    """Preprocess an upload the same way as training.
+
+    ``image_data`` is the base64 text (optionally a data URL) or the image
+    bytes it encodes, when the server has already decoded them.
+
+    Returns ``(image, encoded_bytes, decoded_pixels, seconds)``. ``image`` is
+    uint8 ``[H, W, 1]`` and already inverted, a quarter of the float32 size to
+    send back to the server. It is None if the upload cannot be decoded.
+    """
+    from data.image_preprocessing import decode_grayscale, finish_batch, resize_grayscale
+    start = time.perf_counter()
+    if isinstance(image_data, bytes):
+        image_bytes = image_data
+    else:
+        try:
+            image_bytes = base64.b64decode(image_data.split(',')[1] if ',' in image_data else image_data)
+        except (binascii.Error, ValueError):
+            return None, 0, 0, time.perf_counter() - start
+    try:
+        image = decode_grayscale(image_bytes, image_shape, oversampling)
+        if image is None or image.size == 0:
+            return None, len(image_bytes), 0, time.perf_counter() - start
+        pixels = image.size
+        image = resize_grayscale(image, image_shape, crop)
+    except Exception:
+        return None, len(image_bytes), 0, time.perf_counter() - start
+    return finish_batch(image[np.newaxis], np.uint8)[0], len(image_bytes), pixels, time.perf_counter() - start
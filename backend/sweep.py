@@ -0,0 +1,253 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+from config.config import Config
+
+# Settings that shape the shared preprocessed dataset; every trial has to use the same ones
+DATA_SETTINGS = ("IMAGE_SHAPE", "INPUT_SHAPE", "DATASET_PATH", "EXTRACT_PATH", "USE_PACKED_DATASET",
+                 "PACKED_DATASET_PATH", "PREPROCESSING_VERSION", "PREPROCESS_CROP_TO_INK",
+                 "PREPROCESS_DECODE_OVERSAMPLING")
+
+def load_space(spec):
+    """Search space from a JSON file or string: ``{"LEARNING_RATE": [1e-4, 3e-4], "MARGIN": {"uniform": [0.5, 2]}}``.
+
+    A list is a set of choices; ``{"uniform": [low, high]}``,
+    ``{"loguniform": [low, high]}`` and ``{"int": [low, high]}`` (inclusive)
+    are distributions for random search. Keys are ``Config`` attributes.
+    """
+    if os.path.isfile(spec):
+        with open(spec) as f:
+            space = json.load(f)
+    else:
+        space = json.loads(spec)
+    for name, values in space.items():
+        if not hasattr(Config, name):
+            raise ValueError(f"Unknown Config setting {name}")
+        if name in DATA_SETTINGS:
+            raise ValueError(f"{name} changes the preprocessed dataset shared by all trials and cannot be swept")
+        if isinstance(values, dict) and (len(values) != 1 or next(iter(values)) not in ("uniform", "loguniform", "int")):
+            raise ValueError(f"{name}: expected a list of choices or one of uniform/loguniform/int")
+    return space
+
+def sample_trials(space, num_trials=None, seed=0):
+    """Every combination of a grid (``num_trials`` None), else ``num_trials`` random draws"""
+    if num_trials is None:
+        if any(isinstance(values, dict) for values in space.values()):
+            raise ValueError("Distributions need random search (pass the number of trials)")
+        names = list(space)
+        return [dict(zip(names, combination)) for combination in itertools.product(*space.values())]
+
+    rng = np.random.RandomState(seed)
+    def draw(values):
+        if isinstance(values, list):
+            return values[rng.randint(len(values))]
+        (kind, (low, high)), = values.items()
+        if kind == "uniform":
+            return float(rng.uniform(low, high))
+        if kind == "loguniform":
+            return float(np.exp(rng.uniform(np.log(low), np.log(high))))
+        return int(rng.randint(low, high + 1))
+    return [{name: draw(values) for name, values in space.items()} for _ in range(num_trials)]
+
+def trial_name(params, epochs):
+    """Directory name of a trial, derived from its settings so that a changed search space never reuses other results"""
+    key = json.dumps({"params": params, "epochs": epochs}, sort_keys=True)
+    return f"trial-{hashlib.sha256(key.encode()).hexdigest()[:8]}"
+
+def prepare_dataset(config):
+    """Download, preprocess and pack the dataset once; trials memory-map the same shards"""
+    from data.dataset_loader import DatasetLoader
+    from data.data_preprocessing import DataPreprocessor
+    from train import load_training_data
+    Config.USE_PACKED_DATASET = True
+    images, _ = load_training_data(config, DatasetLoader(config), DataPreprocessor(config))
+    return len(images)
+
+def run_sweep(space, num_trials=None, parallel=None, threads_per_trial=None, sweep_dir=None, epochs=None, seed=0):
+    """Train every trial of ``space`` in its own process, ``parallel`` at a time, and rank them.
+
+    The dataset is preprocessed and packed once, up front; the trials then
+    memory-map the same read-only shards, so the operating system keeps a
+    single copy in its page cache. Each trial is pinned to its own
+    ``threads_per_trial`` cores. Trials report their validation metric after
+    every epoch, and one that trails the median of the others is pruned
+    (``MedianPruningCallback``). Each trial works in its own directory under
+    ``sweep_dir``, named after a hash of its parameters and epoch count;
+    running the sweep again skips trials that already finished and resumes
+    interrupted ones from their checkpoints, while a changed search space or
+    epoch count gets new trials. The report ranks this sweep's trials only.
+    """
+    config = Config()
+    sweep_dir = os.path.abspath(sweep_dir or config.SWEEP_DIR)
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    threads_per_trial = threads_per_trial or config.SWEEP_THREADS_PER_TRIAL
+    parallel = parallel or config.SWEEP_PARALLEL_TRIALS or max(1, len(cores) // threads_per_trial)
+    trials = sample_trials(space, num_trials, seed)
+    os.makedirs(sweep_dir, exist_ok=True)
+
+    print("Preparing the shared dataset...")
+    print(f"{prepare_dataset(config)} images packed; {len(trials)} trials, {parallel} at a time, "
+          f"{threads_per_trial} cores each")
+
+    names, pending = [], []
+    for params in trials:
+        name = trial_name(params, epochs)
+        if name in names:  # Random search drew the same settings twice
+            continue
+        names.append(name)
+        trial_dir = os.path.join(sweep_dir, name)
+        os.makedirs(trial_dir, exist_ok=True)
+        with open(os.path.join(trial_dir, "params.json"), "w") as f:
+            json.dump({"params": params, "epochs": epochs}, f)
+        if not os.path.exists(os.path.join(trial_dir, "result.json")):
+            pending.append(trial_dir)
+
+    start = time.perf_counter()
+    running = {}  # slot -> (process, trial_dir, log file)
+    while pending or running:
+        for slot in [slot for slot, (process, _, _) in running.items() if process.poll() is not None]:
+            process, trial_dir, log = running.pop(slot)
+            log.close()
+            status = "done" if process.returncode == 0 else f"failed (exit code {process.returncode})"
+            print(f"{os.path.basename(trial_dir)} {status}")
+        for slot in range(parallel):
+            if slot in running or not pending:
+                continue
+            trial_dir = pending.pop(0)
+            slot_cores = [cores[(slot * threads_per_trial + i) % len(cores)] for i in range(threads_per_trial)]
+            log = open(os.path.join(trial_dir, "train.log"), "a")
+            command = [sys.executable, os.path.abspath(__file__), "trial", "--dir", trial_dir,
+                       "--sweep-dir", sweep_dir, "--cores", ",".join(map(str, slot_cores))]
+            env = {name: value for name, value in os.environ.items() if name != "TF_CONFIG"}  # Trials train alone
+            running[slot] = (subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, env=env), trial_dir, log)
+            print(f"Started {os.path.basename(trial_dir)} on cores {slot_cores}")
+        time.sleep(1)
+
+    report = collect_report(sweep_dir, config, names)
+    report["wall_seconds"] = time.perf_counter() - start
+    with open(os.path.join(sweep_dir, "report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    print_report(report)
+    print(f"\nReport written to {os.path.join(sweep_dir, 'report.json')}")
+    return report
+
+def run_trial(trial_dir, sweep_dir, cores):
+    """Entry point of one trial process"""
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(len(cores))
+    tf.config.threading.set_inter_op_parallelism_threads(max(1, len(cores) // 2))
+
+    from train import train_model
+    from utils.callbacks import MedianPruningCallback
+    with open(os.path.join(trial_dir, "params.json")) as f:
+        trial = json.load(f)
+    for name, value in trial["params"].items():
+        setattr(Config, name, value)
+    if trial["epochs"]:
+        Config.EPOCHS = trial["epochs"]
+    Config.USE_PACKED_DATASET = True
+    Config.CHECKPOINT_DIR = os.path.join(trial_dir, "checkpoints")
+    Config.MODEL_SAVE_PATH = os.path.join(trial_dir, "siamese_model.h5")
+    config = Config()
+
+    pruner = MedianPruningCallback(sweep_dir, trial_dir, monitor=config.SWEEP_METRIC, mode=_mode(config.SWEEP_METRIC),
+                                   warmup_epochs=config.SWEEP_PRUNE_WARMUP_EPOCHS,
+                                   min_trials=config.SWEEP_PRUNE_MIN_TRIALS)
+    start = time.perf_counter()
+    train_model(callbacks=[pruner], plot_history=False)
+    with open(os.path.join(trial_dir, "result.json"), "w") as f:
+        json.dump({
+            "params": trial["params"],
+            "status": "pruned" if pruner.pruned else "complete",
+            "best": pruner.best(pruner.values) if pruner.values else None,
+            "values": pruner.values,
+            "epochs": len(pruner.values),
+            "seconds": time.perf_counter() - start,
+            "model_path": config.MODEL_SAVE_PATH
+        }, f, indent=2)
+
+def _mode(metric):
+    return "max" if "accuracy" in metric or "auc" in metric else "min"
+
+def collect_report(sweep_dir, config, names=None):
+    """Rank finished trials by their best validation metric: completed trials first, then pruned, then failed.
+
+    ``names`` limits the report to those trial directories; by default every
+    trial in ``sweep_dir`` is ranked.
+    """
+    trials = []
+    for name in sorted(os.listdir(sweep_dir)):
+        if names is not None and name not in names:
+            continue
+        trial_dir = os.path.join(sweep_dir, name)
+        if not os.path.isfile(os.path.join(trial_dir, "params.json")):
+            continue
+        with open(os.path.join(trial_dir, "params.json")) as f:
+            trial = json.load(f)
+        try:
+            with open(os.path.join(trial_dir, "result.json")) as f:
+                result = json.load(f)
+        except (OSError, ValueError):
+            result = {"params": trial["params"], "status": "failed", "best": None, "epochs": 0}
+        trials.append(dict(result, trial=name, max_epochs=trial["epochs"] or config.EPOCHS))
+
+    sign = 1 if _mode(config.SWEEP_METRIC) == "min" else -1
+    order = {"complete": 0, "pruned": 1, "failed": 2}
+    trials.sort(key=lambda trial: (order[trial["status"]], sign * trial["best"] if trial["best"] is not None else 0))
+    epochs_trained = sum(trial["epochs"] for trial in trials)
+    return {
+        "metric": config.SWEEP_METRIC,
+        "trials": trials,
+        "best": trials[0] if trials and trials[0]["status"] != "failed" else None,
+        "epochs_trained": epochs_trained,
+        # Training cost relative to running every trial for all epochs
+        "epoch_fraction": epochs_trained / max(1, sum(trial["max_epochs"] for trial in trials))
+    }
+
+def print_report(report):
+    print(f"\n{'rank':>4}  {'trial':<16}{'status':<10}{report['metric']:>12}{'epochs':>8}{'seconds':>9}  params")
+    for rank, trial in enumerate(report["trials"], 1):
+        best = f"{trial['best']:.4f}" if trial["best"] is not None else "-"
+        seconds = f"{trial['seconds']:.0f}" if "seconds" in trial else "-"
+        params = ", ".join(f"{name}={value:g}" if isinstance(value, float) else f"{name}={value}"
+                           for name, value in trial["params"].items())
+        print(f"{rank:>4}  {trial['trial']:<16}{trial['status']:<10}{best:>12}{trial['epochs']:>8}{seconds:>9}  {params}")
+    print(f"\n{report['epochs_trained']} epochs trained, {report['epoch_fraction']:.0%} of running every trial to the end")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel hyperparameter sweep over one shared packed dataset")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="Run a grid or random search")
+    run_parser.add_argument("space", help="Search space as a JSON file or string (see load_space)")
+    run_parser.add_argument("--trials", type=int, default=None,
+                            help="Random search with this many trials (default: the full grid)")
+    run_parser.add_argument("--parallel", type=int, default=None,
+                            help="Concurrent trials (defaults to Config.SWEEP_PARALLEL_TRIALS or cores / threads)")
+    run_parser.add_argument("--threads-per-trial", type=int, default=None,
+                            help="Cores per trial (defaults to Config.SWEEP_THREADS_PER_TRIAL)")
+    run_parser.add_argument("--dir", default=None, help="Sweep directory (defaults to Config.SWEEP_DIR)")
+    run_parser.add_argument("--epochs", type=int, default=None, help="Override Config.EPOCHS for every trial")
+    run_parser.add_argument("--seed", type=int, default=0, help="Random search seed")
+    report_parser = subparsers.add_parser("report", help="Rank the trials of an existing sweep")
+    report_parser.add_argument("--dir", default=None, help="Sweep directory (defaults to Config.SWEEP_DIR)")
+    trial_parser = subparsers.add_parser("trial", help=argparse.SUPPRESS)
+    trial_parser.add_argument("--dir", required=True)
+    trial_parser.add_argument("--sweep-dir", required=True)
+    trial_parser.add_argument("--cores", required=True)
+    args = parser.parse_args()
+
+    if args.command == "trial":
+        run_trial(args.dir, args.sweep_dir, [int(core) for core in args.cores.split(",")])
+    elif args.command == "report":
+        print_report(collect_report(args.dir or Config.SWEEP_DIR, Config()))
+    else:
+        run_sweep(load_space(args.space), args.trials, args.parallel, args.threads_per_trial, args.dir,
+                  args.epochs, args.seed)
@@ -1,14 +1,141 @@
+import json
+import os
+import shutil
+import tempfile
+from functools import partial
 import tensorflow as tf
 import numpy as np
 from config.config import Config
 from data.dataset_loader import DatasetLoader
 from data.data_preprocessing import DataPreprocessor
+from data.shards import ShardedDataset
 from models.siamese import SiameseModel
-from utils.losses import contrastive_loss
+from models.in_batch import InBatchSiameseTrainer
+from utils.callbacks import CheckpointCallback, ProfilingCallback, ThroughputCallback
+from utils.losses import configured_contrastive_loss
 from utils.visualization import Visualizer
 
-def train_model():
+def load_training_data(config, loader, preprocessor):
+    """Return the image tensor and per-writer image index, from packed shards when available"""
+    shards = ShardedDataset(config)
+    if config.USE_PACKED_DATASET and shards.exists():
+        print(f"Using packed dataset at {shards.root} ({len(shards)} images)")
+        return shards.open()
+    
+    print("Loading dataset...")
+    loader.download_and_extract_dataset()
+    dataset, orig, forg = loader.load_dataset_paths()
+    
+    print("Preprocessing data...")
+    if config.USE_PACKED_DATASET:
+        shards.pack(dataset, orig, preprocessor)
+        print(f"Packed {len(shards)} images into {shards.root}")
+        return shards.open()
+    
+    processed_dataset = preprocessor.preprocess_dataset(dataset, orig)
+    return preprocessor.build_image_index(processed_dataset)
+
+def create_strategy():
+    """Pick the tf.distribute strategy from the environment.
+    
+    When TF_CONFIG describes a cluster of several workers (see distributed.py),
+    this process is one worker of a MultiWorkerMirroredStrategy. Otherwise
+    training runs in this process on whatever devices TensorFlow finds.
+    Returns the strategy, this worker's index and the number of workers.
+    """
+    tf_config = json.loads(os.environ.get("TF_CONFIG", "{}"))
+    workers = tf_config.get("cluster", {}).get("worker", [])
+    if len(workers) > 1:
+        strategy = tf.distribute.MultiWorkerMirroredStrategy(
+            communication_options=tf.distribute.experimental.CommunicationOptions(
+                implementation=tf.distribute.experimental.CommunicationImplementation.RING
+            )
+        )
+        return strategy, tf_config["task"]["index"], len(workers)
+    return tf.distribute.get_strategy(), 0, 1
+
+def fit_distributed(trainer, strategy, train_data, steps_per_epoch, initial_epoch, epochs,
+                    validation_data, validation_steps, callbacks=None, verbose=1):
+    """``trainer.fit`` for MultiWorkerMirroredStrategy, as a custom loop around ``strategy.run``.
+    
+    Keras 3's ``fit`` cannot run under this strategy: before the first step it
+    reduces a per-replica batch eagerly across the workers to build the model,
+    which the collective ops reject. This loop runs the trainer's own
+    ``train_step`` and ``test_step`` on every replica instead, averages their
+    logs across the workers and drives the callbacks the way ``fit`` does. Every
+    worker sees the same logs, so callbacks such as early stopping decide the
+    same on all of them; ``stop_training`` is honoured at epoch boundaries,
+    where the workers are in step. Non-trainable state such as BatchNorm moving
+    statistics is updated from each worker's own batches, so it is averaged
+    across the workers after every epoch, before validation and checkpointing.
+    Returns the History callback.
+    """
+    with strategy.scope():
+        if not trainer.optimizer.built:
+            trainer.optimizer.build(trainer.trainable_variables)
+    
+    def distributed(step):
+        @tf.function
+        def run(iterator):
+            logs = strategy.run(step, args=(next(iterator),))
+            return {name: strategy.reduce("MEAN", value, axis=None) for name, value in logs.items()}
+        return run
+    train_function, test_function = distributed(trainer.train_step), distributed(trainer.test_step)
+    
+    @tf.function
+    def average_non_trainable():
+        def average():
+            context = tf.distribute.get_replica_context()
+            for variable in trainer.non_trainable_variables:
+                if tf.as_dtype(variable.dtype).is_floating:
+                    variable.assign(context.all_reduce("MEAN", tf.identity(variable.value)))
+        strategy.run(average)
+    train_iterator = iter(strategy.experimental_distribute_dataset(train_data))
+    val_iterator = iter(strategy.experimental_distribute_dataset(validation_data))
+    
+    callback_list = tf.keras.callbacks.CallbackList(
+        callbacks, add_history=True, add_progbar=verbose != 0, model=trainer,
+        verbose=verbose, epochs=epochs, steps=steps_per_epoch
+    )
+    history = next(callback for callback in callback_list.callbacks
+                   if isinstance(callback, tf.keras.callbacks.History))
+    trainer.stop_training = False
+    callback_list.on_train_begin()
+    logs = {}
+    for epoch in range(initial_epoch, epochs):
+        trainer.reset_metrics()
+        callback_list.on_epoch_begin(epoch)
+        for step in range(steps_per_epoch):
+            callback_list.on_train_batch_begin(step)
+            logs = {name: float(value) for name, value in train_function(train_iterator).items()}
+            callback_list.on_train_batch_end(step, logs)
+        epoch_logs = dict(logs)
+        average_non_trainable()
+        
+        trainer.reset_metrics()
+        callback_list.on_test_begin()
+        val_logs = {}
+        for step in range(validation_steps):
+            callback_list.on_test_batch_begin(step)
+            val_logs = {name: float(value) for name, value in test_function(val_iterator).items()}
+            callback_list.on_test_batch_end(step, val_logs)
+        callback_list.on_test_end(val_logs)
+        epoch_logs.update({f"val_{name}": value for name, value in val_logs.items()})
+        
+        callback_list.on_epoch_end(epoch, epoch_logs)
+        logs = epoch_logs
+        if trainer.stop_training:
+            break
+    callback_list.on_train_end(logs)
+    return history
+
+def train_model(model_save_path=None, callbacks=None, plot_history=True):
     config = Config()
+    model_save_path = model_save_path or config.MODEL_SAVE_PATH
+    
+    # The strategy has to exist before any other TensorFlow op runs
+    strategy, worker_index, num_workers = create_strategy()
+    distributed = num_workers > 1
     
     # Initialize components
     loader = DatasetLoader(config)
@@ -17,56 +144,155 @@ def train_model():
     visualizer = Visualizer()
     
     # Load and preprocess data
-    print("Loading dataset...")
-    extract_path = loader.download_and_extract_dataset()
-    dataset, orig, forg = loader.load_dataset_paths()
-    
-    print("Preprocessing data...")
-    processed_dataset = preprocessor.preprocess_dataset(dataset, orig)
-    pairs, labels = preprocessor.create_pairs(processed_dataset)
+    images, image_index = load_training_data(config, loader, preprocessor)
+    pairs = preprocessor.create_pairs(image_index)
     
     # Split data
-    (train_pairs, train_labels), (val_pairs, val_labels), (test_pairs, test_labels) = preprocessor.split_data(pairs, labels)
+    train_pairs, val_pairs, test_pairs = preprocessor.split_data(pairs)
     
     print(f"Training pairs: {len(train_pairs)}")
     print(f"Validation pairs: {len(val_pairs)}")
     print(f"Test pairs: {len(test_pairs)}")
     
+    # Config.BATCH_SIZE is per worker; the global batch and the learning rate grow with the worker count
+    global_batch_size = config.BATCH_SIZE * num_workers
+    learning_rate = config.LEARNING_RATE * (num_workers if config.SCALE_LEARNING_RATE else 1)
+    if distributed:
+        print(f"Worker {worker_index} of {num_workers}: global batch size {global_batch_size}, "
+              f"learning rate {learning_rate:g}")
+    
     # Create and compile model
     print("Creating Siamese model...")
-    with tf.device('/GPU:0'):
+    with strategy.scope():
         siamese_model = siamese_model_builder.create_siamese_model()
         
         optimizer = tf.keras.optimizers.AdamW(
-            learning_rate=config.LEARNING_RATE, 
+            learning_rate=learning_rate, 
             weight_decay=config.WEIGHT_DECAY
         )
         
-        siamese_model.compile(
-            optimizer=optimizer,
-            loss=contrastive_loss,
-            metrics=['accuracy']
+        if config.TRAINING_MODE == "in_batch":
+            trainer = InBatchSiameseTrainer(siamese_model, config)
+            trainer.compile(optimizer=optimizer)
+        else:
+            trainer = siamese_model
+            siamese_model.compile(
+                optimizer=optimizer,
+                loss=configured_contrastive_loss(config),
+                metrics=['accuracy']
+            )
+    
+    # Each worker reads its own shard in global batches, which tf.distribute splits across the workers.
+    # Training pipelines repeat with a fixed number of steps per epoch, so every worker runs the same
+    # steps and a resumed run can restart the pipeline at the batch where it stopped.
+    shard = (num_workers, worker_index) if distributed else None
+    if config.TRAINING_MODE == "in_batch":
+        # Sample writers and signatures; all pairs are formed and mined inside each batch
+        train_ids = np.unique(train_pairs[:, :2])
+        train_index = {
+            writer: {kind: indices[np.isin(indices, train_ids)] for kind, indices in values.items()}
+            for writer, values in image_index.items()
+        }
+        samples_per_step = 2 * config.IN_BATCH_WRITERS * config.IN_BATCH_SAMPLES
+        print(f"In-batch training: {samples_per_step} images per batch, {config.MINING} mining, {config.IN_BATCH_LOSS} loss")
+        make_train_data = lambda start_batch: preprocessor.make_writer_batch_dataset(
+            images, train_index, shard=shard, start_batch=start_batch)
+        steps_per_epoch = max(1, len(train_ids) // (samples_per_step * num_workers))
+    else:
+        samples_per_step = config.BATCH_SIZE
+        make_train_data = lambda start_batch: preprocessor.make_pair_dataset(
+            images, train_pairs, global_batch_size, shuffle=True, repeat=True, shard=shard, start_batch=start_batch)
+        steps_per_epoch = preprocessor.pair_steps_per_epoch(len(train_pairs), global_batch_size, shard)
+    val_data = preprocessor.make_pair_dataset(images, val_pairs, global_batch_size, repeat=distributed, shard=shard)
+    validation_steps = preprocessor.pair_steps_per_epoch(len(val_pairs), global_batch_size, shard) if distributed else None
+    
+    # Checkpoints of model, optimizer, pipeline position and early-stopping state. A run with another
+    # model, pipeline, optimizer or loss setting does not resume them.
+    run_info = {"mode": config.TRAINING_MODE, "architecture": config.ARCHITECTURE, "batch_size": global_batch_size,
+                "steps_per_epoch": steps_per_epoch, "workers": num_workers, "learning_rate": learning_rate,
+                "weight_decay": config.WEIGHT_DECAY, "margin": config.MARGIN, "alpha": config.ALPHA, "beta": config.BETA}
+    if config.TRAINING_MODE == "in_batch":
+        run_info.update(loss=config.IN_BATCH_LOSS, mining=config.MINING, triplet_margin=config.TRIPLET_MARGIN,
+                        mining_margin=config.MINING_MARGIN, mining_hard_negatives=config.MINING_HARD_NEGATIVES,
+                        cross_writer=config.IN_BATCH_CROSS_WRITER)
+    checkpoint = CheckpointCallback(
+        siamese_model, optimizer, config.CHECKPOINT_DIR,
+        run_info=run_info,
+        every_n_steps=config.CHECKPOINT_EVERY_STEPS,
+        max_to_keep=config.CHECKPOINT_KEEP,
+        keep_every_n_hours=config.CHECKPOINT_KEEP_EVERY_HOURS,
+        patience=config.EARLY_STOPPING_PATIENCE,
+        min_delta=config.EARLY_STOPPING_MIN_DELTA,
+        save_directory=None if worker_index == 0 else tempfile.mkdtemp(prefix=f"signet-worker-{worker_index}-")
+    )
+    with strategy.scope():
+        start_batch = checkpoint.restore() if config.RESUME_TRAINING else checkpoint.reset()
+    
+    callbacks = list(callbacks or []) + [checkpoint]
+    if not any(isinstance(callback, ThroughputCallback) for callback in callbacks):
+        callbacks.append(ThroughputCallback(samples_per_step, worker_index, num_workers))
+    profiler = None
+    if config.PROFILE_TRAINING:
+        profiler = ProfilingCallback(
+            os.path.join(config.PROFILE_DIR, f"worker-{worker_index}") if distributed else config.PROFILE_DIR,
+            samples_per_step,
+            trace_steps=config.PROFILE_TRACE_STEPS,
+            stall_fraction=config.PROFILE_STALL_FRACTION
         )
+        callbacks.append(profiler)
+    
+    # A run resumed mid-epoch first finishes that epoch, then continues epoch by epoch
+    epoch, done = divmod(start_batch, steps_per_epoch)
+    phases = []
+    if done:
+        phases.append((epoch, epoch + 1, steps_per_epoch - done, start_batch))
+        epoch += 1
+    if epoch < config.EPOCHS:
+        phases.append((epoch, config.EPOCHS, steps_per_epoch, epoch * steps_per_epoch))
     
     # Train model
     print("Training model...")
-    history = siamese_model.fit(
-        x=[train_pairs[:, 0], train_pairs[:, 1]],
-        y=train_labels,
-        batch_size=config.BATCH_SIZE,
-        epochs=config.EPOCHS,
-        validation_data=([val_pairs[:, 0], val_pairs[:, 1]], val_labels),
-        verbose=1
-    )
+    history = None
+    for initial_epoch, epochs, steps, first_batch in phases:
+        # Early stopping, or another callback (e.g. sweep pruning) ended the run
+        if checkpoint.stopped_early or getattr(trainer, "stop_training", False):
+            break
+        train_data = make_train_data(first_batch)
+        if profiler is not None:
+            train_data = profiler.instrument(train_data)
+        fit = partial(fit_distributed, trainer, strategy) if distributed else trainer.fit
+        phase_history = fit(
+            train_data,
+            steps_per_epoch=steps,
+            initial_epoch=initial_epoch,
+            epochs=epochs,
+            validation_data=val_data,
+            validation_steps=validation_steps,
+            callbacks=callbacks,
+            verbose=1 if worker_index == 0 else 2
+        )
+        if history is not None:
+            for key, values in history.history.items():
+                phase_history.history[key] = values + phase_history.history.get(key, [])
+        history = phase_history
+    checkpoint.finish()
+    if worker_index != 0:
+        shutil.rmtree(checkpoint.save_directory, ignore_errors=True)
     
-    # Save model
-    siamese_model.save(config.MODEL_SAVE_PATH)
-    print(f"Model saved to {config.MODEL_SAVE_PATH}")
+    # Save model; every worker takes part, only the chief's copy is kept
+    if worker_index == 0:
+        siamese_model.save(model_save_path)
+        print(f"Model saved to {model_save_path}")
+    else:
+        scratch = tempfile.mkdtemp()
+        siamese_model.save(os.path.join(scratch, os.path.basename(model_save_path)))
+        shutil.rmtree(scratch, ignore_errors=True)
     
     # Visualize training history
-    visualizer.plot_training_history(history)
+    if plot_history and worker_index == 0 and history is not None:
+        visualizer.plot_training_history(history, path=config.TRAINING_PLOT_PATH)
     
-    return siamese_model, (test_pairs, test_labels)
+    return siamese_model, (images, test_pairs)
 
 if __name__ == "__main__":
     model, test_data = train_model()
\ No newline at end of file
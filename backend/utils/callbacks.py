@@ -0,0 +1,419 @@
+import json
+import os
+import shutil
+import sys
+import time
+import numpy as np
+import tensorflow as tf
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+class TrainingProgressCallback(tf.keras.callbacks.Callback):
+    """Report epoch, loss and ETA to a callable (e.g. a multiprocessing queue's put)"""
+
+    def __init__(self, report, every_n_batches=10):
+        super().__init__()
+        self.report = report
+        self.every_n_batches = every_n_batches
+        self._start = None
+        self._epoch = 0
+        self._epochs = None
+        self._steps = None
+
+    def on_train_begin(self, logs=None):
+        self._start = time.time()
+        self._epochs = self.params.get('epochs')
+        self._steps = self.params.get('steps')
+        self.report({'event': 'train_begin', 'epochs': self._epochs, 'steps': self._steps})
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch = epoch
+
+    def on_train_batch_end(self, batch, logs=None):
+        if (batch + 1) % self.every_n_batches == 0:
+            self.report(self._progress(batch + 1, logs))
+
+    def on_epoch_end(self, epoch, logs=None):
+        progress = self._progress(self._steps, logs)
+        progress['event'] = 'epoch_end'
+        self.report(progress)
+
+    def _progress(self, batches_done, logs):
+        logs = logs or {}
+        elapsed = time.time() - self._start
+        done = self._epoch + (batches_done / self._steps if self._steps else 1.0)
+        eta = elapsed / done * (self._epochs - done) if self._epochs and done > 0 else None
+        return {
+            'event': 'progress',
+            'epoch': self._epoch + 1,
+            'epochs': self._epochs,
+            'batch': batches_done,
+            'steps': self._steps,
+            'loss': float(logs['loss']) if 'loss' in logs else None,
+            'val_loss': float(logs['val_loss']) if 'val_loss' in logs else None,
+            'accuracy': float(logs['accuracy']) if 'accuracy' in logs else None,
+            'elapsed_seconds': elapsed,
+            'eta_seconds': eta
+        }
+
+class ThroughputCallback(tf.keras.callbacks.Callback):
+    """Log the samples/sec of this worker every epoch (training steps only, not validation)"""
+
+    def __init__(self, batch_size, worker_index=0, num_workers=1):
+        super().__init__()
+        self.batch_size = batch_size
+        self.worker_index = worker_index
+        self.num_workers = num_workers
+        self.samples_per_sec = []
+        self._steps = 0
+        self._seconds = 0.0
+        self._batch_start = None
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._steps = 0
+        self._seconds = 0.0
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self._batch_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._steps += 1
+        self._seconds += time.perf_counter() - self._batch_start
+
+    def on_epoch_end(self, epoch, logs=None):
+        rate = self._steps * self.batch_size / self._seconds if self._seconds else 0.0
+        self.samples_per_sec.append(rate)
+        print(f"[worker {self.worker_index}/{self.num_workers}] epoch {epoch + 1}: "
+              f"{rate:.1f} samples/sec ({self._steps} steps of {self.batch_size})")
+        if logs is not None:
+            logs['samples_per_sec'] = rate
+
+class CheckpointCallback(tf.keras.callbacks.Callback):
+    """Checkpoint training so an interrupted run resumes where it stopped, and stop early on val_loss.
+
+    ``directory`` holds a tf.train.CheckpointManager of model and optimizer
+    state: the last ``max_to_keep`` checkpoints, plus one every
+    ``keep_every_n_hours`` if set. A checkpoint is written every
+    ``every_n_steps`` training steps (if set) and at the end of every epoch.
+    It also records the number of batches trained, which is the position in
+    the deterministic training pipeline, and the early-stopping state.
+    ``best/`` keeps the weights with the lowest validation loss so far.
+    Training stops once val_loss has not improved by ``min_delta`` for
+    ``patience`` epochs.
+
+    ``run_info`` describes the run (mode, architecture, batch size, steps per
+    epoch, optimizer and loss settings) as JSON-serializable values;
+    checkpoints of a different or finished run are discarded instead of
+    resumed. Workers other than the chief pass ``save_directory`` so their
+    copies do not overwrite the chief's.
+    """
+
+    def __init__(self, siamese_model, optimizer, directory, run_info, every_n_steps=None, max_to_keep=3,
+                 keep_every_n_hours=None, patience=None, min_delta=0.0, save_directory=None):
+        super().__init__()
+        self.siamese_model = siamese_model
+        self.optimizer = optimizer
+        self.directory = directory
+        self.save_directory = save_directory or directory
+        self.run_info = run_info
+        self.every_n_steps = every_n_steps
+        self.max_to_keep = max_to_keep
+        self.keep_every_n_hours = keep_every_n_hours
+        self.patience = patience
+        self.min_delta = min_delta
+        self.stopped_early = False
+
+        self.batches = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.best_val_loss = tf.Variable(float("inf"), dtype=tf.float64, trainable=False)
+        self.wait = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self.finished = tf.Variable(False, trainable=False)
+        self.checkpoint = tf.train.Checkpoint(
+            model=siamese_model, optimizer=optimizer,
+            batches=self.batches, best_val_loss=self.best_val_loss, wait=self.wait, finished=self.finished
+        )
+        self.best = tf.train.Checkpoint(model=siamese_model)
+        self.manager = None
+        self.best_manager = None
+
+    def _managers(self, directory):
+        manager = tf.train.CheckpointManager(self.checkpoint, directory, max_to_keep=self.max_to_keep,
+                                             keep_checkpoint_every_n_hours=self.keep_every_n_hours)
+        best_manager = tf.train.CheckpointManager(self.best, os.path.join(directory, "best"), max_to_keep=1)
+        return manager, best_manager
+
+    def restore(self):
+        """Resume the unfinished run in ``directory``, if any; returns the number of batches already trained"""
+        if hasattr(self.optimizer, "build"):
+            # Create the optimizer slots up front so the checkpoint restores into them
+            self.optimizer.build(self.siamese_model.trainable_variables)
+        manager, _ = self._managers(self.directory)
+        try:
+            with open(os.path.join(self.directory, "run.json")) as f:
+                saved_info = json.load(f)
+        except (OSError, ValueError):
+            saved_info = None
+
+        if manager.latest_checkpoint and saved_info == self.run_info:
+            self.checkpoint.restore(manager.latest_checkpoint)
+            if not bool(self.finished.numpy()):
+                print(f"Resuming from {manager.latest_checkpoint} after {int(self.batches.numpy())} batches")
+                self.manager, self.best_manager = self._managers(self.save_directory)
+                self.stopped_early = bool(self.patience) and int(self.wait.numpy()) >= self.patience
+                return int(self.batches.numpy())
+            print(f"Checkpoints in {self.directory} belong to a finished run, starting over")
+        elif manager.latest_checkpoint:
+            print(f"Checkpoints in {self.directory} belong to a different run, starting over")
+        return self.reset()
+
+    def reset(self):
+        """Discard existing checkpoints and start a new run; returns 0"""
+        if self.save_directory == self.directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.save_directory, exist_ok=True)
+        with open(os.path.join(self.save_directory, "run.json"), "w") as f:
+            json.dump(self.run_info, f)
+        self.batches.assign(0)
+        self.best_val_loss.assign(float("inf"))
+        self.wait.assign(0)
+        self.finished.assign(False)
+        self.manager, self.best_manager = self._managers(self.save_directory)
+        return 0
+
+    def save(self):
+        self.manager.save(checkpoint_number=int(self.batches.numpy()))
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.batches.assign_add(1)
+        if self.every_n_steps and int(self.batches.numpy()) % self.every_n_steps == 0:
+            self.save()
+
+    def on_epoch_end(self, epoch, logs=None):
+        val_loss = (logs or {}).get("val_loss")
+        if val_loss is not None:
+            if val_loss < self.best_val_loss.numpy() - self.min_delta:
+                self.best_val_loss.assign(val_loss)
+                self.wait.assign(0)
+                self.best_manager.save()
+            else:
+                self.wait.assign_add(1)
+                if self.patience and int(self.wait.numpy()) >= self.patience:
+                    print(f"Early stopping: val_loss has not improved for {self.patience} epochs "
+                          f"(best {self.best_val_loss.numpy():.4f})")
+                    self.stopped_early = True
+                    self.model.stop_training = True
+        self.save()
+
+    def finish(self):
+        """Mark the run finished and load the best weights (lowest val_loss) into the model"""
+        self.finished.assign(True)
+        self.save()
+        if self.best_manager.latest_checkpoint:
+            self.best.restore(self.best_manager.latest_checkpoint).expect_partial()
+            print(f"Restored the best weights (val_loss {self.best_val_loss.numpy():.4f})")
+
+class MedianPruningCallback(tf.keras.callbacks.Callback):
+    """Stop a hyperparameter-sweep trial whose validation metric trails the other trials (see sweep.py).
+
+    After every epoch the trial's ``monitor`` value is appended to
+    ``progress.json`` in ``trial_dir``, and the progress files of the other
+    trials in ``sweep_dir`` are read back. From ``warmup_epochs`` on, once at
+    least ``min_trials`` other trials have reached the same epoch, the trial is
+    pruned if its best value so far is worse than the median of theirs at that
+    epoch. ``mode`` is "min" for losses and "max" for accuracies.
+    """
+
+    def __init__(self, sweep_dir, trial_dir, monitor="val_loss", mode="min", warmup_epochs=1, min_trials=3):
+        super().__init__()
+        self.sweep_dir = sweep_dir
+        self.trial_dir = trial_dir
+        self.monitor = monitor
+        self.best = min if mode == "min" else max
+        self.worse = (lambda a, b: a > b) if mode == "min" else (lambda a, b: a < b)
+        self.warmup_epochs = warmup_epochs
+        self.min_trials = min_trials
+        self.pruned = False
+        # A resumed trial continues its recorded history
+        progress = self._read(os.path.join(trial_dir, "progress.json"))
+        self.values = progress["values"] if progress else []
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _others(self, epoch):
+        """Best value up to ``epoch`` of every other trial that has reached it"""
+        bests = []
+        for name in os.listdir(self.sweep_dir):
+            directory = os.path.join(self.sweep_dir, name)
+            if os.path.abspath(directory) == os.path.abspath(self.trial_dir):
+                continue
+            progress = self._read(os.path.join(directory, "progress.json"))
+            if progress and len(progress["values"]) > epoch:
+                bests.append(self.best(progress["values"][:epoch + 1]))
+        return bests
+
+    def on_epoch_end(self, epoch, logs=None):
+        value = (logs or {}).get(self.monitor)
+        if value is None:
+            return
+        self.values = self.values[:epoch] + [float(value)]
+        own_best = self.best(self.values)
+        if epoch + 1 >= self.warmup_epochs:
+            others = self._others(epoch)
+            if len(others) >= self.min_trials and self.worse(own_best, float(np.median(others))):
+                print(f"Pruned after epoch {epoch + 1}: best {self.monitor} {own_best:.4f} is worse than "
+                      f"the median {np.median(others):.4f} of {len(others)} other trials")
+                self.pruned = True
+                self.model.stop_training = True
+
+        # Write-then-rename, so other trials never read a half-written file
+        path = os.path.join(self.trial_dir, "progress.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump({"values": self.values, "pruned": self.pruned}, f)
+        os.replace(path + ".tmp", path)
+
+def _rss_mb():
+    """Current and peak resident memory of this process in MB (None where unavailable)"""
+    current = peak = None
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is not None:
+        # Linux reports kilobytes, macOS bytes
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+    return current, peak
+
+class ProfilingCallback(tf.keras.callbacks.Callback):
+    """Record where training time goes: per-step wall time split into input wait and compute.
+
+    ``instrument(dataset)`` appends a timestamp to the training pipeline,
+    taken when the training step receives its batch. The time from the start
+    of a step to that timestamp is spent waiting for input; the rest is
+    compute. Each step is logged to ``steps.jsonl`` in ``directory`` with
+    examples/sec and resident memory. A summary per epoch goes to
+    ``summary.json``, and is printed with the share of time spent waiting for
+    input and the number of stalled steps (input wait above
+    ``stall_fraction`` of the step). The first step of every ``fit`` also
+    traces the training function; it is logged as warmup and left out of the
+    summary. A TensorBoard profiler trace of the
+    training steps in ``trace_steps = (first, last)`` is written to
+    ``directory/trace``, and ``profile.png`` plots the step times.
+    """
+
+    def __init__(self, directory, batch_size, trace_steps=None, stall_fraction=0.5):
+        super().__init__()
+        self.directory = directory
+        self.batch_size = batch_size
+        self.trace_steps = trace_steps
+        self.stall_fraction = stall_fraction
+        self.steps = []
+        self.epochs = []
+        self._step = 0
+        self._epoch = 0
+        self._epoch_start = 0
+        self._step_start = None
+        self._received = None
+        self._tracing = False
+        self._warmup = False
+        os.makedirs(directory, exist_ok=True)
+        self._log = open(os.path.join(directory, "steps.jsonl"), "w")
+
+    def instrument(self, dataset):
+        """Return ``dataset`` with the batch-received timestamp attached (after any prefetching)"""
+        def received():
+            self._received = time.perf_counter()
+            return np.int64(0)
+
+        def stamp(*element):
+            token = tf.py_function(received, [], tf.int64)
+            with tf.control_dependencies([token]):
+                element = tf.nest.map_structure(tf.identity, element)
+            return element if len(element) > 1 else element[0]
+        return dataset.map(stamp)
+
+    def on_train_begin(self, logs=None):
+        self._warmup = True
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch = epoch
+        self._epoch_start = len(self.steps)
+
+    def on_train_batch_begin(self, batch, logs=None):
+        if self.trace_steps and self._step == self.trace_steps[0]:
+            try:
+                tf.profiler.experimental.start(os.path.join(self.directory, "trace"))
+                self._tracing = True
+            except Exception as e:  # e.g. another profiler session is active
+                print(f"Could not start the profiler trace: {e}")
+        self._received = None
+        self._step_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        end = time.perf_counter()
+        if self._tracing and self._step >= self.trace_steps[1]:
+            tf.profiler.experimental.stop()
+            self._tracing = False
+            print(f"Profiler trace of steps {self.trace_steps[0]}-{self.trace_steps[1]} "
+                  f"written to {os.path.join(self.directory, 'trace')}")
+        wall = end - self._step_start
+        # Uninstrumented pipelines count as all compute
+        wait = min(max(self._received - self._step_start, 0.0), wall) if self._received else 0.0
+        current_rss, peak_rss = _rss_mb()
+        step = {
+            "step": self._step,
+            "epoch": self._epoch + 1,
+            "wall_ms": wall * 1000,
+            "input_wait_ms": wait * 1000,
+            "compute_ms": (wall - wait) * 1000,
+            "examples_per_sec": self.batch_size / wall if wall else 0.0,
+            "rss_mb": current_rss,
+            "peak_rss_mb": peak_rss,
+            "warmup": self._warmup
+        }
+        self._warmup = False
+        self.steps.append(step)
+        self._log.write(json.dumps(step) + "\n")
+        self._step += 1
+
+    def on_epoch_end(self, epoch, logs=None):
+        steps = [step for step in self.steps[self._epoch_start:] if not step["warmup"]]
+        if not steps:
+            return
+        wall = sum(step["wall_ms"] for step in steps)
+        wait = sum(step["input_wait_ms"] for step in steps)
+        summary = {
+            "epoch": epoch + 1,
+            "steps": len(steps),
+            "mean_step_ms": wall / len(steps),
+            "p95_step_ms": float(np.percentile([step["wall_ms"] for step in steps], 95)),
+            "input_wait_fraction": wait / wall if wall else 0.0,
+            "stalled_steps": sum(step["input_wait_ms"] > self.stall_fraction * step["wall_ms"] for step in steps),
+            "examples_per_sec": len(steps) * self.batch_size / (wall / 1000) if wall else 0.0,
+            "peak_rss_mb": steps[-1]["peak_rss_mb"]
+        }
+        self.epochs.append(summary)
+        self._log.flush()
+        print(f"Profile epoch {summary['epoch']}: {summary['mean_step_ms']:.1f} ms/step, "
+              f"{summary['input_wait_fraction']:.0%} waiting for input ({summary['stalled_steps']} stalled steps), "
+              f"{summary['examples_per_sec']:.1f} examples/sec, peak RSS {summary['peak_rss_mb'] or 0:.0f} MB")
+
+    def on_train_end(self, logs=None):
+        if self._tracing:
+            tf.profiler.experimental.stop()
+            self._tracing = False
+        self._log.flush()
+        with open(os.path.join(self.directory, "summary.json"), "w") as f:
+            json.dump({"batch_size": self.batch_size, "epochs": self.epochs}, f, indent=2)
+        steps = [step for step in self.steps if not step["warmup"]]
+        if steps:
+            from utils.visualization import Visualizer
+            Visualizer.plot_profile(steps, os.path.join(self.directory, "profile.png"))
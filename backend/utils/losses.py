@@ -1,3 +1,4 @@
+from functools import partial, update_wrapper
 import tensorflow as tf
 from config.config import Config
 
@@ -18,4 +19,30 @@ def contrastive_loss(y_true, y_pred, margin=1.0, alpha=1.0, beta=1.0):
     margin_square = tf.square(tf.maximum(0.0, margin - y_pred))
     
     loss = alpha * (1 - y_true) * square_pred + beta * y_true * margin_square
-    return tf.reduce_mean(loss)
\ No newline at end of file
+    return tf.reduce_mean(loss)
+
+def configured_contrastive_loss(config):
+    """
+    Contrastive loss with the margin and weights set in the configuration, for model.compile.
+    Args:
+        config: Config whose MARGIN, ALPHA and BETA are passed to contrastive_loss.
+    Returns:
+        contrastive_loss with those arguments bound. It keeps the name contrastive_loss, so
+        saved models still load with custom_objects={'contrastive_loss': contrastive_loss}.
+    """
+    return update_wrapper(
+        partial(contrastive_loss, margin=config.MARGIN, alpha=config.ALPHA, beta=config.BETA),
+        contrastive_loss
+    )
+
+def triplet_loss(positive_scores, negative_scores, margin=0.2):
+    """
+    Triplet loss on Siamese similarity scores.
+    Args:
+        positive_scores: Similarity of each anchor to a genuine signature of the same writer.
+        negative_scores: Similarity of the same anchors to a forged or other-writer signature.
+        margin: How much more similar the genuine pair must be than the forged one.
+    Returns:
+        Triplet loss value.
+    """
+    return tf.reduce_mean(tf.maximum(0.0, negative_scores - positive_scores + margin))
\ No newline at end of file
@@ -1,18 +1,32 @@
+import os
 import matplotlib.pyplot as plt
 import numpy as np
 
 class Visualizer:
     @staticmethod
-    def show_image(image, title="Image", cmap="gray"):
+    def _finish(fig, path=None):
+        """Show the figure, or save it to ``path`` without blocking (headless training nodes)"""
+        if path is None:
+            plt.show()
+            return
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fig.savefig(path, dpi=100)
+        plt.close(fig)
+        print(f"Plot saved to {path}")
+    
+    @staticmethod
+    def show_image(image, title="Image", cmap="gray", path=None):
         """Display a single image"""
-        plt.figure(figsize=(8, 6))
+        fig = plt.figure(figsize=(8, 6))
         plt.imshow(image, cmap=cmap)
         plt.title(title)
         plt.axis('off')
-        plt.show()
+        Visualizer._finish(fig, path)
     
     @staticmethod
-    def show_pair(pair, labels=None, cmap="gray"):
+    def show_pair(pair, labels=None, cmap="gray", path=None):
         """Display a pair of images"""
         fig, axes = plt.subplots(1, 2, figsize=(10, 5))
         
@@ -29,28 +43,59 @@ class Visualizer:
             fig.suptitle(f"Pair: {label_text}")
         
         plt.tight_layout()
-        plt.show()
+        Visualizer._finish(fig, path)
     
     @staticmethod
-    def plot_training_history(history):
+    def plot_training_history(history, path=None):
         """Plot training history"""
         fig, axes = plt.subplots(1, 2, figsize=(12, 4))
         
         # Plot loss
         axes[0].plot(history.history['loss'], label='Training Loss')
-        axes[0].plot(history.history['val_loss'], label='Validation Loss')
+        if 'val_loss' in history.history:
+            axes[0].plot(history.history['val_loss'], label='Validation Loss')
         axes[0].set_title('Model Loss')
         axes[0].set_xlabel('Epoch')
         axes[0].set_ylabel('Loss')
         axes[0].legend()
         
         # Plot accuracy
-        axes[1].plot(history.history['accuracy'], label='Training Accuracy')
-        axes[1].plot(history.history['val_accuracy'], label='Validation Accuracy')
+        if 'accuracy' in history.history:
+            axes[1].plot(history.history['accuracy'], label='Training Accuracy')
+        if 'val_accuracy' in history.history:
+            axes[1].plot(history.history['val_accuracy'], label='Validation Accuracy')
         axes[1].set_title('Model Accuracy')
         axes[1].set_xlabel('Epoch')
         axes[1].set_ylabel('Accuracy')
-        axes[1].legend()
+        if axes[1].lines:
+            axes[1].legend()
+        
+        plt.tight_layout()
+        Visualizer._finish(fig, path)
+    
+    @staticmethod
+    def plot_profile(steps, path=None):
+        """Plot per-step input wait vs. compute time, examples/sec and memory from ProfilingCallback"""
+        index = np.array([step['step'] for step in steps])
+        wait = np.array([step['input_wait_ms'] for step in steps])
+        compute = np.array([step['compute_ms'] for step in steps])
+        rate = np.array([step['examples_per_sec'] for step in steps])
+        rss = np.array([step['rss_mb'] or np.nan for step in steps], dtype=float)
+        fig, axes = plt.subplots(3, 1, figsize=(12, 9), sharex=True)
+        
+        axes[0].stackplot(index, compute, wait, labels=['Compute', 'Input wait'])
+        axes[0].set_title('Step Time')
+        axes[0].set_ylabel('ms')
+        axes[0].legend(loc='upper right')
+        
+        axes[1].plot(index, rate)
+        axes[1].set_title('Throughput')
+        axes[1].set_ylabel('Examples/sec')
+        
+        axes[2].plot(index, rss)
+        axes[2].set_title('Resident Memory')
+        axes[2].set_ylabel('MB')
+        axes[2].set_xlabel('Step')
         
         plt.tight_layout()
-        plt.show()
\ No newline at end of file
+        Visualizer._finish(fig, path)
\ No newline at end of file
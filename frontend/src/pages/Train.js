@@ -224,9 +224,21 @@ const Train = () => {
                     </p>
                   </div>
                   <div className="text-center">
-                    <h4 className="text-lg font-semibold text-white mb-2">Loss</h4>
+                    <h4 className="text-lg font-semibold text-white mb-2">Equal Error Rate</h4>
                     <p className="text-3xl font-bold text-blue-400">
-                      {evaluationResult.loss.toFixed(4)}
+                      {(evaluationResult.eer * 100).toFixed(2)}%
+                    </p>
+                  </div>
+                  <div className="text-center">
+                    <h4 className="text-lg font-semibold text-white mb-2">ROC AUC</h4>
+                    <p className="text-3xl font-bold text-purple-400">
+                      {evaluationResult.auc.toFixed(4)}
+                    </p>
+                  </div>
+                  <div className="text-center">
+                    <h4 className="text-lg font-semibold text-white mb-2">Decision Threshold</h4>
+                    <p className="text-3xl font-bold text-yellow-400">
+                      {evaluationResult.threshold.toFixed(3)}
                     </p>
                   </div>
                 </div>
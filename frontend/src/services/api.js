@@ -56,8 +56,27 @@ export const verifySignatures = async (signature1, signature2) => {
   });
 };
 
-export const trainModel = async () => {
-  return await api.post('/train');
+export const getTrainingJob = async (jobId) => {
+  return await api.get(`/train/${jobId}`);
+};
+
+// Training runs as a background job; poll it until it finishes
+export const trainModel = async (onProgress, pollIntervalMs = 5000) => {
+  const job = await api.post('/train');
+
+  for (;;) {
+    await new Promise((resolve) => setTimeout(resolve, pollIntervalMs));
+    const status = await getTrainingJob(job.job_id);
+    if (onProgress) {
+      onProgress(status);
+    }
+    if (status.status === 'succeeded') {
+      return { ...status, success: true };
+    }
+    if (status.status === 'failed') {
+      return { ...status, success: false };
+    }
+  }
 };
 
 export const evaluateModel = async () => {